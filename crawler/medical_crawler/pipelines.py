@@ -1,38 +1,180 @@
+import queue
+import threading
+import time
+from collections import deque
+
 from pymongo import MongoClient
+from pymongo.errors import BulkWriteError
+from twisted.internet import defer, threads
+
+# Код ошибки MongoDB для нарушения уникального индекса (url уже есть в базе)
+DUPLICATE_KEY = 11000
+
+# Сигнал потоку записи: дописать буфер и завершиться
+_STOP = object()
 
 
 class MongoDBPipeline:
+    """
+    Сохранение статей в MongoDB пачками из отдельного потока.
+
+    process_item только кладёт статью в очередь (MONGO_QUEUE_SIZE) и сразу
+    возвращает её, поэтому запись в MongoDB не задерживает реактор Twisted:
+    загрузка и разбор страниц идут одновременно с записью. Если очередь
+    полна, process_item возвращает Deferred, который сработает, когда поток
+    записи освободит место, - только тогда краулинг ждёт базу.
+
+    Поток записи собирает статьи в пачки и пишет одним неупорядоченным
+    insert_many, когда набралось MONGO_BATCH_SIZE статей или прошло
+    MONGO_FLUSH_INTERVAL секунд с первой статьи пачки, и при закрытии паука.
+    Дубликаты по url выделяются из отчёта BulkWriteError, остальные статьи
+    пачки сохраняются.
+    """
+
     def open_spider(self, spider):
+        # Реактор уже установлен Scrapy (TWISTED_REACTOR): импорт при загрузке
+        # модуля установил бы реактор по умолчанию
+        from twisted.internet import reactor
+
         mongo_uri = spider.settings.get('MONGO_URI', 'mongodb://localhost:27017/')
+        self.batch_size = spider.settings.getint('MONGO_BATCH_SIZE', 100)
+        self.flush_interval = spider.settings.getfloat('MONGO_FLUSH_INTERVAL', 5.0)
         self.client = MongoClient(mongo_uri)
         self.db = self.client['medical_search']
         self.collection = self.db['articles']
-        
+
         self.collection.create_index('url', unique=True)
         self.collection.create_index([('source', 1), ('title', 1)])
-        
+
+        self.spider = spider
+        self.reactor = reactor
+        self.lock = threading.Lock()
+        self.counters = {'inserted': 0, 'duplicate': 0, 'dropped': 0}
+
+        self.queue = queue.Queue(maxsize=spider.settings.getint('MONGO_QUEUE_SIZE', 1000))
+        self.waiting = deque()  # (статья, Deferred) - ждут места в очереди
+        self.thread = threading.Thread(target=self._run, name='mongodb-writer', daemon=True)
+        self.thread.start()
+
         spider.logger.info(f"Подключено к MongoDB: {mongo_uri}")
         spider.logger.info(f"Текущее количество документов: {self.collection.count_documents({})}")
-    
+
     def close_spider(self, spider):
-        total = self.collection.count_documents({})
-        spider.logger.info(f"Закрыто. Всего в БД: {total}")
+        self._enqueue(_STOP)
+        return threads.deferToThread(self._finish).addCallback(self._closed)
+
+    def _finish(self):
+        self.thread.join()
+        return self.collection.count_documents({})
+
+    def _closed(self, total):
+        stats = self.spider.crawler.stats
+        for name, value in self.counters.items():
+            stats.set_value(f'mongodb/{name}', value, spider=self.spider)
+        self.spider.logger.info(f"Сохранено: {self.counters['inserted']}, "
+                                f"дубликатов: {self.counters['duplicate']}, "
+                                f"отброшено: {self.counters['dropped']}")
+        self.spider.logger.info(f"Закрыто. Всего в БД: {total}")
         self.client.close()
-    
+
     def process_item(self, item, spider):
         if not item.get('title') or not item.get('text'):
             spider.logger.debug(f"Пропущено (нет title/text): {item.get('url')}")
+            self._count('dropped')
             return item
-        
+
         if len(item['text']) < 100:
             spider.logger.debug(f"Пропущено (короткий текст): {item.get('url')}")
+            self._count('dropped')
             return item
-        
+
+        waiter = self._enqueue(dict(item))
+        if waiter is None:
+            return item
+        return waiter.addCallback(lambda _: item)
+
+    def _enqueue(self, document):
+        """Положить в очередь; None - сразу, иначе Deferred до появления места"""
+        if not self.waiting:
+            try:
+                self.queue.put_nowait(document)
+                return None
+            except queue.Full:
+                pass
+        waiter = defer.Deferred()
+        self.waiting.append((document, waiter))
+        # Поток записи мог освободить место, пока статья ещё не была в списке
+        self._admit()
+        return waiter
+
+    def _admit(self):
+        """Перенести ожидающие статьи в освободившиеся места очереди (в реакторе)"""
+        while self.waiting:
+            document, waiter = self.waiting[0]
+            try:
+                self.queue.put_nowait(document)
+            except queue.Full:
+                return
+            self.waiting.popleft()
+            waiter.callback(None)
+
+    def _run(self):
+        buffer = []
+        deadline = None
+        while True:
+            timeout = max(deadline - time.monotonic(), 0) if buffer else None
+            try:
+                document = self.queue.get(timeout=timeout)
+            except queue.Empty:
+                document = None
+            else:
+                if self.waiting:
+                    self.reactor.callFromThread(self._admit)
+
+            if document is _STOP:
+                self._write(buffer)
+                return
+            if document is not None:
+                if not buffer:
+                    deadline = time.monotonic() + self.flush_interval
+                buffer.append(document)
+            if buffer and (len(buffer) >= self.batch_size or time.monotonic() >= deadline):
+                self._write(buffer)
+                buffer = []
+
+    def _write(self, documents):
+        """Записать пачку одним insert_many; дубликаты и ошибки - по отчёту"""
+        if not documents:
+            return
+
         try:
-            self.collection.insert_one(dict(item))
-            spider.logger.info(f"Сохранено: {item['title'][:50]}...")
+            inserted = len(self.collection.insert_many(documents, ordered=False).inserted_ids)
+            errors = []
+        except BulkWriteError as e:
+            inserted = e.details.get('nInserted', 0)
+            errors = e.details.get('writeErrors', [])
         except Exception as e:
-            spider.logger.debug(f"Пропущено ({e}): {item.get('url')}")
-        
-        return item
+            self.spider.logger.error(f"Ошибка записи в MongoDB ({e}): потеряно {len(documents)}")
+            self._count('dropped', len(documents))
+            return
+
+        duplicate = 0
+        for error in errors:
+            url = documents[error['index']].get('url')
+            if error.get('code') == DUPLICATE_KEY:
+                duplicate += 1
+                self.spider.logger.debug(f"Пропущено (уже в БД): {url}")
+            else:
+                self.spider.logger.warning(f"Не сохранено ({error.get('errmsg')}): {url}")
+
+        self._count('inserted', inserted)
+        self._count('duplicate', duplicate)
+        self._count('dropped', len(errors) - duplicate)
+        self.spider.logger.info(f"Сохранено {inserted} из {len(documents)} "
+                                f"(дубликатов: {duplicate})")
 
+    def _count(self, name, value=1):
+        # Счётчики меняют и реактор, и поток записи; в статистику Scrapy -
+        # при закрытии паука, из реактора
+        with self.lock:
+            self.counters[name] += value
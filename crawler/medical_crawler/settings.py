@@ -16,6 +16,13 @@ USER_AGENT = 'Medical Research Bot (+misha.zhadnov@student.ru)'
 # MongoDB URI (из Docker environment)
 MONGO_URI = os.getenv('MONGO_URI', 'mongodb://localhost:27017/')
 
+# Статьи пишутся в MongoDB пачками: по MONGO_BATCH_SIZE или раз в
+# MONGO_FLUSH_INTERVAL секунд, если пачка не набралась
+MONGO_BATCH_SIZE = int(os.getenv('MONGO_BATCH_SIZE', 100))
+MONGO_FLUSH_INTERVAL = float(os.getenv('MONGO_FLUSH_INTERVAL', 5))
+# Статей в очереди потока записи; при полной очереди краулинг ждёт запись
+MONGO_QUEUE_SIZE = int(os.getenv('MONGO_QUEUE_SIZE', 1000))
+
 # Pipelines
 ITEM_PIPELINES = {
     'medical_crawler.pipelines.MongoDBPipeline': 300,
@@ -2,8 +2,13 @@
 #include <iostream>
 #include <algorithm>
 #include <cstring>
+#include <cstdio>
+#include <chrono>
+#include <random>
+#include <fcntl.h>
+#include <unistd.h>
 
-Indexer::Indexer() : term_count(0) {}
+Indexer::Indexer() : term_count(0), total_doc_length(0), build_id(0) {}
 
 Indexer::~Indexer() {}
 
@@ -84,21 +89,31 @@ void Indexer::add_document(uint32_t doc_id, const std::string& title,
     std::string full_text = title + " " + text;
     std::vector<std::string> tokens = tokenizer.tokenize(full_text);
     
-    HashMap<bool> added_terms;
+    HashMap<uint32_t> doc_terms;  // term -> частота в документе
+    HashMap<bool> added_words;
+    uint32_t length = 0;
     
     for (const auto& token : tokens) {
+        if (!added_words.contains(token)) {
+            added_words.insert(token, true);
+            word_freq[token]++;
+        }
+        
         std::string term = stemmer.stem(token);
         
         if (term.empty()) continue;
         
-        bool already_added = false;
-        added_terms.find(term, already_added);
-        
-        if (!already_added) {
-            added_terms.insert(term, true);
-            inverted_index[term].push_back(doc_id);
-        }
+        doc_terms[term]++;
+        length++;
+    }
+    
+    // Документы добавляются по возрастанию ID: posting lists остаются отсортированными
+    for (const auto& kv : doc_terms.get_all()) {
+        inverted_index[kv.key].push_back(doc_id);
+        term_freqs[kv.key].push_back(kv.value);
     }
+    doc_lengths.push_back(length);
+    total_doc_length += length;
 }
 
 void Indexer::build_from_json(const std::string& json_file) {
@@ -110,6 +125,14 @@ void Indexer::build_from_json(const std::string& json_file) {
     
     std::cout << "Индексация файла: " << json_file << std::endl;
     
+    // Случайный идентификатор сборки: две сборки с одинаковым числом
+    // документов всё равно различаются
+    std::random_device random;
+    uint64_t now = static_cast<uint64_t>(
+        std::chrono::system_clock::now().time_since_epoch().count());
+    build_id = ((static_cast<uint64_t>(random()) << 32) | random()) ^ now;
+    if (build_id == 0) build_id = 1;
+    
     std::string line;
     uint32_t doc_id = 0;
     uint32_t progress = 0;
@@ -136,14 +159,7 @@ void Indexer::build_from_json(const std::string& json_file) {
     
     std::cout << "\rОбработано документов: " << doc_id << std::endl;
     
-    std::cout << "Сортировка posting lists..." << std::endl;
-    auto all_terms = inverted_index.get_all();
-    term_count = static_cast<uint32_t>(all_terms.size());
-    
-    for (const auto& kv : all_terms) {
-        std::vector<uint32_t>& postings = inverted_index[kv.key];
-        std::sort(postings.begin(), postings.end());
-    }
+    term_count = static_cast<uint32_t>(inverted_index.size());
     
     std::cout << "Индексация завершена:" << std::endl;
     std::cout << "  Документов: " << doc_id << std::endl;
@@ -152,21 +168,42 @@ void Indexer::build_from_json(const std::string& json_file) {
     file.close();
 }
 
+// Сбросить файл (или каталог) на диск
+static bool sync_path(const std::string& path) {
+    int fd = open(path.c_str(), O_RDONLY);
+    if (fd < 0) return false;
+    bool ok = fsync(fd) == 0;
+    close(fd);
+    return ok;
+}
+
 void Indexer::save_to_file(const std::string& index_file) {
-    std::ofstream file(index_file, std::ios::binary);
+    // Индекс пишется во временный файл и подменяет старый через rename:
+    // читатели (веб-сервис) видят либо старую версию, либо новую целиком
+    std::string tmp_file = index_file + ".tmp";
+    std::ofstream file(tmp_file, std::ios::binary);
     if (!file.is_open()) {
-        std::cerr << "Ошибка: не удалось создать файл " << index_file << std::endl;
+        std::cerr << "Ошибка: не удалось создать файл " << tmp_file << std::endl;
         return;
     }
     
     std::cout << "Сохранение индекса в " << index_file << std::endl;
     
+    // Формат версии 3 (все числа little-endian):
+    //   magic u32, version u32, num_terms u32, num_docs u32,
+    //   forward_offset u64, lengths_offset u64, build_id u64
+    //   термы    term_len u32, term, posting_len u32,
+    //            doc_id u32 * posting_len, tf u32 * posting_len
+    //   документы (с forward_offset) id u32, title, url, category, source
+    //   длины    (с lengths_offset) число термов документа u32 * num_docs
+    // Версия 1 - без частот и длин документов (в заголовке вместо lengths_offset ноль),
+    // версии 1 и 2 - без build_id в заголовке
     uint32_t magic = MAGIC;
     uint32_t version = VERSION;
     uint32_t num_terms = term_count;
     uint32_t num_docs = static_cast<uint32_t>(forward_index.size());
     uint64_t forward_offset = 0;
-    uint64_t reserved = 0;
+    uint64_t lengths_offset = 0;
     
     file.write(reinterpret_cast<const char*>(&magic), sizeof(magic));
     file.write(reinterpret_cast<const char*>(&version), sizeof(version));
@@ -175,7 +212,8 @@ void Indexer::save_to_file(const std::string& index_file) {
     
     std::streampos forward_offset_pos = file.tellp();
     file.write(reinterpret_cast<const char*>(&forward_offset), sizeof(forward_offset));
-    file.write(reinterpret_cast<const char*>(&reserved), sizeof(reserved));
+    file.write(reinterpret_cast<const char*>(&lengths_offset), sizeof(lengths_offset));
+    file.write(reinterpret_cast<const char*>(&build_id), sizeof(build_id));
     
     auto all_terms = inverted_index.get_all();
     
@@ -191,6 +229,11 @@ void Indexer::save_to_file(const std::string& index_file) {
         file.write(reinterpret_cast<const char*>(&posting_len), sizeof(posting_len));
         file.write(reinterpret_cast<const char*>(kv.value.data()), 
                    posting_len * sizeof(uint32_t));
+        
+        std::vector<uint32_t> freqs;
+        term_freqs.find(kv.key, freqs);
+        freqs.resize(posting_len, 1);
+        file.write(reinterpret_cast<const char*>(freqs.data()), posting_len * sizeof(uint32_t));
     }
     
     forward_offset = static_cast<uint64_t>(file.tellp());
@@ -219,14 +262,177 @@ void Indexer::save_to_file(const std::string& index_file) {
         file.write(doc.source.c_str(), src_len);
     }
     
+    lengths_offset = static_cast<uint64_t>(file.tellp());
+    std::vector<uint32_t> lengths(doc_lengths);
+    lengths.resize(num_docs, 0);
+    file.write(reinterpret_cast<const char*>(lengths.data()), num_docs * sizeof(uint32_t));
+    
     file.seekp(forward_offset_pos);
     file.write(reinterpret_cast<const char*>(&forward_offset), sizeof(forward_offset));
+    file.write(reinterpret_cast<const char*>(&lengths_offset), sizeof(lengths_offset));
     
     file.close();
+    if (file.fail() || !sync_path(tmp_file)) {
+        std::cerr << "Ошибка: не удалось записать файл " << tmp_file << std::endl;
+        std::remove(tmp_file.c_str());
+        return;
+    }
+    
+    if (std::rename(tmp_file.c_str(), index_file.c_str()) != 0) {
+        std::cerr << "Ошибка: не удалось переименовать " << tmp_file << " в " << index_file << std::endl;
+        std::remove(tmp_file.c_str());
+        return;
+    }
+    
+    // Запись о переименовании в каталоге тоже должна пережить сбой
+    size_t slash = index_file.rfind('/');
+    sync_path(slash == std::string::npos ? "." : index_file.substr(0, slash + 1));
     
     std::cout << "Индекс сохранён (" << forward_offset << " байт)" << std::endl;
 }
 
+// Триграммы словоформы для нечёткого поиска: по кодовым точкам UTF-8, слово
+// дополнено нулём с обеих сторон ("$слово$"), триграмма - три кодовые точки
+// по 21 биту в одном u64. Повторы внутри слова убраны
+static std::vector<uint64_t> word_trigrams(const std::string& word) {
+    std::vector<uint64_t> points = {0};
+    for (size_t i = 0; i < word.size();) {
+        unsigned char c = static_cast<unsigned char>(word[i]);
+        int length = c < 0x80 ? 1 : (c >> 5) == 0x6 ? 2 : (c >> 4) == 0xE ? 3 : (c >> 3) == 0x1E ? 4 : 1;
+        if (i + length > word.size()) length = 1;
+        uint64_t point = length == 1 ? c : c & (0xFF >> (length + 1));
+        for (int k = 1; k < length; k++) {
+            point = (point << 6) | (static_cast<unsigned char>(word[i + k]) & 0x3F);
+        }
+        points.push_back(point);
+        i += length;
+    }
+    points.push_back(0);
+    
+    std::vector<uint64_t> grams;
+    for (size_t i = 0; i + 2 < points.size(); i++) {
+        grams.push_back((points[i] << 42) | (points[i + 1] << 21) | points[i + 2]);
+    }
+    std::sort(grams.begin(), grams.end());
+    grams.erase(std::unique(grams.begin(), grams.end()), grams.end());
+    return grams;
+}
+
+void Indexer::save_suggest_file(const std::string& suggest_file, uint32_t min_df) {
+    // Формат (все числа little-endian):
+    //   magic u32, version u32, num_words u32, leaves u32, num_docs u32, reserved u32,
+    //   build_id u64                    - сборка индекса (get_build_id)
+    //   offsets u32 * (num_words + 1)   - начало словоформы в блоке строк
+    //   df      u32 * num_words         - число документов
+    //   tree    u32 * (2 * leaves)      - дерево отрезков: в узле номер словоформы
+    //                                     с наибольшим df на его отрезке
+    //   строки  словоформы подряд, отсортированы побайтово
+    //   нули до границы 8 байт
+    //   num_grams u32, num_postings u32
+    //   grams   u64 * num_grams         - триграммы (word_trigrams) по возрастанию
+    //   gram_offsets u32 * (num_grams + 1) - начало списка триграммы в postings
+    //   postings u32 * num_postings     - номера словоформ с триграммой, по возрастанию
+    // Словоформы с общим префиксом идут подряд, поэтому подсказки - двоичный
+    // поиск отрезка и выбор k максимумов df на нём по дереву. Триграммы дают
+    // кандидатов для исправления опечаток без просмотра всего словаря
+    std::vector<std::pair<std::string, uint32_t>> words;
+    for (const auto& kv : word_freq.get_all()) {
+        if (kv.value >= min_df) {
+            words.push_back({kv.key, kv.value});
+        }
+    }
+    std::sort(words.begin(), words.end(),
+              [](const auto& a, const auto& b) { return a.first < b.first; });
+    
+    uint32_t num_words = static_cast<uint32_t>(words.size());
+    uint32_t leaves = 1;
+    while (leaves < num_words) leaves *= 2;
+    
+    const uint32_t NONE = 0xFFFFFFFF;
+    std::vector<uint32_t> tree(2 * leaves, NONE);
+    for (uint32_t i = 0; i < num_words; i++) {
+        tree[leaves + i] = i;
+    }
+    for (uint32_t node = leaves - 1; node >= 1; node--) {
+        uint32_t left = tree[2 * node];
+        uint32_t right = tree[2 * node + 1];
+        // При равном df - словоформа меньше по алфавиту (левая)
+        if (right == NONE || (left != NONE && words[left].second >= words[right].second)) {
+            tree[node] = left;
+        } else {
+            tree[node] = right;
+        }
+    }
+    
+    std::vector<uint32_t> offsets;
+    std::vector<uint32_t> dfs;
+    uint32_t offset = 0;
+    for (const auto& word : words) {
+        offsets.push_back(offset);
+        dfs.push_back(word.second);
+        offset += static_cast<uint32_t>(word.first.size());
+    }
+    offsets.push_back(offset);
+    
+    std::vector<std::pair<uint64_t, uint32_t>> pairs;
+    for (uint32_t i = 0; i < num_words; i++) {
+        for (uint64_t gram : word_trigrams(words[i].first)) {
+            pairs.push_back({gram, i});
+        }
+    }
+    std::sort(pairs.begin(), pairs.end());
+    
+    std::vector<uint64_t> grams;
+    std::vector<uint32_t> gram_offsets;
+    std::vector<uint32_t> postings;
+    for (const auto& pair : pairs) {
+        if (grams.empty() || grams.back() != pair.first) {
+            grams.push_back(pair.first);
+            gram_offsets.push_back(static_cast<uint32_t>(postings.size()));
+        }
+        postings.push_back(pair.second);
+    }
+    gram_offsets.push_back(static_cast<uint32_t>(postings.size()));
+    
+    std::string tmp_file = suggest_file + ".tmp";
+    std::ofstream file(tmp_file, std::ios::binary);
+    if (!file.is_open()) {
+        std::cerr << "Ошибка: не удалось создать файл " << tmp_file << std::endl;
+        return;
+    }
+    
+    uint32_t header[6] = {SUGGEST_MAGIC, SUGGEST_VERSION, num_words, leaves,
+                          static_cast<uint32_t>(forward_index.size()), 0};
+    file.write(reinterpret_cast<const char*>(header), sizeof(header));
+    file.write(reinterpret_cast<const char*>(&build_id), sizeof(build_id));
+    file.write(reinterpret_cast<const char*>(offsets.data()), offsets.size() * sizeof(uint32_t));
+    file.write(reinterpret_cast<const char*>(dfs.data()), dfs.size() * sizeof(uint32_t));
+    file.write(reinterpret_cast<const char*>(tree.data()), tree.size() * sizeof(uint32_t));
+    for (const auto& word : words) {
+        file.write(word.first.data(), word.first.size());
+    }
+    
+    size_t written = sizeof(header) + sizeof(build_id) + (offsets.size() + dfs.size() + tree.size()) * sizeof(uint32_t) + offset;
+    const char padding[8] = {0};
+    file.write(padding, (8 - written % 8) % 8);
+    uint32_t gram_header[2] = {static_cast<uint32_t>(grams.size()),
+                               static_cast<uint32_t>(postings.size())};
+    file.write(reinterpret_cast<const char*>(gram_header), sizeof(gram_header));
+    file.write(reinterpret_cast<const char*>(grams.data()), grams.size() * sizeof(uint64_t));
+    file.write(reinterpret_cast<const char*>(gram_offsets.data()), gram_offsets.size() * sizeof(uint32_t));
+    file.write(reinterpret_cast<const char*>(postings.data()), postings.size() * sizeof(uint32_t));
+    file.close();
+    
+    if (file.fail() || !sync_path(tmp_file) ||
+        std::rename(tmp_file.c_str(), suggest_file.c_str()) != 0) {
+        std::cerr << "Ошибка: не удалось записать файл " << suggest_file << std::endl;
+        std::remove(tmp_file.c_str());
+        return;
+    }
+    
+    std::cout << "Словарь подсказок сохранён: " << num_words << " словоформ" << std::endl;
+}
+
 void Indexer::load_from_file(const std::string& index_file) {
     std::ifstream file(index_file, std::ios::binary);
     if (!file.is_open()) {
@@ -236,29 +442,35 @@ void Indexer::load_from_file(const std::string& index_file) {
     
     // Читаем заголовок
     uint32_t magic, version, num_terms, num_docs;
-    uint64_t forward_offset, reserved;
+    uint64_t forward_offset, lengths_offset;
     
     file.read(reinterpret_cast<char*>(&magic), sizeof(magic));
     file.read(reinterpret_cast<char*>(&version), sizeof(version));
     file.read(reinterpret_cast<char*>(&num_terms), sizeof(num_terms));
     file.read(reinterpret_cast<char*>(&num_docs), sizeof(num_docs));
     file.read(reinterpret_cast<char*>(&forward_offset), sizeof(forward_offset));
-    file.read(reinterpret_cast<char*>(&reserved), sizeof(reserved));
+    file.read(reinterpret_cast<char*>(&lengths_offset), sizeof(lengths_offset));
     
     if (magic != MAGIC) {
         std::cerr << "Ошибка: неверный формат файла индекса" << std::endl;
         return;
     }
     
-    if (version != VERSION) {
+    if (version < 1 || version > VERSION) {
         std::cerr << "Ошибка: неподдерживаемая версия индекса" << std::endl;
         return;
     }
     
+    build_id = 0;
+    if (version >= 3) {
+        file.read(reinterpret_cast<char*>(&build_id), sizeof(build_id));
+    }
+    
     term_count = num_terms;
     
     // Читаем инвертированный индекс
     inverted_index.clear();
+    term_freqs.clear();
     
     for (uint32_t i = 0; i < num_terms; i++) {
         // Длина терма
@@ -278,6 +490,11 @@ void Indexer::load_from_file(const std::string& index_file) {
         file.read(reinterpret_cast<char*>(postings.data()), posting_len * sizeof(uint32_t));
         
         inverted_index.insert(term, postings);
+        
+        if (version >= 2) {
+            file.read(reinterpret_cast<char*>(postings.data()), posting_len * sizeof(uint32_t));
+            term_freqs.insert(term, postings);
+        }
     }
     
     // Читаем прямой индекс
@@ -317,6 +534,17 @@ void Indexer::load_from_file(const std::string& index_file) {
         forward_index.push_back(doc);
     }
     
+    doc_lengths.clear();
+    total_doc_length = 0;
+    if (version >= 2) {
+        doc_lengths.resize(num_docs);
+        file.seekg(static_cast<std::streamoff>(lengths_offset));
+        file.read(reinterpret_cast<char*>(doc_lengths.data()), num_docs * sizeof(uint32_t));
+        for (uint32_t length : doc_lengths) {
+            total_doc_length += length;
+        }
+    }
+    
     file.close();
     
     std::cout << "Индекс загружен: " << num_docs << " документов, " 
@@ -336,6 +564,22 @@ std::vector<uint32_t> Indexer::search_term(const std::string& term) {
     return result;
 }
 
+std::vector<uint32_t> Indexer::search_term_freqs(const std::string& term) {
+    std::vector<std::string> tokens = tokenizer.tokenize(term);
+    if (tokens.empty()) return {};
+    
+    std::string stemmed = stemmer.stem(tokens[0]);
+    
+    std::vector<uint32_t> result;
+    if (!term_freqs.find(stemmed, result)) {
+        // Индекс без частот: каждый терм встречается в документе один раз
+        inverted_index.find(stemmed, result);
+        std::fill(result.begin(), result.end(), 1);
+    }
+    
+    return result;
+}
+
 Document Indexer::get_document(uint32_t doc_id) const {
     if (doc_id < forward_index.size()) {
         return forward_index[doc_id];
@@ -40,6 +40,14 @@ public:
      */
     void save_to_file(const std::string& index_file);
     
+    /**
+     * Сохранить словарь подсказок (словоформы с частотами и их триграммы)
+     * для автодополнения и исправления опечаток
+     * @param suggest_file - путь к файлу index.suggest
+     * @param min_df - минимальное число документов со словоформой
+     */
+    void save_suggest_file(const std::string& suggest_file, uint32_t min_df = 2);
+    
     /**
      * Загрузить индекс из бинарного файла
      * @param index_file - путь к файлу index.bin
@@ -53,6 +61,13 @@ public:
      */
     std::vector<uint32_t> search_term(const std::string& term);
     
+    /**
+     * Частоты термина в документах - в том же порядке, что search_term
+     * (для индекса версии 1, где частот нет, - единицы)
+     * @param term - термин для поиска (будет обработан токенизатором и стеммером)
+     */
+    std::vector<uint32_t> search_term_freqs(const std::string& term);
+    
     /**
      * Получить документ по ID
      * @param doc_id - ID документа
@@ -70,6 +85,27 @@ public:
      */
     uint32_t get_term_count() const { return term_count; }
     
+    /**
+     * Идентификатор сборки индекса: пишется в index.bin и в словарь подсказок,
+     * чтобы файлы одной сборки можно было отличить от файлов другой
+     * (0 - индекс версии 1-2, без идентификатора)
+     */
+    uint64_t get_build_id() const { return build_id; }
+    
+    /**
+     * Длина документа в термах (0, если длины не сохранены - индекс версии 1)
+     */
+    uint32_t get_doc_length(uint32_t doc_id) const {
+        return doc_id < doc_lengths.size() ? doc_lengths[doc_id] : 0;
+    }
+    
+    /**
+     * Средняя длина документа в термах (0 для индекса версии 1)
+     */
+    double get_avg_doc_length() const {
+        return doc_lengths.empty() ? 0.0 : static_cast<double>(total_doc_length) / doc_lengths.size();
+    }
+    
     /**
      * Получить все термы с их частотами (для анализа Ципфа)
      */
@@ -77,12 +113,17 @@ public:
     
 private:
     HashMap<std::vector<uint32_t>> inverted_index;  // term -> [doc_ids]
+    HashMap<std::vector<uint32_t>> term_freqs;      // term -> [tf], параллельно inverted_index
+    std::vector<uint32_t> doc_lengths;              // doc_id -> число термов
+    HashMap<uint32_t> word_freq;                    // словоформа -> число документов
     std::vector<Document> forward_index;            // doc_id -> document
     
     Tokenizer tokenizer;
     Stemmer stemmer;
     
     uint32_t term_count;
+    uint64_t total_doc_length;
+    uint64_t build_id;
     
     /**
      * Добавить документ в индекс
@@ -98,7 +139,10 @@ private:
     
     // Магическое число для проверки формата файла
     static constexpr uint32_t MAGIC = 0x5849444D;  // "MIDX"
-    static constexpr uint32_t VERSION = 1;
+    static constexpr uint32_t VERSION = 3;
+    
+    static constexpr uint32_t SUGGEST_MAGIC = 0x4755534D;  // "MSUG"
+    static constexpr uint32_t SUGGEST_VERSION = 3;
 };
 
 #endif // INDEXER_HPP
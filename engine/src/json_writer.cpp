@@ -0,0 +1,66 @@
+#include "json_writer.hpp"
+
+std::string json_string(const std::string& value) {
+    static const char* hex = "0123456789abcdef";
+    
+    std::string result;
+    result.reserve(value.size() + 2);
+    result += '"';
+    
+    for (char c : value) {
+        unsigned char uc = static_cast<unsigned char>(c);
+        switch (c) {
+            case '"':  result += "\\\""; break;
+            case '\\': result += "\\\\"; break;
+            case '\n': result += "\\n"; break;
+            case '\r': result += "\\r"; break;
+            case '\t': result += "\\t"; break;
+            default:
+                if (uc < 0x20) {
+                    result += "\\u00";
+                    result += hex[uc >> 4];
+                    result += hex[uc & 0x0F];
+                } else {
+                    result += c;
+                }
+        }
+    }
+    
+    result += '"';
+    return result;
+}
+
+std::string json_header(const std::string& query, size_t total, size_t hits, long long search_us,
+                        const std::vector<uint32_t>* ids, bool truncated) {
+    std::string result = "{\"type\":\"header\",\"query\":";
+    result += json_string(query);
+    result += ",\"total\":" + std::to_string(total);
+    result += ",\"hits\":" + std::to_string(hits);
+    result += ",\"search_us\":" + std::to_string(search_us);
+    if (truncated) {
+        result += ",\"truncated\":true";
+    }
+    
+    if (ids) {
+        result += ",\"ids\":[";
+        for (size_t i = 0; i < ids->size(); i++) {
+            if (i > 0) result += ',';
+            result += std::to_string((*ids)[i]);
+        }
+        result += "]";
+    }
+    
+    result += "}";
+    return result;
+}
+
+std::string json_hit(size_t rank, const Document& doc) {
+    std::string result = "{\"type\":\"hit\",\"rank\":" + std::to_string(rank);
+    result += ",\"id\":" + std::to_string(doc.id);
+    result += ",\"title\":" + json_string(doc.title);
+    result += ",\"url\":" + json_string(doc.url);
+    result += ",\"category\":" + json_string(doc.category);
+    result += ",\"source\":" + json_string(doc.source);
+    result += "}";
+    return result;
+}
@@ -0,0 +1,36 @@
+#ifndef JSON_WRITER_HPP
+#define JSON_WRITER_HPP
+
+#include <string>
+#include <vector>
+#include <cstdint>
+#include "indexer.hpp"
+
+/**
+ * Экранировать строку для вставки в JSON (без внешних библиотек)
+ * Байты UTF-8 передаются как есть, управляющие символы - через \uXXXX
+ * @param value - исходная строка
+ * @return строка в кавычках
+ */
+std::string json_string(const std::string& value);
+
+/**
+ * Запись-заголовок ответа на запрос (одна строка JSON)
+ * @param query - текст запроса
+ * @param total - сколько всего документов найдено
+ * @param hits - сколько записей hit последует за заголовком
+ * @param search_us - время выполнения запроса в микросекундах
+ * @param ids - полный список ID найденных документов (nullptr - не выводить)
+ * @param truncated - запрос остановлен по времени, результат неполный
+ */
+std::string json_header(const std::string& query, size_t total, size_t hits, long long search_us,
+                        const std::vector<uint32_t>* ids = nullptr, bool truncated = false);
+
+/**
+ * Запись об одном найденном документе (одна строка JSON)
+ * @param rank - позиция в выдаче, начиная с 1
+ * @param doc - документ из прямого индекса
+ */
+std::string json_hit(size_t rank, const Document& doc);
+
+#endif // JSON_WRITER_HPP
@@ -10,6 +10,7 @@ void print_usage(const char* program) {
     std::cout << "Опции:" << std::endl;
     std::cout << "  --input=FILE     Входной JSON файл (corpus.json)" << std::endl;
     std::cout << "  --output=FILE    Выходной файл индекса (index.bin)" << std::endl;
+    std::cout << "  --suggest=FILE   Также сохранить словарь подсказок (index.suggest)" << std::endl;
     std::cout << "  --stats          Вывести статистику термов" << std::endl;
     std::cout << "  --help           Показать эту справку" << std::endl;
     std::cout << std::endl;
@@ -20,6 +21,7 @@ void print_usage(const char* program) {
 int main(int argc, char* argv[]) {
     std::string input_file;
     std::string output_file;
+    std::string suggest_file;
     bool show_stats = false;
     
     for (int i = 1; i < argc; i++) {
@@ -32,6 +34,8 @@ int main(int argc, char* argv[]) {
             input_file = arg.substr(8);
         } else if (arg.find("--output=") == 0) {
             output_file = arg.substr(9);
+        } else if (arg.find("--suggest=") == 0) {
+            suggest_file = arg.substr(10);
         } else if (arg == "--stats") {
             show_stats = true;
         } else {
@@ -72,6 +76,9 @@ int main(int argc, char* argv[]) {
         }
     }
     
+    if (!suggest_file.empty()) {
+        indexer.save_suggest_file(suggest_file);
+    }
     indexer.save_to_file(output_file);
     
     auto save_end = std::chrono::high_resolution_clock::now();
@@ -1,8 +1,13 @@
 #include <iostream>
 #include <string>
 #include <chrono>
+#include <algorithm>
 #include "indexer.hpp"
 #include "searcher.hpp"
+#include "json_writer.hpp"
+
+// Сколько лучших документов упорядочивается по BM25, если не задано --depth
+const size_t DEFAULT_RANK_DEPTH = 1000;
 
 void print_usage(const char* program) {
     std::cout << "Использование: " << program << " [опции]" << std::endl;
@@ -12,6 +17,14 @@ void print_usage(const char* program) {
     std::cout << "  --query=QUERY    Поисковый запрос (однократный режим)" << std::endl;
     std::cout << "  --batch          Пакетный режим: запросы из stdin" << std::endl;
     std::cout << "  --limit=N        Максимальное количество результатов (по умолчанию 50)" << std::endl;
+    std::cout << "  --format=FMT     Формат вывода: text (по умолчанию) или jsonl" << std::endl;
+    std::cout << "  --ids            Вывести в заголовке jsonl полный список ID документов" << std::endl;
+    std::cout << "  --docs=ID,ID     Вывести документы по ID (вместо запроса)" << std::endl;
+    std::cout << "  --ranked         Упорядочить найденное по BM25 (по умолчанию - по ID)" << std::endl;
+    std::cout << "  --depth=N        Сколько лучших документов упорядочить по BM25 (по умолчанию "
+              << DEFAULT_RANK_DEPTH << ")" << std::endl;
+    std::cout << "  --budget-ms=N    Время на запрос: по истечении вычисление останавливается," << std::endl;
+    std::cout << "                   результат неполный (по умолчанию без ограничения)" << std::endl;
     std::cout << "  --help           Показать эту справку" << std::endl;
     std::cout << std::endl;
     std::cout << "Примеры:" << std::endl;
@@ -19,6 +32,23 @@ void print_usage(const char* program) {
     std::cout << "  " << program << " --index=data/index.bin --query=\"диабет && лечение\"" << std::endl;
     std::cout << "  cat queries.txt | " << program << " --index=data/index.bin --batch" << std::endl;
     std::cout << std::endl;
+    std::cout << "Пакетный режим:" << std::endl;
+    std::cout << "  Каждая строка stdin - отдельный запрос. Перед запросом можно указать" << std::endl;
+    std::cout << "  опции через табуляцию: \"limit=10 ids=1<TAB>диабет\"," << std::endl;
+    std::cout << "  ранжирование BM25 - \"rank=bm25 depth=N\" (rank=none - по ID)," << std::endl;
+    std::cout << "  время на запрос - \"budget_ms=N\"." << std::endl;
+    std::cout << "  Строка \":docs ID ID ...\" (без опций) выводит документы по ID без поиска;" << std::endl;
+    std::cout << "  после опций с табуляцией тот же текст - обычный запрос." << std::endl;
+    std::cout << "  Строка \":batch N\" (без ответа) объединяет следующие N запросов в пакет:" << std::endl;
+    std::cout << "  общие для них термы ищутся в индексе один раз." << std::endl;
+    std::cout << "  Ответ на каждый запрос завершается строкой \"---\"." << std::endl;
+    std::cout << std::endl;
+    std::cout << "Формат jsonl (одна JSON-запись на строку):" << std::endl;
+    std::cout << "  {\"type\":\"ready\",...}   - индекс загружен (только в пакетном режиме)" << std::endl;
+    std::cout << "  {\"type\":\"header\",...}  - запрос, total, hits, search_us" << std::endl;
+    std::cout << "                           (truncated: true - запрос остановлен по времени)" << std::endl;
+    std::cout << "  {\"type\":\"hit\",...}     - документ; за заголовком следует ровно hits таких записей" << std::endl;
+    std::cout << std::endl;
     std::cout << "Синтаксис запросов:" << std::endl;
     std::cout << "  term1 term2      - AND (неявное)" << std::endl;
     std::cout << "  term1 && term2   - AND (явное)" << std::endl;
@@ -27,8 +57,12 @@ void print_usage(const char* program) {
     std::cout << "  (term1 || term2) && term3 - скобки" << std::endl;
 }
 
-void print_results(Indexer& indexer, const std::vector<uint32_t>& results, int limit) {
+void print_results(Indexer& indexer, const std::vector<uint32_t>& results, int limit,
+                   bool truncated) {
     std::cout << "Найдено: " << results.size() << " документов" << std::endl;
+    if (truncated) {
+        std::cout << "Время запроса истекло: результат неполный" << std::endl;
+    }
     
     int count = 0;
     for (uint32_t doc_id : results) {
@@ -49,10 +83,171 @@ void print_results(Indexer& indexer, const std::vector<uint32_t>& results, int l
     }
 }
 
+void print_results_jsonl(Indexer& indexer, const std::string& query,
+                         const std::vector<uint32_t>& results, int limit, long long search_us,
+                         bool with_ids, bool truncated) {
+    size_t hits = results.size();
+    if (limit >= 0 && hits > static_cast<size_t>(limit)) {
+        hits = static_cast<size_t>(limit);
+    }
+    
+    std::cout << json_header(query, results.size(), hits, search_us,
+                             with_ids ? &results : nullptr, truncated) << '\n';
+    for (size_t i = 0; i < hits; i++) {
+        std::cout << json_hit(i + 1, indexer.get_document(results[i])) << '\n';
+    }
+    std::cout << std::flush;
+}
+
+/**
+ * Разобрать список ID документов, разделённых пробелами или запятыми
+ * ID вне индекса пропускаются
+ */
+std::vector<uint32_t> parse_doc_ids(const std::string& text, uint32_t doc_count) {
+    std::vector<uint32_t> result;
+    
+    size_t pos = 0;
+    while (pos < text.size()) {
+        while (pos < text.size() && (text[pos] == ' ' || text[pos] == ',')) pos++;
+        
+        size_t end = pos;
+        uint64_t value = 0;
+        while (end < text.size() && text[end] >= '0' && text[end] <= '9') {
+            value = value * 10 + static_cast<uint64_t>(text[end] - '0');
+            if (value > UINT32_MAX) value = UINT32_MAX;
+            end++;
+        }
+        
+        if (end == pos) {
+            // Не число - пропустить символ
+            pos++;
+            continue;
+        }
+        
+        if (value < doc_count) {
+            result.push_back(static_cast<uint32_t>(value));
+        }
+        pos = end;
+    }
+    
+    return result;
+}
+
+/**
+ * Опции запроса (командной строки или строки пакетного режима)
+ */
+struct BatchOptions {
+    int limit;      // Сколько документов вывести
+    bool ids;       // Вывести полный список ID (только jsonl)
+    bool ranked;    // Упорядочить по BM25
+    size_t depth;   // Сколько лучших документов упорядочить по BM25
+    uint32_t budget_ms;  // Время на запрос (0 - без ограничения)
+};
+
+/**
+ * Управляющая строка ":docs ID ID ..." (вся строка, без опций запроса)
+ */
+bool is_docs_command(const std::string& line) {
+    return line == ":docs" || line.compare(0, 6, ":docs ") == 0;
+}
+
+/**
+ * Выполнить запрос пакетного режима или команду ":docs ID ID ..."
+ * @param docs_command - query - команда :docs (is_docs_command для всей строки);
+ *                       текст запроса из строки с опциями командой не бывает
+ * @param search_us - время выполнения в микросекундах
+ * @param truncated - запрос остановлен по истечении options.budget_ms
+ */
+std::vector<uint32_t> run_batch_query(Searcher& searcher, Indexer& indexer,
+                                      const std::string& query, const BatchOptions& options,
+                                      long long& search_us, bool& truncated,
+                                      bool docs_command = false) {
+    truncated = false;
+    if (docs_command) {
+        search_us = 0;
+        return parse_doc_ids(query.substr(5), indexer.get_doc_count());
+    }
+    
+    auto start = std::chrono::high_resolution_clock::now();
+    searcher.set_time_budget(options.budget_ms);
+    std::vector<uint32_t> results;
+    if (options.ranked) {
+        // Выводимые документы упорядочены по оценке, даже если limit больше depth
+        size_t depth = std::max(options.depth, static_cast<size_t>(std::max(options.limit, 0)));
+        results = searcher.search_ranked(query, depth);
+    } else {
+        results = searcher.search(query);
+    }
+    auto end = std::chrono::high_resolution_clock::now();
+    search_us = std::chrono::duration_cast<std::chrono::microseconds>(end - start).count();
+    truncated = searcher.truncated();
+    
+    return results;
+}
+
+/**
+ * Разобрать строку пакетного режима: "[опции<TAB>]запрос"
+ * Опции разделяются пробелами: limit=N, ids=1, rank=bm25|none, depth=N, budget_ms=N
+ * @return текст запроса без опций
+ */
+std::string parse_batch_line(const std::string& line, BatchOptions& batch_options) {
+    size_t tab = line.find('\t');
+    if (tab == std::string::npos) {
+        return line;
+    }
+    
+    std::string options = line.substr(0, tab);
+    if (options.find('=') == std::string::npos) {
+        return line;
+    }
+    
+    size_t pos = 0;
+    while (pos < options.size()) {
+        size_t end = options.find(' ', pos);
+        if (end == std::string::npos) end = options.size();
+        std::string option = options.substr(pos, end - pos);
+        
+        if (option.find("limit=") == 0) {
+            try {
+                batch_options.limit = std::stoi(option.substr(6));
+            } catch (const std::exception&) {
+                // Некорректное значение - оставить лимит по умолчанию
+            }
+        } else if (option == "ids=1") {
+            batch_options.ids = true;
+        } else if (option == "rank=bm25") {
+            batch_options.ranked = true;
+        } else if (option == "rank=none") {
+            batch_options.ranked = false;
+        } else if (option.find("depth=") == 0) {
+            try {
+                batch_options.depth = static_cast<size_t>(std::stoul(option.substr(6)));
+            } catch (const std::exception&) {
+                // Некорректное значение - оставить глубину по умолчанию
+            }
+        } else if (option.find("budget_ms=") == 0) {
+            try {
+                batch_options.budget_ms = static_cast<uint32_t>(std::stoul(option.substr(10)));
+            } catch (const std::exception&) {
+                // Некорректное значение - оставить время по умолчанию
+            }
+        }
+        pos = end + 1;
+    }
+    
+    return line.substr(tab + 1);
+}
+
 int main(int argc, char* argv[]) {
     std::string index_file;
     std::string query;
     bool batch_mode = false;
+    bool jsonl = false;
+    bool with_ids = false;
+    bool ranked = false;
+    size_t depth = DEFAULT_RANK_DEPTH;
+    uint32_t budget_ms = 0;
+    std::string doc_ids;
     int limit = 50;
     
     for (int i = 1; i < argc; i++) {
@@ -69,6 +264,24 @@ int main(int argc, char* argv[]) {
             batch_mode = true;
         } else if (arg.find("--limit=") == 0) {
             limit = std::stoi(arg.substr(8));
+        } else if (arg == "--ids") {
+            with_ids = true;
+        } else if (arg == "--ranked") {
+            ranked = true;
+        } else if (arg.find("--depth=") == 0) {
+            depth = static_cast<size_t>(std::stoul(arg.substr(8)));
+        } else if (arg.find("--budget-ms=") == 0) {
+            budget_ms = static_cast<uint32_t>(std::stoul(arg.substr(12)));
+        } else if (arg.find("--docs=") == 0) {
+            doc_ids = arg.substr(7);
+        } else if (arg.find("--format=") == 0) {
+            std::string format = arg.substr(9);
+            if (format == "jsonl") {
+                jsonl = true;
+            } else if (format != "text") {
+                std::cerr << "Неизвестный формат: " << format << std::endl;
+                return 1;
+            }
         } else {
             std::cerr << "Неизвестная опция: " << arg << std::endl;
             print_usage(argv[0]);
@@ -81,7 +294,14 @@ int main(int argc, char* argv[]) {
     }
     
     Indexer indexer;
-    indexer.load_from_file(index_file);
+    if (jsonl) {
+        // В режиме jsonl stdout содержит только JSON: сообщения загрузки - в stderr
+        std::streambuf* stdout_buf = std::cout.rdbuf(std::cerr.rdbuf());
+        indexer.load_from_file(index_file);
+        std::cout.rdbuf(stdout_buf);
+    } else {
+        indexer.load_from_file(index_file);
+    }
     
     if (indexer.get_doc_count() == 0) {
         std::cerr << "Ошибка: индекс пуст или не загружен" << std::endl;
@@ -90,42 +310,91 @@ int main(int argc, char* argv[]) {
     
     Searcher searcher(&indexer);
     
-    if (!query.empty()) {
+    bool docs_command = !doc_ids.empty();
+    if (docs_command) {
+        query = ":docs " + doc_ids;
+    }
+    
+    BatchOptions query_options = {limit, with_ids, ranked, depth, budget_ms};
+    
+    if (!query.empty() && jsonl) {
+        long long search_us = 0;
+        bool truncated = false;
+        std::vector<uint32_t> results = run_batch_query(searcher, indexer, query, query_options,
+                                                        search_us, truncated, docs_command);
+        
+        print_results_jsonl(indexer, query, results, limit, search_us, with_ids, truncated);
+        
+    } else if (!query.empty()) {
         std::cout << "Запрос: " << query << std::endl;
         std::cout << "----------------------------------------" << std::endl;
         
-        auto start = std::chrono::high_resolution_clock::now();
-        std::vector<uint32_t> results = searcher.search(query);
-        auto end = std::chrono::high_resolution_clock::now();
-        auto duration = std::chrono::duration_cast<std::chrono::microseconds>(end - start);
+        long long search_us = 0;
+        bool truncated = false;
+        std::vector<uint32_t> results = run_batch_query(searcher, indexer, query, query_options,
+                                                        search_us, truncated, docs_command);
         
-        print_results(indexer, results, limit);
+        print_results(indexer, results, limit, truncated);
         
-        std::cout << "Время поиска: " << duration.count() << " мкс" << std::endl;
+        std::cout << "Время поиска: " << search_us << " мкс" << std::endl;
         
     } else if (batch_mode) {
+        if (jsonl) {
+            std::cout << "{\"type\":\"ready\",\"docs\":" << indexer.get_doc_count()
+                      << ",\"terms\":" << indexer.get_term_count() << "}" << std::endl;
+        }
+        
         std::string line;
+        int batch_remaining = 0;
         while (std::getline(std::cin, line)) {
             if (line.empty()) continue;
             
-            std::cout << "Q: " << line << std::endl;
+            if (line.compare(0, 6, ":batch") == 0) {
+                try {
+                    batch_remaining = std::stoi(line.substr(6));
+                } catch (const std::exception&) {
+                    batch_remaining = 0;
+                }
+                searcher.set_term_cache(batch_remaining > 0);
+                continue;
+            }
+            
+            // ":docs" - только управляющая строка целиком, как ":batch": запрос
+            // после опций ("limit=N<TAB>:docs 1 2") остаётся обычным поиском
+            bool docs_line = is_docs_command(line);
+            BatchOptions batch_options = query_options;
+            std::string batch_query = docs_line ? line : parse_batch_line(line, batch_options);
+            
+            long long search_us = 0;
+            bool truncated = false;
+            std::vector<uint32_t> results = run_batch_query(searcher, indexer, batch_query,
+                                                            batch_options, search_us, truncated,
+                                                            docs_line);
             
-            auto start = std::chrono::high_resolution_clock::now();
-            std::vector<uint32_t> results = searcher.search(line);
-            auto end = std::chrono::high_resolution_clock::now();
-            auto duration = std::chrono::duration_cast<std::chrono::microseconds>(end - start);
+            if (batch_remaining > 0 && --batch_remaining == 0) {
+                searcher.set_term_cache(false);
+            }
+            
+            if (jsonl) {
+                print_results_jsonl(indexer, batch_query, results, batch_options.limit,
+                                    search_us, batch_options.ids, truncated);
+                continue;
+            }
             
+            std::cout << "Q: " << batch_query << '\n';
             std::cout << "R: " << results.size() << " документов (" 
-                      << duration.count() << " мкс)" << std::endl;
+                      << search_us << " мкс" << (truncated ? ", неполный" : "") << ")" << '\n';
             
             int count = 0;
             for (uint32_t doc_id : results) {
-                if (count >= limit) break;
+                if (count >= batch_options.limit) break;
                 Document doc = indexer.get_document(doc_id);
-                std::cout << "   - " << doc.title << std::endl;
+                std::cout << "   - " << doc.title << '\n';
                 count++;
             }
             
+            // Сбросить буфер только в конце ответа: читатель на другом конце pipe
+            // ждёт целый ответ, а не отдельные строки
             std::cout << "---" << std::endl;
         }
         
@@ -149,13 +418,14 @@ int main(int argc, char* argv[]) {
             
             if (line.empty()) continue;
             
-            auto start = std::chrono::high_resolution_clock::now();
-            std::vector<uint32_t> results = searcher.search(line);
-            auto end = std::chrono::high_resolution_clock::now();
-            auto duration = std::chrono::duration_cast<std::chrono::microseconds>(end - start);
+            long long search_us = 0;
+            bool truncated = false;
+            std::vector<uint32_t> results = run_batch_query(searcher, indexer, line, query_options,
+                                                            search_us, truncated,
+                                                            is_docs_command(line));
             
-            print_results(indexer, results, limit);
-            std::cout << "Время: " << duration.count() << " мкс" << std::endl;
+            print_results(indexer, results, limit, truncated);
+            std::cout << "Время: " << search_us << " мкс" << std::endl;
             std::cout << std::endl;
         }
     }
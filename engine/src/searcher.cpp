@@ -2,11 +2,48 @@
 #include "tokenizer.hpp"
 #include "stemmer.hpp"
 #include <algorithm>
+#include <cmath>
 #include <iostream>
 
-Searcher::Searcher(Indexer* idx) : indexer(idx) {}
+Searcher::Searcher(Indexer* idx)
+    : indexer(idx), cache_terms(false), term_cache(1021), has_deadline(false),
+      was_truncated(false) {}
+
+void Searcher::set_time_budget(uint32_t budget_ms) {
+    has_deadline = budget_ms > 0;
+    deadline = std::chrono::steady_clock::now() + std::chrono::milliseconds(budget_ms);
+}
+
+bool Searcher::expired() {
+    if (!has_deadline) return false;
+    if (!was_truncated && std::chrono::steady_clock::now() >= deadline) {
+        was_truncated = true;
+    }
+    return was_truncated;
+}
+
+void Searcher::set_term_cache(bool enabled) {
+    cache_terms = enabled;
+    if (!enabled) {
+        term_cache.clear();
+    }
+}
+
+std::vector<uint32_t> Searcher::lookup_term(const std::string& term) {
+    if (!cache_terms) {
+        return indexer->search_term(term);
+    }
+    
+    std::vector<uint32_t> result;
+    if (!term_cache.find(term, result)) {
+        result = indexer->search_term(term);
+        term_cache.insert(term, result);
+    }
+    return result;
+}
 
 std::vector<uint32_t> Searcher::search(const std::string& query) {
+    was_truncated = false;
     QueryNode* root = parser.parse(query);
     
     if (!root) {
@@ -15,25 +52,151 @@ std::vector<uint32_t> Searcher::search(const std::string& query) {
         std::vector<std::string> tokens = tokenizer.tokenize(query);
         if (tokens.empty()) return {};
         
-        std::vector<uint32_t> result = indexer->search_term(tokens[0]);
+        std::vector<uint32_t> result = lookup_term(tokens[0]);
         
         for (size_t i = 1; i < tokens.size() && !result.empty(); i++) {
-            std::vector<uint32_t> next = indexer->search_term(tokens[i]);
-            result = intersect(result, next);
+            if (expired()) return {};
+            std::vector<uint32_t> next = lookup_term(tokens[i]);
+            result = intersect(result, next, this);
         }
         
         return result;
     }
     
-    std::vector<uint32_t> result = execute(root);
+    bool all = false;
+    std::vector<uint32_t> result = execute(root, false, all);
     delete root;
     
     return result;
 }
 
-std::vector<uint32_t> Searcher::execute(QueryNode* node) {
+std::vector<uint32_t> Searcher::search_ranked(const std::string& query, size_t depth) {
+    std::vector<uint32_t> results = search(query);
+    if (results.empty() || depth == 0 || expired()) return results;
+    
+    // Ключи термов - как их ищет search: без дерева токен стеммируется
+    // в search_term, в узле TERM - ещё и перед lookup_term
+    std::vector<std::string> terms;
+    QueryNode* root = parser.parse(query);
+    if (root) {
+        collect_scoring_terms(root, terms);
+        delete root;
+    } else {
+        Tokenizer tokenizer;
+        for (const auto& token : tokenizer.tokenize(query)) {
+            if (std::find(terms.begin(), terms.end(), token) == terms.end()) {
+                terms.push_back(token);
+            }
+        }
+    }
+    
+    std::vector<double> scores = score(results, terms);
+    if (expired()) return results;
+    
+    // Куча худших из отобранных: в вершине документ, который вытесняется первым.
+    // Номера в results возрастают вместе с ID, поэтому при равной оценке выше меньший ID
+    auto before = [&scores](uint32_t a, uint32_t b) {
+        return scores[a] > scores[b] || (scores[a] == scores[b] && a < b);
+    };
+    std::vector<uint32_t> heap;
+    heap.reserve(std::min(depth, results.size()));
+    for (uint32_t i = 0; i < results.size(); i++) {
+        if (heap.size() < depth) {
+            heap.push_back(i);
+            std::push_heap(heap.begin(), heap.end(), before);
+        } else if (before(i, heap.front())) {
+            std::pop_heap(heap.begin(), heap.end(), before);
+            heap.back() = i;
+            std::push_heap(heap.begin(), heap.end(), before);
+        }
+    }
+    std::sort_heap(heap.begin(), heap.end(), before);
+    
+    std::vector<bool> taken(results.size(), false);
+    std::vector<uint32_t> ranked;
+    ranked.reserve(results.size());
+    for (uint32_t i : heap) {
+        ranked.push_back(results[i]);
+        taken[i] = true;
+    }
+    for (uint32_t i = 0; i < results.size(); i++) {
+        if (!taken[i]) ranked.push_back(results[i]);
+    }
+    
+    return ranked;
+}
+
+void Searcher::collect_scoring_terms(QueryNode* node, std::vector<std::string>& terms) {
+    if (!node || node->type == NodeType::NOT) return;
+    
+    if (node->type == NodeType::TERM) {
+        Tokenizer tokenizer;
+        Stemmer stemmer;
+        
+        std::vector<std::string> tokens = tokenizer.tokenize(node->term);
+        if (tokens.empty()) return;
+        
+        std::string stemmed = stemmer.stem(tokens[0]);
+        if (std::find(terms.begin(), terms.end(), stemmed) == terms.end()) {
+            terms.push_back(stemmed);
+        }
+        return;
+    }
+    
+    collect_scoring_terms(node->left, terms);
+    collect_scoring_terms(node->right, terms);
+}
+
+std::vector<double> Searcher::score(const std::vector<uint32_t>& results,
+                                    const std::vector<std::string>& terms) {
+    std::vector<double> scores(results.size(), 0.0);
+    
+    double num_docs = indexer->get_doc_count();
+    double avg_length = indexer->get_avg_doc_length();
+    
+    for (const auto& term : terms) {
+        std::vector<uint32_t> postings = lookup_term(term);
+        if (postings.empty()) continue;
+        std::vector<uint32_t> freqs = indexer->search_term_freqs(term);
+        
+        double df = static_cast<double>(postings.size());
+        double idf = std::log(1.0 + (num_docs - df + 0.5) / (df + 0.5));
+        
+        // Слияние двух отсортированных списков: results и posting list терма
+        size_t i = 0, j = 0, steps = 0;
+        while (i < results.size() && j < postings.size()) {
+            if (++steps % BUDGET_CHECK_STEPS == 0 && expired()) return {};
+            if (results[i] < postings[j]) {
+                i++;
+            } else if (results[i] > postings[j]) {
+                j++;
+            } else {
+                double tf = freqs[j];
+                // Без длин документов (индекс версии 1) - как у документа средней длины
+                double norm = avg_length > 0
+                    ? 1.0 - BM25_B + BM25_B * indexer->get_doc_length(results[i]) / avg_length
+                    : 1.0;
+                scores[i] += idf * tf * (BM25_K1 + 1.0) / (tf + BM25_K1 * norm);
+                i++;
+                j++;
+            }
+        }
+    }
+    
+    return scores;
+}
+
+std::vector<uint32_t> Searcher::execute(QueryNode* node, bool negated, bool& all) {
+    all = false;
     if (!node) return {};
     
+    if (expired()) {
+        // Невычисленное поддерево: без отрицания - ничего, под отрицанием -
+        // вся коллекция. Так неполный результат - подмножество точного
+        all = negated;
+        return {};
+    }
+    
     switch (node->type) {
         case NodeType::TERM: {
             Tokenizer tokenizer;
@@ -43,39 +206,69 @@ std::vector<uint32_t> Searcher::execute(QueryNode* node) {
             if (tokens.empty()) return {};
             
             std::string stemmed = stemmer.stem(tokens[0]);
-            return indexer->search_term(stemmed);
+            return lookup_term(stemmed);
         }
         
         case NodeType::AND: {
-            std::vector<uint32_t> left = execute(node->left);
-            if (left.empty()) return {};
+            bool left_all = false, right_all = false;
+            std::vector<uint32_t> left = execute(node->left, negated, left_all);
+            if (!left_all && left.empty()) return {};
             
-            std::vector<uint32_t> right = execute(node->right);
-            return intersect(left, right);
+            std::vector<uint32_t> right = execute(node->right, negated, right_all);
+            if (left_all) {
+                all = right_all;
+                return right;
+            }
+            if (right_all) return left;
+            return finish(intersect(left, right, this), negated, all);
         }
         
         case NodeType::OR: {
-            std::vector<uint32_t> left = execute(node->left);
-            std::vector<uint32_t> right = execute(node->right);
-            return union_lists(left, right);
+            bool left_all = false, right_all = false;
+            std::vector<uint32_t> left = execute(node->left, negated, left_all);
+            std::vector<uint32_t> right = execute(node->right, negated, right_all);
+            if (left_all || right_all) {
+                all = true;
+                return {};
+            }
+            return finish(union_lists(left, right, this), negated, all);
         }
         
         case NodeType::NOT: {
-            std::vector<uint32_t> operand = execute(node->left);
-            return negate(operand);
+            bool operand_all = false;
+            std::vector<uint32_t> operand = execute(node->left, !negated, operand_all);
+            if (operand_all) return {};
+            if (expired()) {
+                all = negated;
+                return {};
+            }
+            return finish(negate(operand), negated, all);
         }
     }
     
     return {};
 }
 
+std::vector<uint32_t> Searcher::finish(std::vector<uint32_t> result, bool negated, bool& all) {
+    // Прерванная по сроку операция отдала начало результата - подмножество
+    // точного. Под отрицанием нужно надмножество: узел считается
+    // невычисленным, как и при проверке перед ним
+    if (negated && expired()) {
+        all = true;
+        return {};
+    }
+    return result;
+}
+
 std::vector<uint32_t> Searcher::intersect(const std::vector<uint32_t>& list1,
-                                          const std::vector<uint32_t>& list2) {
+                                          const std::vector<uint32_t>& list2,
+                                          Searcher* budget) {
     std::vector<uint32_t> result;
     
-    size_t i = 0, j = 0;
+    size_t i = 0, j = 0, steps = 0;
     
     while (i < list1.size() && j < list2.size()) {
+        if (budget && ++steps % BUDGET_CHECK_STEPS == 0 && budget->expired()) break;
         if (list1[i] == list2[j]) {
             result.push_back(list1[i]);
             i++;
@@ -91,13 +284,15 @@ std::vector<uint32_t> Searcher::intersect(const std::vector<uint32_t>& list1,
 }
 
 std::vector<uint32_t> Searcher::union_lists(const std::vector<uint32_t>& list1,
-                                            const std::vector<uint32_t>& list2) {
+                                            const std::vector<uint32_t>& list2,
+                                            Searcher* budget) {
     std::vector<uint32_t> result;
     result.reserve(list1.size() + list2.size());
     
-    size_t i = 0, j = 0;
+    size_t i = 0, j = 0, steps = 0;
     
     while (i < list1.size() || j < list2.size()) {
+        if (budget && ++steps % BUDGET_CHECK_STEPS == 0 && budget->expired()) break;
         if (i >= list1.size()) {
             result.push_back(list2[j++]);
         } else if (j >= list2.size()) {
@@ -123,6 +318,7 @@ std::vector<uint32_t> Searcher::negate(const std::vector<uint32_t>& list) {
     size_t list_idx = 0;
     
     for (uint32_t doc_id = 0; doc_id < total_docs; doc_id++) {
+        if ((doc_id + 1) % BUDGET_CHECK_STEPS == 0 && expired()) break;
         while (list_idx < list.size() && list[list_idx] < doc_id) {
             list_idx++;
         }
@@ -3,8 +3,10 @@
 
 #include <vector>
 #include <cstdint>
+#include <chrono>
 #include "indexer.hpp"
 #include "query_parser.hpp"
+#include "hashmap.hpp"
 
 /**
  * Класс для выполнения булевого поиска
@@ -24,31 +26,122 @@ public:
      */
     std::vector<uint32_t> search(const std::string& query);
     
+    /**
+     * Поиск с ранжированием BM25. Булев запрос отбирает документы, из них
+     * depth лучших по BM25 идут первыми (по убыванию оценки, при равной оценке -
+     * по возрастанию ID), остальные найденные - следом по возрастанию ID.
+     * Лучшие выбираются кучей на depth элементов, без сортировки всей выдачи.
+     * Оценку дают термы запроса вне отрицаний
+     * @param query - строка запроса
+     * @param depth - сколько документов упорядочить по оценке
+     * @return все найденные ID документов в порядке выдачи
+     */
+    std::vector<uint32_t> search_ranked(const std::string& query, size_t depth);
+    
+    // Параметры BM25: насыщение частоты терма и нормализация по длине документа
+    static constexpr double BM25_K1 = 1.2;
+    static constexpr double BM25_B = 0.75;
+    
     /**
      * Пересечение двух отсортированных списков (AND)
+     * @param budget - поиск, срок которого проверяется каждые BUDGET_CHECK_STEPS
+     *                 шагов; по истечении возвращается уже найденное начало
+     *                 результата (nullptr - без проверки)
      */
     static std::vector<uint32_t> intersect(const std::vector<uint32_t>& list1,
-                                           const std::vector<uint32_t>& list2);
+                                           const std::vector<uint32_t>& list2,
+                                           Searcher* budget = nullptr);
     
     /**
      * Объединение двух отсортированных списков (OR)
+     * @param budget - как в intersect
      */
     static std::vector<uint32_t> union_lists(const std::vector<uint32_t>& list1,
-                                             const std::vector<uint32_t>& list2);
+                                             const std::vector<uint32_t>& list2,
+                                             Searcher* budget = nullptr);
     
     /**
-     * Отрицание списка (NOT) - все документы кроме указанных
+     * Отрицание списка (NOT) - все документы кроме указанных. Срок запроса
+     * проверяется, как в intersect
      */
     std::vector<uint32_t> negate(const std::vector<uint32_t>& list);
     
+    /**
+     * Включить или выключить кэш posting lists термов (пакет запросов).
+     * Пока кэш включён, терм, общий для нескольких запросов, ищется в индексе
+     * один раз; при выключении кэш очищается
+     */
+    void set_term_cache(bool enabled);
+    
+    /**
+     * Количество термов в кэше
+     */
+    size_t term_cache_size() const { return term_cache.size(); }
+    
+    /**
+     * Ограничить время следующих запросов. Срок проверяется перед каждым
+     * узлом дерева запроса и каждые BUDGET_CHECK_STEPS шагов внутри
+     * пересечения, объединения, отрицания и оценки BM25; после него
+     * оставшиеся узлы не вычисляются, и результат неполный: в нём только
+     * документы, которые точно подходят под запрос (без ранжирования, если
+     * срок истёк до его завершения)
+     * @param budget_ms - миллисекунды от текущего момента (0 - без ограничения)
+     */
+    void set_time_budget(uint32_t budget_ms);
+    
+    /**
+     * Был ли последний запрос остановлен по истечении срока
+     */
+    bool truncated() const { return was_truncated; }
+    
 private:
     Indexer* indexer;
     QueryParser parser;
+    bool cache_terms;
+    HashMap<std::vector<uint32_t>> term_cache;  // term -> [doc_ids]
+    bool has_deadline;
+    std::chrono::steady_clock::time_point deadline;
+    bool was_truncated;
+    
+    // Как часто внутри циклов по posting lists сверяться с часами
+    static constexpr size_t BUDGET_CHECK_STEPS = 4096;
+    
+    /**
+     * Истёк ли срок запроса (отмечает результат как неполный)
+     */
+    bool expired();
+    
+    /**
+     * Indexer::search_term с учётом кэша термов
+     */
+    std::vector<uint32_t> lookup_term(const std::string& term);
     
     /**
      * Рекурсивное выполнение запроса по дереву
+     * @param negated - узел под нечётным числом отрицаний
+     * @param all - результат - вся коллекция (только если срок истёк под
+     *              отрицанием: так после отрицания остаётся подмножество ответа)
+     */
+    std::vector<uint32_t> execute(QueryNode* node, bool negated, bool& all);
+    
+    /**
+     * Результат операции узла с учётом срока: под отрицанием прерванная
+     * операция даёт всю коллекцию (all), иначе - своё начало
+     */
+    std::vector<uint32_t> finish(std::vector<uint32_t> result, bool negated, bool& all);
+    
+    /**
+     * Термы, которые дают оценку BM25: ключи для lookup_term из узлов TERM
+     * вне отрицаний, без повторов
+     */
+    void collect_scoring_terms(QueryNode* node, std::vector<std::string>& terms);
+    
+    /**
+     * Оценки BM25 документов results (отсортированных) по термам terms;
+     * пустой вектор, если срок запроса истёк
      */
-    std::vector<uint32_t> execute(QueryNode* node);
+    std::vector<double> score(const std::vector<uint32_t>& results,
+                              const std::vector<std::string>& terms);
 };
 
 #endif // SEARCHER_HPP
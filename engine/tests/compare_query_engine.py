@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+"""
+Сверка QueryEngine (web/query_engine.py) с C++ searcher.
+
+QueryEngine повторяет семантику Searcher на Python: токенизатор, стеммер,
+разбор запроса, И/ИЛИ/НЕ и BM25. Скрипт строит индекс из синтетического
+корпуса (русские словоформы, латиница, числа, пунктуация), выполняет
+фиксированный набор запросов в searcher --batch --format=jsonl и в
+QueryEngine и сравнивает полные списки ID - булевы и ранжированные по BM25,
+а также документы первых позиций выдачи из IndexReader.
+
+Запуск из engine/ (make test_query_engine):
+    python3 tests/compare_query_engine.py [./indexer] [./searcher]
+"""
+
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'web'))
+
+from index_reader import IndexReader  # noqa: E402
+from query_engine import QueryEngine  # noqa: E402
+from searcher_pool import ResponseParser, format_request  # noqa: E402
+
+SEED = 20240501
+NUM_DOCS = 3000
+RANK_DEPTHS = (1, 10, 200)
+HITS = 5
+
+# Словоформы разных окончаний: ключи термов после стемминга должны совпасть
+WORDS = [
+    'лечение', 'лечения', 'лечением', 'лечить', 'лечат', 'сердце', 'сердца', 'сердечный',
+    'сердечная', 'болезнь', 'болезни', 'болезней', 'врач', 'врача', 'врачи', 'диабет',
+    'диабета', 'диабетом', 'кардиология', 'кардиологии', 'мозг', 'мозга', 'головной',
+    'боль', 'боли', 'дети', 'детей', 'детская', 'ёлка', 'елка', 'терапия', 'терапии',
+    'давление', 'давления', 'анализ', 'анализы', 'крови', 'кровь', 'инсульт', 'инфаркт',
+    'heart', 'hearts', 'disease', 'diseases', 'treatment', 'treated', 'brain', 'health',
+    'COVID-19', 'ВИЧ', 'B12', 'Омега-3', 'x-ray', 'МРТ', '2023', '120/80', 'а', 'и', 'в',
+]
+
+PUNCTUATION = ['', '', '', ',', '.', ':', ';', '!', '?', ' -', ' (', ')', '"']
+
+QUERIES = [
+    'лечение', 'лечения', 'Лечение', 'ЛЕЧЕНИЕ', 'сердце', 'сердечный', 'heart', 'Hearts',
+    'диабет лечение', 'диабет && лечение', 'диабет || лечение', '!диабет',
+    'сердце && !болезнь', '!(сердце || мозг)', '(сердце || мозг) && (боль || давление)',
+    '!(диабет && !лечение) && врач', 'heart || brain || health', 'heart disease treatment',
+    'COVID-19', 'covid', '19', 'ВИЧ', 'b12', 'омега', 'x-ray', 'ёлка', 'елка', '2023',
+    '120/80', 'а', 'и || в', 'нетакогослова', 'нетакогослова || сердце',
+    'сердце && нетакогослова', '!нетакогослова', '', '   ', '&&', '||', '!', '()',
+    'сердце &&', '|| мозг', '(сердце', 'сердце)', '((мозг))', 'сердце ! мозг',
+    'сердце,мозг', 'сердце-мозг', '"сердце"', 'лечение && (диабет || !инсульт)',
+]
+
+
+def make_corpus(path, num_docs, rng):
+    with open(path, 'w', encoding='utf-8') as f:
+        for doc_id in range(num_docs):
+            def text(low, high):
+                return ' '.join(rng.choice(WORDS) + rng.choice(PUNCTUATION)
+                                for _ in range(rng.randint(low, high)))
+            document = {
+                # Документ без заголовка, но с текстом, тоже попадает в индекс
+                'title': text(1, 6) if doc_id % 17 else '',
+                'text': text(5, 120),
+                'url': f'http://test/{doc_id}',
+                'source': rng.choice(['a', 'b', 'c']),
+                'category': rng.choice(['Кардиология', 'Неврология', '']),
+            }
+            f.write(json.dumps(document, ensure_ascii=False) + '\n')
+
+
+def make_queries(rng, count):
+    """Случайные запросы по словарю корпуса с операторами, скобками и отрицаниями"""
+    def expression(depth):
+        if depth == 0 or rng.random() < 0.3:
+            word = rng.choice(WORDS)
+            return ('!' + word) if rng.random() < 0.15 else word
+        left, right = expression(depth - 1), expression(depth - 1)
+        operator = rng.choice([' && ', ' || ', ' '])
+        result = left + operator + right
+        if rng.random() < 0.4:
+            result = '(' + result + ')'
+        if rng.random() < 0.15:
+            result = '!(' + result + ')'
+        return result
+
+    return [expression(rng.randint(1, 4)) for _ in range(count)]
+
+
+class Searcher:
+    """searcher --batch --format=jsonl: один процесс на все запросы"""
+
+    def __init__(self, searcher_path, index_path):
+        self.process = subprocess.Popen(
+            [searcher_path, f'--index={index_path}', '--batch', '--format=jsonl'],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+
+    def search(self, query, rank_depth=0):
+        self.process.stdin.write(format_request(query, HITS, with_ids=True,
+                                                rank_depth=rank_depth))
+        self.process.stdin.flush()
+        parser = ResponseParser()
+        while True:
+            line = self.process.stdout.readline()
+            if not line:
+                raise RuntimeError('searcher завершился')
+            if parser.feed(line):
+                return parser.result()
+
+    def close(self):
+        self.process.stdin.close()
+        self.process.wait()
+
+
+def compare(reader, searcher, query, rank_depth):
+    """Описание расхождения или None"""
+    expected = searcher.search(query, rank_depth)
+    engine = QueryEngine(reader)
+    # format_request схлопывает пробелы - QueryEngine получает тот же текст.
+    # searcher упорядочивает не меньше limit документов (main_searcher.cpp)
+    text = ' '.join(query.split())
+    if rank_depth:
+        found = engine.search_ranked(text, max(rank_depth, HITS))
+    else:
+        found = engine.search(text)
+    found = found.tolist()
+
+    if found != expected['ids']:
+        mode = f'bm25 depth={rank_depth}' if rank_depth else 'boolean'
+        first = next((i for i, (a, b) in enumerate(zip(found, expected['ids'])) if a != b),
+                     min(len(found), len(expected['ids'])))
+        return (f'{query!r} ({mode}): QueryEngine {len(found)} документов, '
+                f'searcher {len(expected["ids"])}, первое различие на позиции {first}')
+
+    documents = reader.documents(found[:HITS])
+    for document, hit in zip(documents, expected['documents']):
+        for field in ('id', 'title', 'url', 'category', 'source'):
+            if document.get(field) != hit.get(field):
+                return (f'{query!r}: документ {hit.get("id")}, поле {field}: '
+                        f'{document.get(field)!r} и {hit.get(field)!r}')
+    return None
+
+
+def main():
+    indexer_path = sys.argv[1] if len(sys.argv) > 1 else './indexer'
+    searcher_path = sys.argv[2] if len(sys.argv) > 2 else './searcher'
+    rng = random.Random(SEED)
+
+    with tempfile.TemporaryDirectory() as directory:
+        corpus_path = os.path.join(directory, 'corpus.json')
+        index_path = os.path.join(directory, 'index.bin')
+        make_corpus(corpus_path, NUM_DOCS, rng)
+        subprocess.run([indexer_path, f'--input={corpus_path}', f'--output={index_path}'],
+                       check=True, stdout=subprocess.DEVNULL)
+
+        queries = QUERIES + make_queries(rng, 300)
+        reader = IndexReader(index_path)
+        searcher = Searcher(searcher_path, index_path)
+        mismatches = []
+        try:
+            for query in queries:
+                for rank_depth in (0,) + RANK_DEPTHS:
+                    mismatch = compare(reader, searcher, query, rank_depth)
+                    if mismatch:
+                        mismatches.append(mismatch)
+        finally:
+            searcher.close()
+            reader.close()
+
+    checks = len(queries) * (1 + len(RANK_DEPTHS))
+    if mismatches:
+        for mismatch in mismatches[:20]:
+            print(f'FAIL {mismatch}')
+        print(f'QueryEngine расходится с searcher: {len(mismatches)} из {checks} проверок')
+        return 1
+    print(f'QueryEngine совпадает с searcher: {len(queries)} запросов, {checks} проверок')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -2,12 +2,19 @@
 #include <cassert>
 #include <vector>
 #include <string>
+#include <fstream>
+#include <cstdio>
+#include <cstring>
+#include <algorithm>
+#include <chrono>
+#include <thread>
 #include "../src/tokenizer.hpp"
 #include "../src/stemmer.hpp"
 #include "../src/hashmap.hpp"
 #include "../src/indexer.hpp"
 #include "../src/searcher.hpp"
 #include "../src/query_parser.hpp"
+#include "../src/json_writer.hpp"
 
 // ========== Тесты токенизатора ==========
 
@@ -209,6 +216,204 @@ void test_union_empty() {
     std::cout << " test_union_empty" << std::endl;
 }
 
+void test_searcher_term_cache() {
+    const char* path = "/tmp/test_searcher_corpus.json";
+    {
+        std::ofstream out(path);
+        out << "{\"title\": \"Heart\", \"text\": \"heart disease treatment\", \"url\": \"u1\"}\n";
+        out << "{\"title\": \"Brain\", \"text\": \"brain disease\", \"url\": \"u2\"}\n";
+        out << "{\"title\": \"Heart brain\", \"text\": \"heart and brain\", \"url\": \"u3\"}\n";
+    }
+    
+    Indexer indexer;
+    indexer.build_from_json(path);
+    std::remove(path);
+    
+    Searcher searcher(&indexer);
+    auto expected_and = searcher.search("heart brain");
+    auto expected_or = searcher.search("heart || disease");
+    
+    searcher.set_term_cache(true);
+    assert(searcher.search("heart brain") == expected_and);
+    assert(searcher.search("heart || disease") == expected_or);
+    assert(searcher.search("heart brain") == expected_and);
+    assert(searcher.term_cache_size() == 3);
+    
+    searcher.set_term_cache(false);
+    assert(searcher.term_cache_size() == 0);
+    assert(searcher.search("heart brain") == expected_and);
+    std::cout << " test_searcher_term_cache" << std::endl;
+}
+
+void test_searcher_ranked() {
+    const char* path = "/tmp/test_ranked_corpus.json";
+    const char* index = "/tmp/test_ranked_index.bin";
+    {
+        std::ofstream out(path);
+        out << "{\"title\": \"Heart\", \"text\": \"heart disease\", \"url\": \"u1\"}\n";
+        out << "{\"title\": \"Brain\", \"text\": \"heart brain disease treatment\", \"url\": \"u2\"}\n";
+        out << "{\"title\": \"Heart\", \"text\": \"heart heart\", \"url\": \"u3\"}\n";
+        out << "{\"title\": \"Brain\", \"text\": \"brain\", \"url\": \"u4\"}\n";
+    }
+    
+    Indexer indexer;
+    indexer.build_from_json(path);
+    std::remove(path);
+    
+    assert((indexer.search_term_freqs("heart") == std::vector<uint32_t>{2, 1, 3}));
+    assert(indexer.get_doc_length(1) == 5);
+    
+    Searcher searcher(&indexer);
+    // Частый терм в коротком документе выше; документы вне depth - следом по ID
+    assert((searcher.search_ranked("heart", 10) == std::vector<uint32_t>{2, 0, 1}));
+    assert((searcher.search_ranked("heart", 1) == std::vector<uint32_t>{2, 0, 1}));
+    assert((searcher.search_ranked("heart", 0) == searcher.search("heart")));
+    assert((searcher.search_ranked("heart && !brain", 10) == std::vector<uint32_t>{2, 0}));
+    // ИЛИ: оценки термов складываются, документ с обоими термами выше
+    assert((searcher.search_ranked("brain || disease", 10) == std::vector<uint32_t>{1, 3, 0}));
+    
+    // Частоты и длины переживают сохранение и загрузку
+    indexer.save_to_file(index);
+    Indexer loaded;
+    loaded.load_from_file(index);
+    std::remove(index);
+    Searcher loaded_searcher(&loaded);
+    assert((loaded.search_term_freqs("heart") == std::vector<uint32_t>{2, 1, 3}));
+    assert(loaded.get_avg_doc_length() == indexer.get_avg_doc_length());
+    assert(loaded.get_build_id() != 0 && loaded.get_build_id() == indexer.get_build_id());
+    assert((loaded_searcher.search_ranked("heart", 10) == std::vector<uint32_t>{2, 0, 1}));
+    std::cout << " test_searcher_ranked" << std::endl;
+}
+
+void test_searcher_time_budget() {
+    const char* path = "/tmp/test_budget_corpus.json";
+    {
+        std::ofstream out(path);
+        out << "{\"title\": \"A\", \"text\": \"heart disease\", \"url\": \"u1\"}\n";
+        out << "{\"title\": \"B\", \"text\": \"brain disease\", \"url\": \"u2\"}\n";
+        out << "{\"title\": \"C\", \"text\": \"heart brain\", \"url\": \"u3\"}\n";
+    }
+    
+    Indexer indexer;
+    indexer.build_from_json(path);
+    std::remove(path);
+    
+    Searcher searcher(&indexer);
+    searcher.set_time_budget(60000);
+    assert((searcher.search("heart || brain") == std::vector<uint32_t>{0, 1, 2}));
+    assert(!searcher.truncated());
+    
+    // Срок истёк до начала: ничего не вычислено, в том числе под отрицанием
+    searcher.set_time_budget(1);
+    std::this_thread::sleep_for(std::chrono::milliseconds(5));
+    assert(searcher.search("heart || brain").empty());
+    assert(searcher.truncated());
+    assert(searcher.search("!heart").empty());
+    assert(searcher.search("disease && !(heart || brain)").empty());
+    assert(searcher.search("heart disease").empty());
+    assert((searcher.search_ranked("heart", 10).empty()));
+    assert(searcher.truncated());
+    
+    searcher.set_time_budget(0);
+    assert((searcher.search("disease && !heart") == std::vector<uint32_t>{1}));
+    assert(!searcher.truncated());
+    
+    // Срок проверяется и внутри слияния длинных списков: остаётся начало результата
+    std::vector<uint32_t> evens, odds;
+    for (uint32_t i = 0; i < 100000; i++) {
+        (i % 2 ? odds : evens).push_back(i);
+    }
+    searcher.set_time_budget(1);
+    std::this_thread::sleep_for(std::chrono::milliseconds(5));
+    std::vector<uint32_t> merged = Searcher::union_lists(evens, odds, &searcher);
+    assert(!merged.empty() && merged.size() < 100000);
+    for (uint32_t i = 0; i < merged.size(); i++) {
+        assert(merged[i] == i);
+    }
+    std::vector<uint32_t> common = Searcher::intersect(evens, evens, &searcher);
+    assert(common.size() < evens.size());
+    assert(std::equal(common.begin(), common.end(), evens.begin()));
+    assert(Searcher::union_lists(evens, odds).size() == 100000);
+    std::cout << " test_searcher_time_budget" << std::endl;
+}
+
+// ========== Тесты словаря подсказок ==========
+
+void test_indexer_suggest_file() {
+    const char* corpus = "/tmp/test_suggest_corpus.json";
+    const char* suggest = "/tmp/test_index.suggest";
+    {
+        std::ofstream out(corpus);
+        out << "{\"title\": \"Heart\", \"text\": \"heart health heal\", \"url\": \"u1\"}\n";
+        out << "{\"title\": \"Health\", \"text\": \"health heal\", \"url\": \"u2\"}\n";
+        out << "{\"title\": \"Health\", \"text\": \"heart brain once\", \"url\": \"u3\"}\n";
+    }
+    
+    Indexer indexer;
+    indexer.build_from_json(corpus);
+    indexer.save_suggest_file(suggest, 2);
+    std::remove(corpus);
+    
+    std::ifstream in(suggest, std::ios::binary);
+    std::vector<char> data((std::istreambuf_iterator<char>(in)), std::istreambuf_iterator<char>());
+    in.close();
+    std::remove(suggest);
+    
+    const uint32_t* header = reinterpret_cast<const uint32_t*>(data.data());
+    uint32_t num_words = header[2];
+    uint32_t leaves = header[3];
+    assert(header[0] == 0x4755534D);
+    assert(header[1] == 3);
+    assert(header[4] == 3);
+    // Идентификатор сборки - тот же, что попадёт в index.bin
+    uint64_t build_id;
+    std::memcpy(&build_id, data.data() + 6 * sizeof(uint32_t), sizeof(build_id));
+    assert(build_id != 0 && build_id == indexer.get_build_id());
+    // "brain" и "once" встречаются в одном документе и не попадают в словарь
+    assert(num_words == 3);
+    assert(leaves == 4);
+    
+    const uint32_t* offsets = header + 8;
+    const uint32_t* dfs = offsets + num_words + 1;
+    const uint32_t* tree = dfs + num_words;
+    const char* strings = reinterpret_cast<const char*>(tree + 2 * leaves);
+    
+    std::vector<std::string> words;
+    for (uint32_t i = 0; i < num_words; i++) {
+        words.push_back(std::string(strings + offsets[i], offsets[i + 1] - offsets[i]));
+    }
+    assert((words == std::vector<std::string>{"heal", "health", "heart"}));
+    assert(dfs[0] == 2 && dfs[1] == 3 && dfs[2] == 2);
+    // Корень дерева - словоформа с наибольшим df
+    assert(tree[1] == 1);
+    
+    // Триграммы: после строк, с границы 8 байт
+    size_t position = (strings - data.data()) + offsets[num_words];
+    position = (position + 7) / 8 * 8;
+    const uint32_t* gram_header = reinterpret_cast<const uint32_t*>(data.data() + position);
+    uint32_t num_grams = gram_header[0];
+    const uint64_t* grams = reinterpret_cast<const uint64_t*>(gram_header + 2);
+    const uint32_t* gram_offsets = reinterpret_cast<const uint32_t*>(grams + num_grams);
+    const uint32_t* postings = gram_offsets + num_grams + 1;
+    assert(gram_offsets[num_grams] == gram_header[1]);
+    // heal: $he hea eal al$; health: $he hea eal alt lth th$; heart: $he hea ear art rt$
+    assert(num_grams == 10);
+    assert(gram_header[1] == 15);
+    
+    auto gram = [](uint64_t a, uint64_t b, uint64_t c) { return (a << 42) | (b << 21) | c; };
+    const uint64_t* first = std::lower_bound(grams, grams + num_grams, gram(0, 'h', 'e'));
+    assert(first != grams + num_grams && *first == gram(0, 'h', 'e'));
+    uint32_t g = static_cast<uint32_t>(first - grams);
+    assert(gram_offsets[g + 1] - gram_offsets[g] == 3);
+    assert(postings[gram_offsets[g]] == 0 && postings[gram_offsets[g] + 2] == 2);
+    
+    const uint64_t* eal = std::lower_bound(grams, grams + num_grams, gram('e', 'a', 'l'));
+    g = static_cast<uint32_t>(eal - grams);
+    assert(gram_offsets[g + 1] - gram_offsets[g] == 2);
+    assert(postings[gram_offsets[g]] == 0 && postings[gram_offsets[g] + 1] == 1);
+    std::cout << " test_indexer_suggest_file" << std::endl;
+}
+
 // ========== Тесты парсера запросов ==========
 
 void test_query_parser_simple() {
@@ -281,6 +486,44 @@ void test_query_parser_implicit_and() {
     std::cout << " test_query_parser_implicit_and" << std::endl;
 }
 
+// ========== Тесты JSON-вывода ==========
+
+void test_json_string_escape() {
+    assert(json_string("abc") == "\"abc\"");
+    assert(json_string("a\"b") == "\"a\\\"b\"");
+    assert(json_string("a\\b") == "\"a\\\\b\"");
+    assert(json_string("a\nb\tc") == "\"a\\nb\\tc\"");
+    assert(json_string(std::string("\x01", 1)) == "\"\\u0001\"");
+    assert(json_string("Привет") == "\"Привет\"");
+    std::cout << "test_json_string_escape" << std::endl;
+}
+
+void test_json_hit() {
+    Document doc;
+    doc.id = 7;
+    doc.title = "Заголовок \"в кавычках\"";
+    doc.url = "http://test/7";
+    doc.category = "Кардиология";
+    doc.source = "test";
+    
+    std::string hit = json_hit(3, doc);
+    assert(hit.find("\"type\":\"hit\"") != std::string::npos);
+    assert(hit.find("\"rank\":3") != std::string::npos);
+    assert(hit.find("\"id\":7") != std::string::npos);
+    assert(hit.find("\\\"в кавычках\\\"") != std::string::npos);
+    assert(hit.find('\n') == std::string::npos);
+    
+    std::string header = json_header("a && b", 10, 3, 42);
+    assert(header == "{\"type\":\"header\",\"query\":\"a && b\",\"total\":10,\"hits\":3,\"search_us\":42}");
+    
+    std::vector<uint32_t> ids = {1, 5, 9};
+    header = json_header("a", 3, 0, 1, &ids);
+    assert(header.find(",\"ids\":[1,5,9]}") != std::string::npos);
+    header = json_header("a", 3, 0, 1, nullptr, true);
+    assert(header.find(",\"truncated\":true}") != std::string::npos);
+    std::cout << " test_json_hit" << std::endl;
+}
+
 // ========== Главная функция ==========
 
 int main() {
@@ -312,6 +555,12 @@ int main() {
     test_intersect_empty();
     test_union();
     test_union_empty();
+    test_searcher_term_cache();
+    test_searcher_ranked();
+    test_searcher_time_budget();
+    
+    std::cout << std::endl << "--- Тесты словаря подсказок ---" << std::endl;
+    test_indexer_suggest_file();
     
     std::cout << std::endl << "--- Тесты парсера запросов ---" << std::endl;
     test_query_parser_simple();
@@ -321,6 +570,10 @@ int main() {
     test_query_parser_complex();
     test_query_parser_implicit_and();
     
+    std::cout << std::endl << "--- Тесты JSON-вывода ---" << std::endl;
+    test_json_string_escape();
+    test_json_hit();
+    
     std::cout << std::endl;
     std::cout << "========================================" << std::endl;
     std::cout << "      ВСЕ ТЕСТЫ ПРОЙДЕНЫ!" << std::endl;
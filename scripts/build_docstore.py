@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+"""
+Хранилище текстов документов для сниппетов (index.docs), строится рядом с index.bin.
+
+Формат:
+    заголовок   magic u32 ("MDOC"), version u32, num_docs u32, reserved u32,
+                offsets_offset u64, build_id u64 (сборка index.bin)
+    тексты      zlib(text) для каждого документа подряд
+    смещения    u64 * (num_docs + 1) - начало сжатого текста документа i
+
+Хранится начало текста (MAX_TEXT_BYTES): сниппет строится по нему, и время
+на одну страницу выдачи не зависит от длины самых больших статей.
+
+ID документов должны совпадать с индексом, поэтому строки corpus.json
+разбираются так же, как в Indexer::build_from_json (включая extract_json_value),
+а не через json.loads.
+
+Использование:
+    python build_docstore.py [../data/corpus.json] [../data/index.docs] [../data/index.bin]
+"""
+
+import os
+import struct
+import sys
+import zlib
+from array import array
+
+MAGIC = 0x434F444D  # "MDOC"
+VERSION = 2
+
+_HEADER = struct.Struct('<IIIIQQ')
+
+MAX_TEXT_BYTES = 16 * 1024
+
+INDEX_MAGIC = 0x5849444D
+_INDEX_HEADER = struct.Struct('<IIIIQQ')
+
+
+def extract_json_value(line, key):
+    """Байтовый порт Indexer::extract_json_value"""
+    search_key = b'"' + key + b'"'
+    key_pos = line.find(search_key)
+    if key_pos < 0:
+        return b''
+
+    colon_pos = line.find(b':', key_pos + len(search_key))
+    if colon_pos < 0:
+        return b''
+
+    value_start = colon_pos + 1
+    while value_start < len(line) and line[value_start] in b' \t':
+        value_start += 1
+
+    if value_start >= len(line):
+        return b''
+
+    if line[value_start] == ord('"'):
+        str_start = value_start + 1
+        str_end = str_start
+        while str_end < len(line):
+            if line[str_end] == ord('"') and (str_end == 0 or line[str_end - 1] != ord('\\')):
+                break
+            str_end += 1
+
+        value = line[str_start:str_end]
+        if b'\\' not in value:
+            return value
+
+        result = bytearray()
+        i = 0
+        while i < len(value):
+            c = value[i]
+            if c == ord('\\') and i + 1 < len(value):
+                following = value[i + 1]
+                if following == ord('n'):
+                    result += b'\n'
+                    i += 1
+                elif following == ord('t'):
+                    result += b'\t'
+                    i += 1
+                elif following == ord('"'):
+                    result += b'"'
+                    i += 1
+                elif following == ord('\\'):
+                    result += b'\\'
+                    i += 1
+                else:
+                    result.append(c)
+            else:
+                result.append(c)
+            i += 1
+        return bytes(result)
+
+    if line[value_start] == ord('n'):
+        return b''
+
+    value_end = value_start
+    while value_end < len(line) and line[value_end] not in b',}\n':
+        value_end += 1
+    return line[value_start:value_end]
+
+
+def truncate_utf8(data, limit):
+    """Обрезать UTF-8 до limit байт, не разрывая символ"""
+    if len(data) <= limit:
+        return data
+    while limit > 0 and (data[limit] & 0xC0) == 0x80:
+        limit -= 1
+    return data[:limit]
+
+
+def iter_documents(corpus_file):
+    """Строки corpus.json, ставшие документами индекса, в порядке ID"""
+    with open(corpus_file, 'rb') as f:
+        for line in f:
+            line = line.rstrip(b'\n')
+            if not line or line[0] != ord('{'):
+                continue
+
+            title = extract_json_value(line, b'title')
+            text = extract_json_value(line, b'text')
+            if not title and not text:
+                continue
+
+            yield line
+
+
+def iter_texts(corpus_file):
+    """Тексты документов в порядке ID индекса"""
+    for line in iter_documents(corpus_file):
+        yield extract_json_value(line, b'text')
+
+
+def build_docstore(corpus_file, output_file, build_id=0, level=6,
+                   max_text_bytes=MAX_TEXT_BYTES):
+    tmp_file = output_file + '.tmp'
+
+    with open(tmp_file, 'wb') as out:
+        # Количество документов известно только в конце: заголовок
+        # перезаписывается после текстов, таблица смещений идёт за ними
+        out.write(_HEADER.pack(MAGIC, VERSION, 0, 0, 0, build_id))
+        offsets = array('Q', [out.tell()])
+        for text in iter_texts(corpus_file):
+            out.write(zlib.compress(truncate_utf8(text, max_text_bytes), level))
+            offsets.append(out.tell())
+
+        num_docs = len(offsets) - 1
+        offsets_offset = out.tell()
+        out.write(offsets.tobytes())
+        out.seek(0)
+        out.write(_HEADER.pack(MAGIC, VERSION, num_docs, 0, offsets_offset, build_id))
+        out.flush()
+        os.fsync(out.fileno())
+
+    os.replace(tmp_file, output_file)
+    return num_docs
+
+
+def index_header(index_file):
+    """
+    (количество документов, build_id) из заголовка index.bin или None;
+    build_id 0 - индекс версии 1-2, без идентификатора сборки
+    """
+    try:
+        with open(index_file, 'rb') as f:
+            data = f.read(_INDEX_HEADER.size + 8)
+        magic, version, _, num_docs, _, _ = _INDEX_HEADER.unpack_from(data, 0)
+        build_id = struct.unpack_from('<Q', data, _INDEX_HEADER.size)[0] if version >= 3 else 0
+    except (OSError, struct.error):
+        return None
+    return (num_docs, build_id) if magic == INDEX_MAGIC else None
+
+
+if __name__ == '__main__':
+    corpus_file = sys.argv[1] if len(sys.argv) > 1 else '../data/corpus.json'
+    output_file = sys.argv[2] if len(sys.argv) > 2 else '../data/index.docs'
+    index_file = sys.argv[3] if len(sys.argv) > 3 else '../data/index.bin'
+
+    header = index_header(index_file)
+    num_docs = build_docstore(corpus_file, output_file, header[1] if header else 0)
+    size = os.path.getsize(output_file)
+    print(f'Тексты {num_docs} документов сохранены в {output_file} ({size / 1024 / 1024:.1f} МБ)')
+
+    if header is not None and header[0] != num_docs:
+        print(f'Ошибка: в индексе {header[0]} документов, в хранилище {num_docs}')
+        sys.exit(1)
@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""
+Столбцы фасетов (index.facets): источник, категория и год каждого документа,
+строится рядом с index.bin.
+
+Формат:
+    заголовок   magic u32 ("MFCT"), version u32, num_docs u32, num_columns u32,
+                build_id u64 (сборка index.bin)
+    столбец     name_len u16, name, num_values u32,
+                значения: len u16 + UTF-8 для каждого (код 0 - значение не указано),
+                выравнивание до 8 байт, коды u16 * num_docs
+
+Код документа - номер значения в словаре столбца, поэтому число документов
+по значениям для любого набора ID - один bincount по массиву кодов.
+Строки corpus.json разбираются так же, как для index.docs (build_docstore.py).
+
+Использование:
+    python build_facets.py [../data/corpus.json] [../data/index.facets] [../data/index.bin]
+"""
+
+import os
+import re
+import struct
+import sys
+from array import array
+
+from build_docstore import extract_json_value, index_header, iter_documents
+
+MAGIC = 0x5443464D  # "MFCT"
+VERSION = 2
+
+_HEADER = struct.Struct('<IIIIQ')
+
+COLUMNS = ('source', 'category', 'year')
+
+MAX_VALUES = 0xFFFF
+
+_YEAR = re.compile(rb'(?<!\d)(1[89]|20)\d\d(?!\d)')
+
+
+def column_value(line, name):
+    """Значение столбца документа (b'' - не указано); год - первые четыре цифры года"""
+    value = extract_json_value(line, name.encode('ascii')).strip()
+    if name == 'year':
+        match = _YEAR.search(value)
+        return match.group() if match else b''
+    return value
+
+
+def encode_column(values):
+    """(словарь значений, коды документов): словарь отсортирован, b'' - код 0"""
+    dictionary = sorted(set(values) | {b''})
+    if len(dictionary) > MAX_VALUES:
+        raise ValueError(f'Слишком много различных значений: {len(dictionary)}')
+    codes = {value: code for code, value in enumerate(dictionary)}
+    return dictionary, array('H', (codes[value] for value in values))
+
+
+def build_facets(corpus_file, output_file, build_id=0):
+    columns = {name: [] for name in COLUMNS}
+    for line in iter_documents(corpus_file):
+        for name, values in columns.items():
+            values.append(column_value(line, name))
+    num_docs = len(columns[COLUMNS[0]])
+
+    tmp_file = output_file + '.tmp'
+    with open(tmp_file, 'wb') as out:
+        out.write(_HEADER.pack(MAGIC, VERSION, num_docs, len(COLUMNS), build_id))
+        for name in COLUMNS:
+            dictionary, codes = encode_column(columns[name])
+            out.write(struct.pack('<H', len(name)) + name.encode('ascii'))
+            out.write(struct.pack('<I', len(dictionary)))
+            for value in dictionary:
+                out.write(struct.pack('<H', len(value)) + value)
+            out.write(b'\0' * (-out.tell() % 8))
+            if sys.byteorder != 'little':
+                codes.byteswap()
+            out.write(codes.tobytes())
+        out.flush()
+        os.fsync(out.fileno())
+
+    os.replace(tmp_file, output_file)
+    return num_docs
+
+
+if __name__ == '__main__':
+    corpus_file = sys.argv[1] if len(sys.argv) > 1 else '../data/corpus.json'
+    output_file = sys.argv[2] if len(sys.argv) > 2 else '../data/index.facets'
+    index_file = sys.argv[3] if len(sys.argv) > 3 else '../data/index.bin'
+
+    header = index_header(index_file)
+    num_docs = build_facets(corpus_file, output_file, header[1] if header else 0)
+    print(f'Фасеты {num_docs} документов сохранены в {output_file}')
+
+    if header is not None and header[0] != num_docs:
+        print(f'Ошибка: в индексе {header[0]} документов, в фасетах {num_docs}')
+        sys.exit(1)
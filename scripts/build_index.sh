@@ -26,8 +26,27 @@ make all
 
 echo ""
 echo "Индексация корпуса..."
-./indexer --input=../data/corpus.json --output=../data/index.bin
+./indexer --input=../data/corpus.json --output=../data/index.bin.next --suggest=../data/index.suggest.next
 
 echo ""
-echo "Готово! Индекс сохранен: data/index.bin"
+echo "Хранилище текстов для сниппетов..."
+python3 ../scripts/build_docstore.py ../data/corpus.json ../data/index.docs.next ../data/index.bin.next
+
+echo ""
+echo "Столбцы фасетов..."
+python3 ../scripts/build_facets.py ../data/corpus.json ../data/index.facets.next ../data/index.bin.next
+
+# Файлы новой сборки строятся как *.next, пока старые работают. Публикуются
+# они вместе: сначала файлы при индексе, последним сам индекс (каждый rename
+# атомарен), и работающий веб-сервис переключается на новую версию, когда её
+# тексты, подсказки и фасеты уже на месте. Если сервис перезапустится между
+# переименованиями, старый индекс не примет новые файлы (в заголовках другой
+# build_id) и до публикации индекса поработает без них
+for companion in index.suggest index.docs index.facets; do
+    mv -f "../data/$companion.next" "../data/$companion"
+done
+mv -f ../data/index.bin.next ../data/index.bin
+
+echo ""
+echo "Готово! Индекс сохранен: data/index.bin, тексты: data/index.docs, подсказки: data/index.suggest, фасеты: data/index.facets"
 
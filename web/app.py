@@ -3,119 +3,881 @@
 Flask веб-интерфейс для медицинской поисковой системы
 """
 
+import hmac
+import json
 import os
+import re
 import subprocess
-from flask import Flask, render_template, request, jsonify
+import tempfile
+import time
+from array import array
+from flask import Flask, Response, abort, g, render_template, request, jsonify, send_from_directory
 from pymongo import MongoClient
 
+import metrics
+
+from searcher_pool import (SearcherPool, SearcherWorker, SearcherBusy, SearcherTimeout,
+                           LineReader, read_search_response)
+from query_cache import QueryCache
+from singleflight import SingleFlight
+from index_manager import IndexManager
+from query_engine import QueryEngine
+from warmup import QueryLog, Warmer
+from profiler import Profiler
+from snippets import add_snippets
+from spelling import correct_query
+from facets import filters_key
+from tokenizer import LETTERS
+from query_parser import normalize_query, query_shape
+from corpus_stats import CorpusStats
+from pagination import InvalidCursor, decode_cursor, next_cursor
+from http_cache import search_etag, not_modified, choose_encoding, compressible, compress
+
 app = Flask(__name__)
 
 # Конфигурация
 MONGO_URI = os.getenv('MONGO_URI', 'mongodb://localhost:27017/')
+MONGO_POOL_SIZE = int(os.getenv('MONGO_POOL_SIZE', 10))
+STATS_REFRESH_INTERVAL = float(os.getenv('STATS_REFRESH_INTERVAL', 60))
+RESULTS_PER_PAGE = int(os.getenv('RESULTS_PER_PAGE', 50))
 SEARCHER_PATH = os.getenv('SEARCHER_PATH', '../engine/searcher')
 INDEX_PATH = os.getenv('INDEX_PATH', '../data/index.bin')
+# Тексты документов для сниппетов (scripts/build_docstore.py), рядом с index.bin
+DOCSTORE_PATH = os.getenv('DOCSTORE_PATH', os.path.splitext(INDEX_PATH)[0] + '.docs')
+# Словарь подсказок для автодополнения (indexer --suggest), рядом с index.bin
+SUGGEST_PATH = os.getenv('SUGGEST_PATH', os.path.splitext(INDEX_PATH)[0] + '.suggest')
+SUGGEST_MAX_LIMIT = 50
+# Столбцы фасетов (scripts/build_facets.py), рядом с index.bin; параметры
+# запроса для фильтров и сколько значений каждого фасета показывать
+FACETS_PATH = os.getenv('FACETS_PATH', os.path.splitext(INDEX_PATH)[0] + '.facets')
+FACET_FILTERS = ('source', 'category', 'year')
+FACET_LIMIT = int(os.getenv('FACET_LIMIT', 20))
+# Время на исправление одного слова запроса без результатов (0 - не исправлять)
+SPELLING_BUDGET_MS = float(os.getenv('SPELLING_BUDGET_MS', 5))
+
+# Как часто проверять, не опубликован ли новый index.bin (0 - не проверять),
+# и сколько самых частых термов прогревать в page cache перед переключением
+INDEX_CHECK_INTERVAL = float(os.getenv('INDEX_CHECK_INTERVAL', 2))
+INDEX_PREFETCH_TERMS = int(os.getenv('INDEX_PREFETCH_TERMS', 1000))
+
+# Пул процессов searcher (0 - отдельный процесс на каждый запрос)
+SEARCHER_POOL_SIZE = int(os.getenv('SEARCHER_POOL_SIZE', 4))
+SEARCHER_TIMEOUT = float(os.getenv('SEARCHER_TIMEOUT', 30))
+SEARCHER_QUEUE_SIZE = int(os.getenv('SEARCHER_QUEUE_SIZE', 32))
+SEARCHER_QUEUE_TIMEOUT = float(os.getenv('SEARCHER_QUEUE_TIMEOUT', 5))
+
+# Время на вычисление одного запроса, мс (0 - без ограничения). После него
+# вычисление останавливается и возвращается неполный результат (truncated) -
+# подмножество точного; он не кэшируется. SEARCHER_TIMEOUT остаётся
+# запасным ограничением на весь ответ searcher'а
+SEARCH_BUDGET_MS = int(os.getenv('SEARCH_BUDGET_MS', 5000))
+
+# Где вычисляются запросы: 'searcher' - C++ процессы, 'inprocess' - NumPy
+# поверх index.bin, открытого через mmap (query_engine.py)
+SEARCH_BACKEND = os.getenv('SEARCH_BACKEND', 'searcher')
+
+# Порядок выдачи (параметр rank): 'none' - по ID документа, 'bm25' - по
+# релевантности. По BM25 упорядочиваются RANK_DEPTH лучших документов,
+# остальные найденные идут следом по ID
+RANK_MODES = ('none', 'bm25')
+DEFAULT_RANK = os.getenv('DEFAULT_RANK', 'none')
+RANK_DEPTH = int(os.getenv('RANK_DEPTH', 1000))
+
+# Максимум запросов в одном POST /api/search/batch
+BATCH_MAX_QUERIES = int(os.getenv('BATCH_MAX_QUERIES', 100))
+
+# Сколько документов /api/search/export читает и отправляет одним chunk'ом
+EXPORT_CHUNK_DOCS = int(os.getenv('EXPORT_CHUNK_DOCS', 500))
+
+# Кэш результатов: LRU в памяти + общий для воркеров файл SQLite ('' - без диска)
+QUERY_CACHE_ENTRIES = int(os.getenv('QUERY_CACHE_ENTRIES', 1024))
+QUERY_CACHE_MAX_IDS = int(os.getenv('QUERY_CACHE_MAX_IDS', 2000000))
+QUERY_CACHE_PATH = os.getenv('QUERY_CACHE_PATH',
+                             os.path.join(tempfile.gettempdir(), 'ir_query_cache.sqlite'))
+QUERY_CACHE_DISK_MB = int(os.getenv('QUERY_CACHE_DISK_MB', 256))
+
+# Журнал частот запросов, общий для воркеров ('' - не вести): QUERY_LOG_ENTRIES
+# самых частых, счётчики уменьшаются вдвое каждые QUERY_LOG_HALF_LIFE секунд
+QUERY_LOG_PATH = os.getenv('QUERY_LOG_PATH',
+                           os.path.join(tempfile.gettempdir(), 'ir_query_log.sqlite'))
+QUERY_LOG_ENTRIES = int(os.getenv('QUERY_LOG_ENTRIES', 10000))
+QUERY_LOG_HALF_LIFE = float(os.getenv('QUERY_LOG_HALF_LIFE', 6 * 3600))
+
+# Прогрев кэша при загрузке версии индекса: сколько частых запросов журнала
+# выполнить, сколько одновременно и сколько секунд на это отвести (0 - без прогрева)
+WARMUP_QUERIES = int(os.getenv('WARMUP_QUERIES', 200))
+WARMUP_CONCURRENCY = int(os.getenv('WARMUP_CONCURRENCY', 2))
+WARMUP_MAX_SECONDS = float(os.getenv('WARMUP_MAX_SECONDS', 60))
 
+# Сжатие JSON и HTML ответов по Accept-Encoding: уровень zlib (0 - не сжимать)
+# и минимальный размер тела, которое имеет смысл сжимать
+COMPRESS_LEVEL = int(os.getenv('COMPRESS_LEVEL', 6))
+COMPRESS_MIN_BYTES = int(os.getenv('COMPRESS_MIN_BYTES', 1024))
 
-def get_search_results(query, limit=50):
-    """Выполнить поиск через C++ searcher"""
+# Выборочное профилирование запросов (web/profiler.py): каждый
+# PROFILE_SAMPLE_EVERY-й запрос и запросы не быстрее PROFILE_SLOW_MS
+# (оба 0 - выключено). Стеки снимаются раз в PROFILE_INTERVAL_MS, профили
+# collapsed stacks пишутся в PROFILE_DIR, хранятся последние PROFILE_MAX_FILES.
+# Профили отдаются только с заголовком X-Profile-Token, равным PROFILE_TOKEN
+# (без PROFILE_TOKEN - никому): в них стеки кода рабочего сервиса
+PROFILE_SAMPLE_EVERY = int(os.getenv('PROFILE_SAMPLE_EVERY', 0))
+PROFILE_SLOW_MS = float(os.getenv('PROFILE_SLOW_MS', 0))
+PROFILE_INTERVAL_MS = float(os.getenv('PROFILE_INTERVAL_MS', 5))
+PROFILE_DIR = os.getenv('PROFILE_DIR', os.path.join(tempfile.gettempdir(), 'ir_profiles'))
+PROFILE_MAX_FILES = int(os.getenv('PROFILE_MAX_FILES', 100))
+PROFILE_TOKEN = os.getenv('PROFILE_TOKEN', '')
+
+# Один клиент MongoDB с пулом соединений на процесс; connect=False - соединение
+# устанавливается при первом запросе, уже после fork воркера
+mongo_client = MongoClient(MONGO_URI, maxPoolSize=MONGO_POOL_SIZE, connect=False)
+corpus_stats = CorpusStats(mongo_client['medical_search']['articles'],
+                           interval=STATS_REFRESH_INTERVAL)
+
+query_cache = QueryCache(max_entries=QUERY_CACHE_ENTRIES,
+                         max_ids=QUERY_CACHE_MAX_IDS,
+                         disk_path=QUERY_CACHE_PATH or None,
+                         disk_max_bytes=QUERY_CACHE_DISK_MB * 1024 * 1024)
+
+query_log = QueryLog(QUERY_LOG_PATH, max_entries=QUERY_LOG_ENTRIES,
+                     half_life=QUERY_LOG_HALF_LIFE) if QUERY_LOG_PATH else None
+
+# Одинаковые одновременные запросы в процессе вычисляются один раз
+search_flights = SingleFlight()
+
+profiler = Profiler(PROFILE_DIR, sample_every=PROFILE_SAMPLE_EVERY,
+                    slow_seconds=PROFILE_SLOW_MS / 1000,
+                    interval=PROFILE_INTERVAL_MS / 1000,
+                    max_files=PROFILE_MAX_FILES) \
+    if PROFILE_SAMPLE_EVERY > 0 or PROFILE_SLOW_MS > 0 else None
+
+
+def start_searcher_pool(version):
+    """Пул searcher'ов для версии индекса: процессы открывают её файл через /dev/fd"""
+    if SEARCHER_POOL_SIZE <= 0 or SEARCH_BACKEND == 'inprocess':
+        return
+    pool = SearcherPool(SEARCHER_PATH, version.index_arg,
+                        size=SEARCHER_POOL_SIZE,
+                        timeout=SEARCHER_TIMEOUT,
+                        queue_size=SEARCHER_QUEUE_SIZE,
+                        queue_timeout=SEARCHER_QUEUE_TIMEOUT,
+                        pass_fds=(version.fd,))
+    pool.start()
     try:
-        result = subprocess.run(
-            [SEARCHER_PATH, f'--index={INDEX_PATH}', f'--query={query}', f'--limit={limit}'],
-            capture_output=True,
-            text=True,
-            timeout=30
-        )
-        
-        # Парсинг результатов
-        lines = result.stdout.strip().split('\n')
-        documents = []
-        total = 0
-        
-        for line in lines:
-            if 'Найдено:' in line:
-                try:
-                    total = int(line.split(':')[1].strip().split()[0])
-                except:
-                    pass
-            elif line.startswith(('1.', '2.', '3.', '4.', '5.', '6.', '7.', '8.', '9.')):
-                # Заголовок документа
-                title = line.split('.', 1)[1].strip() if '.' in line else line
-                documents.append({'title': title, 'url': '', 'category': ''})
-            elif line.strip().startswith('http'):
-                # URL
-                if documents:
-                    documents[-1]['url'] = line.strip()
-            elif line.strip().startswith('[') and line.strip().endswith(']'):
-                # Категория
-                if documents:
-                    documents[-1]['category'] = line.strip()[1:-1]
-        
-        return {'total': total, 'documents': documents}
-        
-    except subprocess.TimeoutExpired:
-        return {'error': 'Timeout', 'total': 0, 'documents': []}
-    except FileNotFoundError:
-        return {'error': 'Searcher not found', 'total': 0, 'documents': []}
+        # Новая версия публикуется только после загрузки индекса всеми процессами
+        pool.wait_ready(SEARCHER_TIMEOUT)
+    except Exception:
+        pool.close()
+        raise
+    version.pool = pool
+
+
+def stop_searcher_pool(version):
+    if version.pool is not None:
+        version.pool.close()
+
+
+def warm_query(version, query, rank):
+    """Вычислить запрос журнала для версии индекса; False - он уже в кэше"""
+    source, _, _ = find_all_ids(version, query, result_key(query, rank), rank)
+    return source != 'cache'
+
+
+warmer = Warmer(query_log, warm_query, top_n=WARMUP_QUERIES,
+                concurrency=WARMUP_CONCURRENCY,
+                max_seconds=WARMUP_MAX_SECONDS) if query_log and WARMUP_QUERIES > 0 else None
+
+
+def warm_cache(version, background):
+    """Хук прогрева версии индекса частыми запросами из журнала"""
+    if warmer is None:
+        return
+    if background:
+        warmer.start(version)
+    else:
+        warmer.warm(version)
+
+
+# Версия индекса создаётся при первом запросе (после fork воркера); фоновый
+# поток подменяет её, когда build_index.sh публикует новый index.bin
+index_manager = IndexManager(INDEX_PATH, DOCSTORE_PATH,
+                             interval=INDEX_CHECK_INTERVAL,
+                             hot_terms=INDEX_PREFETCH_TERMS,
+                             on_load=start_searcher_pool,
+                             on_close=stop_searcher_pool,
+                             suggest_path=SUGGEST_PATH,
+                             on_warm=warm_cache,
+                             facets_path=FACETS_PATH)
+
+
+def run_searcher(version, query, limit=50, with_ids=False, rank_depth=0, budget_ms=0):
+    """
+    Выполнить запрос через C++ searcher (пул или отдельный процесс);
+    rank_depth > 0 - упорядочить по BM25 столько лучших документов;
+    budget_ms > 0 - время на вычисление (неполный результат - 'truncated')
+    """
+    if version.pool is not None:
+        return version.pool.search(query, limit=limit, with_ids=with_ids, rank_depth=rank_depth,
+                                   budget_ms=budget_ms)
+    
+    args = [SEARCHER_PATH, f'--index={version.index_arg}', f'--query={query}',
+            f'--limit={limit}', '--format=jsonl']
+    if with_ids:
+        args.append('--ids')
+    if rank_depth > 0:
+        args += ['--ranked', f'--depth={rank_depth}']
+    if budget_ms > 0:
+        args.append(f'--budget-ms={budget_ms}')
+    
+    started = time.perf_counter()
+    process = subprocess.Popen(args, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                               pass_fds=(version.fd,))
+    metrics.SPAWN.observe(time.perf_counter() - started)
+    # Записи разбираются по мере поступления, без буферизации всего stdout
+    try:
+        deadline = time.monotonic() + SEARCHER_TIMEOUT
+        return read_search_response(LineReader(process.stdout), deadline)
+    finally:
+        process.kill()
+        process.wait()
+        process.stdout.close()
+
+
+def run_searcher_batch(version, requests, with_ids=False, budget_ms=0):
+    """Пакет запросов [(запрос, limit)] одним проходом searcher'а"""
+    if version.pool is not None:
+        return version.pool.search_many(requests, with_ids=with_ids, budget_ms=budget_ms)
+    
+    started = time.perf_counter()
+    worker = SearcherWorker(SEARCHER_PATH, version.index_arg, pass_fds=(version.fd,))
+    metrics.SPAWN.observe(time.perf_counter() - started)
+    try:
+        return worker.search_many(requests, SEARCHER_TIMEOUT, with_ids=with_ids,
+                                  budget_ms=budget_ms)
+    finally:
+        worker.close()
+
+
+def attach_snippets(version, documents, query):
+    """Добавить документам сниппеты, если для индекса есть хранилище текстов"""
+    if version.doc_store is not None and documents:
+        started = time.perf_counter()
+        add_snippets(documents, query, version.doc_store)
+        metrics.SNIPPETS.observe(time.perf_counter() - started)
+    return documents
+
+
+def search_in_process(version, query, limit, rank_depth=0, budget_ms=0):
+    """Выполнить запрос в процессе веб-сервера (ответ как у run_searcher с with_ids=True)"""
+    reader = version.reader
+    started = time.perf_counter()
+    engine = QueryEngine(reader, time.monotonic() + budget_ms / 1000 if budget_ms > 0 else None)
+    ids = engine.search_ranked(query, rank_depth) if rank_depth > 0 else engine.search(query)
+    elapsed = time.perf_counter() - started
+    metrics.EVALUATION.observe(elapsed)
+    search_us = int(elapsed * 1e6)
+    
+    result = {'total': len(ids),
+              'documents': reader.documents(ids[:limit].tolist()),
+              'search_us': search_us,
+              'ids': array('I', ids.astype('=u4').tobytes())}
+    if engine.truncated:
+        result['truncated'] = True
+    return result
+
+
+def fetch_documents(version, doc_ids):
+    """Документы прямого индекса по списку ID (без выполнения запроса)"""
+    if not doc_ids:
+        return []
+    return version.reader.documents(doc_ids)
+
+
+def parse_rank(value):
+    """Порядок выдачи из параметра rank (пустой - DEFAULT_RANK); ValueError - неизвестный"""
+    rank = value or DEFAULT_RANK
+    if rank not in RANK_MODES:
+        raise ValueError('Unknown rank mode')
+    return rank
+
+
+def result_key(query, rank):
+    """Ключ кэша результатов: нормализованный запрос и порядок выдачи"""
+    key = normalize_query(query)
+    return key if rank == 'none' else f'{rank}:{key}'
+
+
+def parse_filters(args):
+    """Фильтры фасетов из параметров запроса: {столбец: [значения]}"""
+    filters = {}
+    for name in FACET_FILTERS:
+        values = [value for value in args.getlist(name) if value]
+        if values:
+            filters[name] = values
+    return filters
+
+
+def page_key(key, filters):
+    """Ключ для курсора и ETag: ключ результата и фильтры фасетов"""
+    return f'{key}|{filters_key(filters)}' if filters else key
+
+
+def get_search_results(query, limit=50, offset=0, rank='none', filters=None):
+    """
+    Выполнить поиск и вернуть страницу [offset, offset + limit).
+    Полный список ID хранится в кэше результатов: первая страница выполняет
+    запрос, следующие читают из прямого индекса только свои документы.
+    rank - порядок выдачи (RANK_MODES), filters - фильтры фасетов.
+    """
+    started = time.perf_counter()
+    try:
+        with index_manager.use() as version:
+            result = search_page(version, query, limit, offset, started, rank, filters)
+            if not result['total'] and not result.get('truncated'):
+                suggest_correction(version, query, result)
+            else:
+                log_query(query, offset, rank)
+            return result
     except Exception as e:
-        return {'error': str(e), 'total': 0, 'documents': []}
+        return error_result(e)
 
 
-def get_corpus_stats():
-    """Получить статистику корпуса из MongoDB"""
+def log_query(query, offset, rank):
+    """Учесть запрос в журнале для прогрева (только первые страницы с результатами)"""
+    if query_log is not None and offset == 0:
+        query_log.record(result_key(query, rank), query, rank)
+
+
+def suggest_correction(version, query, result):
+    """Добавить к пустому результату исправленный запрос (did_you_mean), если он есть"""
+    started = time.perf_counter()
+    correction = correct_query(query, version.reader, version.suggester,
+                               SPELLING_BUDGET_MS / 1000)
+    metrics.SPELLING.observe(time.perf_counter() - started)
+    metrics.search_corrections.labels('corrected' if correction else 'none').inc()
+    if correction:
+        result['did_you_mean'] = correction
+    return result
+
+
+def evaluate_query(version, query, key, limit, rank='none'):
+    """
+    Вычислить запрос: все ID и первые limit документов, ID - в кэш.
+    Если тот же запрос уже вычисляет другой воркер, дождаться его результата
+    в общем кэше вместо повторного вычисления. Неполный результат
+    (не уложился в SEARCH_BUDGET_MS) в кэш не попадает.
+    """
+    generation = version.generation
+    owner = query_cache.claim(key, generation, SEARCHER_TIMEOUT)
+    if owner is None:
+        ids = query_cache.wait(key, generation, SEARCHER_TIMEOUT)
+        if ids is not None:
+            metrics.search_coalesced.labels('worker').inc()
+            return 'coalesced', {'total': len(ids),
+                                 'documents': fetch_documents(version, ids[:limit]),
+                                 'ids': ids,
+                                 'cached': True}
+        # Результата нет: занять вычисление, если метку уже сняли; чужую
+        # метку (вычисление ещё идёт) снимать нельзя
+        owner = query_cache.claim(key, generation, SEARCHER_TIMEOUT)
+    
+    rank_depth = RANK_DEPTH if rank == 'bm25' else 0
     try:
-        client = MongoClient(MONGO_URI)
-        db = client['medical_search']
-        articles = db['articles']
-        
-        stats = {
-            'total_docs': articles.count_documents({}),
-            'sources': articles.distinct('source'),
-            'categories': len(articles.distinct('category'))
-        }
-        
-        client.close()
-        return stats
+        if SEARCH_BACKEND == 'inprocess':
+            source = 'inprocess'
+            result = search_in_process(version, query, limit, rank_depth, SEARCH_BUDGET_MS)
+        else:
+            source = 'searcher'
+            result = run_searcher(version, query, limit=limit, with_ids=True,
+                                  rank_depth=rank_depth, budget_ms=SEARCH_BUDGET_MS)
+        result['ids'] = array('I', result.get('ids', []))
+        if result.get('truncated'):
+            record_truncated(query)
+        else:
+            query_cache.put(key, generation, result['ids'])
+    finally:
+        if owner is not None:
+            query_cache.release(key, generation, owner)
+    return source, result
+
+
+def record_truncated(query):
+    """Счётчик запросов, не уложившихся в SEARCH_BUDGET_MS, по форме запроса"""
+    metrics.search_truncated.labels(query_shape(query)).inc()
+
+
+def search_page(version, query, limit, offset, started, rank='none', filters=None):
+    """get_search_results для одной версии индекса"""
+    key = result_key(query, rank)
+    generation = version.generation
+    cursor_key = page_key(key, filters)
+    # Без столбцов фасетов фильтры не применяются
+    filters = filters if version.facets is not None else None
+    
+    ids = query_cache.get(key, generation)
+    if ids is None:
+        # Для первой страницы без фильтров документы приходят вместе с
+        # результатом. Одинаковые одновременные запросы ждут одно вычисление
+        first_limit = limit if offset == 0 and not filters else 0
+        (source, response), shared = search_flights.do(
+            (generation, key, first_limit),
+            lambda: evaluate_query(version, query, key, first_limit, rank))
+        if shared:
+            metrics.search_coalesced.labels('process').inc()
+            source = 'coalesced'
+        ids = response['ids']
+        if first_limit:
+            # Ответ общий для всех ожидавших: сниппеты добавляются в копии
+            result = {name: value for name, value in response.items() if name != 'ids'}
+            result.update(documents=[dict(document) for document in response['documents']],
+                          offset=0, limit=limit,
+                          next_cursor=next_cursor(cursor_key, 0, limit, len(ids)))
+            attach_snippets(version, result['documents'], query)
+            add_facets(version, result, ids, filters)
+            record_search(source, started, len(ids))
+            return result
+        cached = response.get('cached', False)
+        truncated = response.get('truncated', False)
+    else:
+        source = 'cache'
+        cached = True
+        truncated = False
+    
+    all_ids = ids
+    if filters:
+        ids = version.facets.filter(ids, filters)
+    documents = fetch_documents(version, ids[offset:offset + limit])
+    attach_snippets(version, documents, query)
+    record_search(source, started, len(ids))
+    result = {'total': len(ids),
+              'documents': documents,
+              'offset': offset,
+              'limit': limit,
+              'next_cursor': next_cursor(cursor_key, offset, limit, len(ids)),
+              'cached': cached}
+    if truncated:
+        result['truncated'] = True
+    return add_facets(version, result, all_ids, filters)
+
+
+def add_facets(version, result, ids, filters):
+    """Счётчики фасетов по всем найденным ID (если для индекса есть столбцы фасетов)"""
+    if version.facets is not None:
+        started = time.perf_counter()
+        result['facets'] = version.facets.counts(ids, filters, FACET_LIMIT)
+        metrics.FACETS.observe(time.perf_counter() - started)
+    return result
+
+
+def find_all_ids(version, query, key, rank='none'):
+    """
+    (источник, ID всех найденных документов, неполный ли результат)
+    без чтения самих документов
+    """
+    ids = query_cache.get(key, version.generation)
+    if ids is not None:
+        return 'cache', ids, False
+    
+    (source, response), shared = search_flights.do(
+        (version.generation, key, 0),
+        lambda: evaluate_query(version, query, key, 0, rank))
+    if shared:
+        metrics.search_coalesced.labels('process').inc()
+        source = 'coalesced'
+    return source, response['ids'], response.get('truncated', False)
+
+
+def export_header(query, total, truncated=False):
+    header = {'type': 'header', 'query': query, 'total': total}
+    if truncated:
+        header['truncated'] = True
+    return json.dumps(header, ensure_ascii=False, separators=(',', ':')) + '\n'
+
+
+def export_chunks(version, ids):
+    """
+    Записи hit (как у searcher --format=jsonl) пачками по EXPORT_CHUNK_DOCS:
+    в памяти одновременно только одна пачка документов
+    """
+    for start in range(0, len(ids), EXPORT_CHUNK_DOCS):
+        yield export_chunk(version, ids, start)
+
+
+def export_chunk(version, ids, start):
+    documents = version.reader.documents(ids[start:start + EXPORT_CHUNK_DOCS])
+    return ''.join(json.dumps({'type': 'hit', 'rank': rank, **document},
+                              ensure_ascii=False, separators=(',', ':')) + '\n'
+                   for rank, document in enumerate(documents, start + 1))
+
+
+def get_batch_results(requests):
+    """
+    Выполнить пакет запросов [(запрос, limit)]; результаты в том же порядке.
+    Запросы из кэша отвечаются сразу, остальные (повторы - один раз)
+    выполняются одним проходом searcher'а с общим кэшем термов.
+    """
+    started = time.perf_counter()
+    try:
+        with index_manager.use() as version:
+            return search_batch(version, requests, started)
     except Exception as e:
-        return {'error': str(e)}
+        return dict(error_result(e), results=[])
+
+
+def search_batch(version, requests, started):
+    """get_batch_results для одной версии индекса"""
+    generation = version.generation
+    keys = [normalize_query(query) for query, _ in requests]
+    results = [None] * len(requests)
+    pending = {}  # ключ запроса -> позиции в пакете
+    
+    for position, ((query, limit), key) in enumerate(zip(requests, keys)):
+        ids = query_cache.get(key, generation)
+        if ids is None:
+            pending.setdefault(key, []).append(position)
+            continue
+        results[position] = {'query': query,
+                             'total': len(ids),
+                             'documents': fetch_documents(version, ids[:limit]),
+                             'cached': True}
+        record_search('cache', started, len(ids))
+    
+    groups = list(pending.values())
+    batch = [(requests[group[0]][0], max(requests[position][1] for position in group))
+             for group in groups]
+    
+    responses = []
+    source = 'inprocess' if SEARCH_BACKEND == 'inprocess' else 'searcher'
+    if batch and source == 'inprocess':
+        responses = [search_in_process(version, query, limit, budget_ms=SEARCH_BUDGET_MS)
+                     for query, limit in batch]
+    elif batch:
+        responses = run_searcher_batch(version, batch, with_ids=True, budget_ms=SEARCH_BUDGET_MS)
+    
+    for group, response in zip(groups, responses):
+        ids = array('I', response.pop('ids', []))
+        truncated = response.get('truncated', False)
+        if truncated:
+            record_truncated(requests[group[0]][0])
+        else:
+            query_cache.put(keys[group[0]], generation, ids)
+        record_search(source, started, len(ids))
+        for position in group:
+            query, limit = requests[position]
+            results[position] = {'query': query,
+                                 'total': len(ids),
+                                 'documents': response['documents'][:limit],
+                                 'search_us': response['search_us']}
+            if truncated:
+                results[position]['truncated'] = True
+    
+    return {'results': results}
+
+
+_LAST_WORD = re.compile(f'[{LETTERS}]*$')
+
+
+def get_suggestions(text, limit=10):
+    """
+    Подсказки для последнего (набираемого) слова запроса: словоформы
+    по убыванию числа документов и запрос с подставленной словоформой
+    """
+    text = text.lower()
+    start = _LAST_WORD.search(text).start()
+    prefix = text[start:]
+    if not prefix:
+        return {'prefix': prefix, 'suggestions': []}
+    
+    with index_manager.use() as version:
+        if version.suggester is None:
+            return {'prefix': prefix, 'suggestions': []}
+        words = version.suggester.suggest(prefix, limit)
+    return {'prefix': prefix,
+            'suggestions': [{'term': word, 'df': df, 'query': text[:start] + word}
+                            for word, df in words]}
+
+
+def error_result(error):
+    """Ответ с ошибкой поиска (и счётчик ошибок этого вида)"""
+    if isinstance(error, SearcherBusy):
+        metrics.search_errors.labels('busy').inc()
+        return {'error': 'Searcher busy', 'busy': True, 'total': 0, 'documents': []}
+    if isinstance(error, SearcherTimeout):
+        metrics.search_errors.labels('timeout').inc()
+        return {'error': 'Timeout', 'total': 0, 'documents': []}
+    if isinstance(error, FileNotFoundError):
+        metrics.search_errors.labels('not_found').inc()
+        return {'error': 'Searcher not found', 'total': 0, 'documents': []}
+    metrics.search_errors.labels('error').inc()
+    return {'error': str(error), 'total': 0, 'documents': []}
+
+
+def parse_batch_request(payload):
+    """
+    Тело POST /api/search/batch -> [(запрос, limit)].
+    Формат: {"queries": [{"q": "...", "limit": 10}, "запрос", ...], "limit": 50}
+    """
+    if not isinstance(payload, dict) or not isinstance(payload.get('queries'), list):
+        raise ValueError('Body must be a JSON object with a "queries" list')
+    
+    items = payload['queries']
+    if not items:
+        raise ValueError('Queries list is empty')
+    if len(items) > BATCH_MAX_QUERIES:
+        raise ValueError(f'Too many queries (max {BATCH_MAX_QUERIES})')
+    
+    default_limit = payload.get('limit', 50)
+    requests = []
+    for number, item in enumerate(items):
+        if isinstance(item, str):
+            item = {'q': item}
+        if not isinstance(item, dict):
+            raise ValueError(f'Query #{number} must be a string or an object')
+        
+        query = str(item.get('q', '')).strip()
+        if not query:
+            raise ValueError(f'Query #{number} is empty')
+        try:
+            limit = max(int(item.get('limit', default_limit)), 0)
+        except (TypeError, ValueError):
+            raise ValueError(f'Query #{number} has an invalid limit')
+        requests.append((query, limit))
+    
+    return requests
+
+
+def record_search(source, started, total):
+    """Счётчики успешного поиска: источник результата, время, размер выдачи"""
+    metrics.search_requests.labels(source).inc()
+    metrics.search_latency.child.observe(time.perf_counter() - started)
+    metrics.result_size.child.observe(total)
+
+
+def get_corpus_stats():
+    """Получить статистику корпуса (снимок, обновляемый в фоне)"""
+    return corpus_stats.get()
+
+
+def render_page(template, **context):
+    """render_template с замером времени рендеринга"""
+    started = time.perf_counter()
+    page = render_template(template, **context)
+    metrics.RENDER.observe(time.perf_counter() - started)
+    return page
+
+
+def collect_metrics():
+    """Счётчики кэша и пула searcher'ов, читаемые при выдаче /metrics"""
+    cache = query_cache.stats()
+    values = [
+        ('query_cache_memory_hits_total', 'counter', 'Попадания в кэш в памяти', cache['memory_hits']),
+        ('query_cache_disk_hits_total', 'counter', 'Попадания в дисковый кэш', cache['disk_hits']),
+        ('query_cache_misses_total', 'counter', 'Промахи кэша результатов', cache['misses']),
+        ('query_cache_evictions_total', 'counter', 'Вытеснения из кэша в памяти', cache['evictions']),
+        ('query_cache_entries', 'gauge', 'Запросов в кэше в памяти', cache['entries']),
+    ]
+    values.append(('index_swaps_total', 'counter',
+                   'Замены версии индекса без перезапуска', index_manager.swaps))
+    if query_log is not None:
+        values.append(('query_log_errors_total', 'counter',
+                       'Ошибки записи журнала запросов', query_log.errors))
+    if warmer is not None:
+        warmup = warmer.progress()
+        values += [
+            ('cache_warmup_runs_total', 'counter', 'Завершённые прогревы кэша', warmer.runs),
+            ('cache_warmup_queries', 'gauge', 'Запросов в последнем прогреве', warmup['total']),
+            ('cache_warmup_done', 'gauge', 'Выполнено запросов последнего прогрева', warmup['done']),
+            ('cache_warmup_seconds', 'gauge', 'Длительность последнего прогрева', warmup['seconds']),
+        ]
+    if profiler is not None:
+        values.append(('request_profiles_written_total', 'counter',
+                       'Сохранённые профили запросов', profiler.written))
+    version = index_manager.version
+    if version is not None and version.pool is not None:
+        values.append(('searcher_restarts_total', 'counter',
+                       'Перезапуски процессов searcher', version.pool.restarts))
+    return values
+
+
+metrics.register_collector(collect_metrics)
+
+
+@app.before_request
+def start_profile():
+    """Начать профиль запроса (выключенный профилировщик - одна проверка)"""
+    if profiler is not None:
+        g.profile = profiler.begin()
+
+
+@app.teardown_request
+def finish_profile(error):
+    """Сохранить профиль запроса, если он выбран или медленный"""
+    if profiler is not None:
+        record = g.pop('profile', None)
+        if record is not None:
+            rule = request.url_rule.rule if request.url_rule is not None else 'unknown'
+            profiler.end(record, f'{request.method} {rule}')
+
+
+@app.after_request
+def compress_response(response):
+    """Сжатие JSON и HTML ответов (потоковые, как export, не сжимаются)"""
+    if response.is_streamed or response.direct_passthrough:
+        return response
+    body = compressed_body(response, response.get_data(), request.accept_encodings)
+    if body is not None:
+        response.set_data(body)
+    return response
 
 
 @app.route('/')
 def index():
     """Главная страница с формой поиска"""
     stats = get_corpus_stats()
-    return render_template('search.html', stats=stats)
+    return render_page('search.html', stats=stats)
 
 
 @app.route('/search')
 def search():
     """Страница результатов поиска"""
     query = request.args.get('q', '').strip()
-    page = int(request.args.get('page', 1))
-    limit = 50
+    page = max(request.args.get('page', 1, type=int), 1)
+    limit = RESULTS_PER_PAGE
     
     if not query:
-        return render_template('search.html', stats=get_corpus_stats())
+        return render_page('search.html', stats=get_corpus_stats())
     
-    results = get_search_results(query, limit=limit)
+    try:
+        rank = parse_rank(request.args.get('rank'))
+    except ValueError:
+        rank = DEFAULT_RANK
+    filters = parse_filters(request.args)
     
-    return render_template('results.html', 
-                         query=query, 
-                         results=results,
-                         page=page,
-                         limit=limit)
+    results = get_search_results(query, limit=limit, offset=(page - 1) * limit, rank=rank,
+                                 filters=filters)
+    status = 503 if results.get('busy') else 200
+    
+    return render_page('results.html',
+                       query=query,
+                       results=results,
+                       page=page,
+                       limit=limit,
+                       rank=rank,
+                       filters=filters), status
 
 
 @app.route('/api/search')
 def api_search():
-    """API endpoint для поиска (JSON)"""
+    """
+    API endpoint для поиска (JSON)
+    
+    Параметры: q, limit, offset или cursor (next_cursor из предыдущего ответа),
+    rank (none - по ID документа, bm25 - по релевантности), фильтры фасетов
+    source, category, year (параметр можно повторить - любое из значений)
+    """
     query = request.args.get('q', '').strip()
-    limit = int(request.args.get('limit', 50))
+    limit = max(request.args.get('limit', 50, type=int), 1)
+    offset = max(request.args.get('offset', 0, type=int), 0)
     
     if not query:
         return jsonify({'error': 'Query is required', 'documents': []})
     
-    results = get_search_results(query, limit=limit)
-    return jsonify(results)
+    try:
+        rank = parse_rank(request.args.get('rank'))
+    except ValueError as e:
+        return jsonify({'error': str(e), 'documents': []}), 400
+    
+    filters = parse_filters(request.args)
+    
+    cursor = request.args.get('cursor')
+    if cursor:
+        try:
+            offset, limit = decode_cursor(cursor, page_key(result_key(query, rank), filters))
+        except InvalidCursor as e:
+            return jsonify({'error': str(e), 'documents': []}), 400
+    
+    # Повторный опрос той же страницы той же версии индекса - 304 без поиска
+    etag = current_search_etag(query, rank, offset, limit, filters)
+    if etag is not None and not_modified(request.if_none_match, etag):
+        return not_modified_response(app.response_class(), etag)
+    
+    results = get_search_results(query, limit=limit, offset=offset, rank=rank,
+                                 filters=filters)
+    return search_response(results, etag, jsonify)
+
+
+@app.route('/api/search/batch', methods=['POST'])
+def api_search_batch():
+    """
+    API endpoint для пакета запросов за один round trip (JSON)
+    
+    Тело: {"queries": [{"q": "...", "limit": 10}, ...]}; ответ: {"results": [...]}
+    в порядке запросов
+    """
+    try:
+        requests = parse_batch_request(request.get_json(silent=True))
+    except ValueError as e:
+        return jsonify({'error': str(e), 'results': []}), 400
+    
+    results = get_batch_results(requests)
+    status = 503 if results.get('busy') else 200
+    return jsonify(results), status
+
+
+@app.route('/api/search/export')
+def api_search_export():
+    """
+    Все найденные документы потоком NDJSON (application/x-ndjson)
+    
+    Параметры: q, rank и фильтры фасетов (как у /api/search). Первая запись -
+    header с total, затем по записи hit на документ. Тело отправляется
+    по частям (chunked) по мере чтения прямого индекса.
+    """
+    query = request.args.get('q', '').strip()
+    if not query:
+        return jsonify({'error': 'Query is required', 'documents': []})
+    
+    try:
+        rank = parse_rank(request.args.get('rank'))
+    except ValueError as e:
+        return jsonify({'error': str(e), 'documents': []}), 400
+    filters = parse_filters(request.args)
+    
+    started = time.perf_counter()
+    version = None
+    try:
+        # Версия индекса занята до закрытия ответа, а не до выхода из функции
+        version = index_manager.acquire_current()
+        source, ids, truncated = find_all_ids(version, query, result_key(query, rank), rank)
+        if filters and version.facets is not None:
+            ids = version.facets.filter(ids, filters)
+    except Exception as e:
+        if version is not None:
+            version.release()
+        results = error_result(e)
+        return jsonify(results), 503 if results.get('busy') else 200
+    record_search(source, started, len(ids))
+    
+    def generate():
+        yield export_header(query, len(ids), truncated)
+        yield from export_chunks(version, ids)
+    
+    response = Response(generate(), mimetype='application/x-ndjson')
+    response.call_on_close(version.release)
+    return response
+
+
+@app.route('/api/suggest')
+def api_suggest():
+    """
+    API endpoint для автодополнения (JSON)
+    
+    Параметры: prefix (набранный текст запроса), limit
+    """
+    limit = min(max(request.args.get('limit', 10, type=int), 1), SUGGEST_MAX_LIMIT)
+    try:
+        return jsonify(get_suggestions(request.args.get('prefix', ''), limit))
+    except Exception as e:
+        return jsonify(dict(error_result(e), suggestions=[]))
 
 
 @app.route('/api/stats')
@@ -124,6 +886,119 @@ def api_stats():
     return jsonify(get_corpus_stats())
 
 
+@app.route('/api/cache')
+def api_cache():
+    """API endpoint для счётчиков кэша результатов"""
+    return jsonify(query_cache.stats())
+
+
+def profile_allowed():
+    """Передан ли PROFILE_TOKEN (сравнение за постоянное время)"""
+    token = request.headers.get('X-Profile-Token', '')
+    return bool(PROFILE_TOKEN) and hmac.compare_digest(token.encode(), PROFILE_TOKEN.encode())
+
+
+@app.route('/api/profile')
+def api_profile():
+    """Настройки и счётчики профилировщика, файлы профилей (новые первыми)"""
+    if not profile_allowed():
+        abort(404)
+    if profiler is None:
+        return jsonify({'enabled': False, 'files': []})
+    return jsonify(dict(profiler.stats(), enabled=True))
+
+
+@app.route('/api/profile/<name>')
+def api_profile_file(name):
+    """Профиль запроса в формате collapsed stacks (для flamegraph.pl, speedscope)"""
+    if profiler is None or not profile_allowed():
+        abort(404)
+    return send_from_directory(profiler.directory, name, mimetype='text/plain')
+
+
+def current_search_etag(query, rank, offset, limit, filters=None):
+    """ETag страницы результатов для текущей версии индекса; None - индекс не загружен"""
+    try:
+        generation = index_manager.current().generation
+    except Exception:
+        return None
+    return search_etag(page_key(result_key(query, rank), filters), offset, limit, generation)
+
+
+def search_response(results, etag, make_response):
+    """
+    (ответ, статус) для /api/search: ETag только у успешного полного
+    результата, ответы с ошибкой или неполные не должны попадать в кэш клиента
+    """
+    response = make_response(results)
+    if results.get('busy'):
+        return response, 503
+    if etag is not None and 'error' not in results and not results.get('truncated'):
+        # Слабый: search_us, did_you_mean и счётчики фасетов от запроса к запросу
+        # могут отличаться при тех же документах страницы
+        response.set_etag(etag, weak=True)
+    return response, 200
+
+
+def not_modified_response(response, etag):
+    """Ответ 304 на If-None-Match: без поиска и без тела"""
+    metrics.search_requests.labels('not_modified').inc()
+    response.status_code = 304
+    response.set_etag(etag, weak=True)
+    response.vary.add('Accept-Encoding')
+    return response
+
+
+def compressed_body(response, data, accept_encodings):
+    """
+    Сжать тело JSON или HTML ответа по Accept-Encoding: выставляет заголовки
+    и возвращает сжатые байты; None - ответ отправляется как есть
+    """
+    if (COMPRESS_LEVEL <= 0 or not data or not compressible(response.mimetype)
+            or 'Content-Encoding' in response.headers):
+        return None
+    response.vary.add('Accept-Encoding')
+    encoding = choose_encoding(accept_encodings)
+    if encoding is None or len(data) < COMPRESS_MIN_BYTES:
+        metrics.response_compression.labels('identity').inc()
+        return None
+
+    metrics.response_compression.labels(encoding).inc()
+    response.headers['Content-Encoding'] = encoding
+    etag, weak = response.get_etag()
+    if etag:
+        # Свой ETag для каждой кодировки (not_modified отбрасывает суффикс)
+        response.set_etag(f'{etag}-{encoding}', weak)
+    return compress(data, encoding, COMPRESS_LEVEL)
+
+
+def get_readiness():
+    """
+    (тело ответа, готов ли): индекс загружен и прогрев кэша для текущей
+    версии индекса завершён
+    """
+    version = index_manager.current()
+    warmup = warmer.progress() if warmer is not None else None
+    ready = warmer is None or not warmer.running(version.generation)
+    return {'ready': ready, 'generation': version.generation, 'warmup': warmup}, ready
+
+
+@app.route('/ready')
+def ready():
+    """Проверка готовности для балансировщика: 503, пока идёт прогрев кэша"""
+    try:
+        body, ready = get_readiness()
+    except Exception as e:
+        return jsonify({'ready': False, 'error': str(e)}), 503
+    return jsonify(body), 200 if ready else 503
+
+
+@app.route('/metrics')
+def metrics_endpoint():
+    """Метрики в текстовом формате Prometheus"""
+    return Response(metrics.render(), content_type=metrics.CONTENT_TYPE)
+
+
 if __name__ == '__main__':
     # Проверить наличие searcher
     if not os.path.exists(SEARCHER_PATH):
@@ -138,6 +1013,8 @@ if __name__ == '__main__':
     port = int(os.getenv('FLASK_PORT', 5000))
     debug = os.getenv('FLASK_ENV', 'production') == 'development'
     
+    corpus_stats.start()
+    
     print(f"Запуск сервера на http://{host}:{port}")
     app.run(host=host, port=port, debug=debug)
 
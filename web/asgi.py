@@ -0,0 +1,510 @@
+#!/usr/bin/env python3
+"""
+Асинхронный (ASGI) режим веб-интерфейса на Quart.
+
+Те же маршруты и шаблоны, что и в app.py, но ожидание searcher'а не
+блокирует поток: запросы к searcher'у идут через asyncio-пул процессов,
+число одновременных поисков ограничено semaphore, а лишняя нагрузка
+сразу получает 503 вместо накопления в очереди.
+
+Запуск:
+    hypercorn asgi:app --bind 0.0.0.0:5000
+"""
+
+import asyncio
+import os
+import time
+import weakref
+from array import array
+from contextlib import asynccontextmanager
+
+from quart import Quart, Response, render_template, request, jsonify
+from quart.wrappers.response import DataBody, IterableBody
+
+import metrics
+
+from app import (SEARCHER_PATH, SEARCHER_POOL_SIZE, SEARCHER_TIMEOUT,
+                 SEARCHER_QUEUE_SIZE, SEARCHER_QUEUE_TIMEOUT, RESULTS_PER_PAGE,
+                 query_cache, get_corpus_stats, index_manager, fetch_documents,
+                 SEARCH_BACKEND, search_in_process, record_search,
+                 error_result, parse_batch_request, attach_snippets,
+                 EXPORT_CHUNK_DOCS, export_header, export_chunk,
+                 SUGGEST_MAX_LIMIT, get_suggestions, suggest_correction,
+                 RANK_DEPTH, DEFAULT_RANK, parse_rank, result_key,
+                 warmer, log_query, get_readiness, current_search_etag,
+                 search_response, not_modified_response, compressed_body,
+                 parse_filters, page_key, add_facets, SEARCH_BUDGET_MS, record_truncated)
+from async_searcher import AsyncSearcherPool, SearchLimiter
+from singleflight import AsyncSingleFlight
+from query_parser import normalize_query
+from pagination import InvalidCursor, decode_cursor, next_cursor
+from http_cache import not_modified
+
+app = Quart(__name__)
+
+# Сколько поисков выполняется одновременно (остальные ждут или получают 503)
+SEARCH_CONCURRENCY = int(os.getenv('SEARCH_CONCURRENCY', max(SEARCHER_POOL_SIZE, 1) * 2))
+
+search_limiter = None
+loop = None
+search_flights = AsyncSingleFlight()
+
+
+async def create_searcher_pool(version):
+    pool = AsyncSearcherPool(SEARCHER_PATH, version.index_arg,
+                             size=max(SEARCHER_POOL_SIZE, 1),
+                             timeout=SEARCHER_TIMEOUT,
+                             queue_timeout=SEARCHER_QUEUE_TIMEOUT,
+                             pass_fds=(version.fd,))
+    await pool.start()
+    try:
+        await pool.wait_ready(SEARCHER_TIMEOUT)
+    except BaseException:
+        await pool.close()
+        raise
+    return pool
+
+
+def start_searcher_pool(version):
+    """
+    Хук загрузки версии индекса: вызывается из потока (первая загрузка
+    или фоновая проверка), а пул процессов живёт в цикле событий сервера
+    """
+    if SEARCH_BACKEND == 'inprocess':
+        return
+    version.pool = asyncio.run_coroutine_threadsafe(create_searcher_pool(version), loop).result()
+
+
+def stop_searcher_pool(version):
+    if version.pool is not None:
+        asyncio.run_coroutine_threadsafe(version.pool.close(), loop).result()
+
+
+def warm_query(version, query, rank):
+    """Запрос прогрева из потока Warmer: вычисляется в цикле событий сервера"""
+    source, _, _ = asyncio.run_coroutine_threadsafe(
+        find_all_ids(version, query, result_key(query, rank), rank), loop).result()
+    return source != 'cache'
+
+
+@app.before_serving
+async def start_searchers():
+    global search_limiter, loop
+    loop = asyncio.get_running_loop()
+    index_manager.on_load = start_searcher_pool
+    index_manager.on_close = stop_searcher_pool
+    if warmer is not None:
+        warmer.run = warm_query
+    await asyncio.to_thread(index_manager.current)
+    search_limiter = SearchLimiter(SEARCH_CONCURRENCY, SEARCHER_QUEUE_SIZE)
+
+
+@app.after_serving
+async def stop_searchers():
+    await asyncio.to_thread(index_manager.stop)
+
+
+@asynccontextmanager
+async def use_index():
+    """
+    index_manager.use() для цикла событий: версия занимается в потоке, потому
+    что первая загрузка индекса (mmap, запуск searcher'ов) блокирует, а её
+    хук on_load сам ждёт цикл событий
+    """
+    version = await asyncio.to_thread(index_manager.acquire_current)
+    try:
+        yield version
+    finally:
+        version.release()
+
+
+async def get_search_results(query, limit=50, offset=0, rank='none', filters=None):
+    """Асинхронный вариант app.get_search_results"""
+    started = time.perf_counter()
+    try:
+        async with search_limiter:
+            async with use_index() as version:
+                result = await search_page(version, query, limit, offset, started, rank,
+                                           filters)
+                if not result['total'] and not result.get('truncated'):
+                    await asyncio.to_thread(suggest_correction, version, query, result)
+                else:
+                    log_query(query, offset, rank)
+                return result
+    except Exception as e:
+        return error_result(e)
+
+
+async def evaluate_query(version, query, key, limit, rank='none'):
+    """Асинхронный вариант app.evaluate_query"""
+    generation = version.generation
+    owner = await asyncio.to_thread(query_cache.claim, key, generation, SEARCHER_TIMEOUT)
+    if owner is None:
+        ids = await asyncio.to_thread(query_cache.wait, key, generation, SEARCHER_TIMEOUT)
+        if ids is not None:
+            metrics.search_coalesced.labels('worker').inc()
+            return 'coalesced', {'total': len(ids),
+                                 'documents': await asyncio.to_thread(fetch_documents, version,
+                                                                      ids[:limit]),
+                                 'ids': ids,
+                                 'cached': True}
+        owner = await asyncio.to_thread(query_cache.claim, key, generation, SEARCHER_TIMEOUT)
+
+    rank_depth = RANK_DEPTH if rank == 'bm25' else 0
+    try:
+        if SEARCH_BACKEND == 'inprocess':
+            source = 'inprocess'
+            result = await asyncio.to_thread(search_in_process, version, query, limit, rank_depth,
+                                             SEARCH_BUDGET_MS)
+        else:
+            source = 'searcher'
+            result = await version.pool.search(query, limit=limit, with_ids=True,
+                                               rank_depth=rank_depth, budget_ms=SEARCH_BUDGET_MS)
+        result['ids'] = array('I', result.get('ids', []))
+        if result.get('truncated'):
+            record_truncated(query)
+        else:
+            await asyncio.to_thread(query_cache.put, key, generation, result['ids'])
+    finally:
+        if owner is not None:
+            await asyncio.to_thread(query_cache.release, key, generation, owner)
+    return source, result
+
+
+async def search_page(version, query, limit, offset, started, rank='none', filters=None):
+    """get_search_results для одной версии индекса"""
+    key = result_key(query, rank)
+    generation = version.generation
+    cursor_key = page_key(key, filters)
+    filters = filters if version.facets is not None else None
+
+    # Дисковый уровень кэша - SQLite, поэтому обращение к кэшу в потоке
+    ids = await asyncio.to_thread(query_cache.get, key, generation)
+
+    if ids is None:
+        first_limit = limit if offset == 0 and not filters else 0
+        (source, response), shared = await search_flights.do(
+            (generation, key, first_limit),
+            lambda: evaluate_query(version, query, key, first_limit, rank))
+        if shared:
+            metrics.search_coalesced.labels('process').inc()
+            source = 'coalesced'
+        ids = response['ids']
+        if first_limit:
+            result = {name: value for name, value in response.items() if name != 'ids'}
+            result.update(documents=[dict(document) for document in response['documents']],
+                          offset=0, limit=limit,
+                          next_cursor=next_cursor(cursor_key, 0, limit, len(ids)))
+            await asyncio.to_thread(attach_snippets, version, result['documents'], query)
+            await asyncio.to_thread(add_facets, version, result, ids, filters)
+            record_search(source, started, len(ids))
+            return result
+        cached = response.get('cached', False)
+        truncated = response.get('truncated', False)
+    else:
+        source = 'cache'
+        cached = True
+        truncated = False
+
+    all_ids = ids
+    if filters:
+        ids = await asyncio.to_thread(version.facets.filter, ids, filters)
+    documents = await asyncio.to_thread(fetch_documents, version, ids[offset:offset + limit])
+    await asyncio.to_thread(attach_snippets, version, documents, query)
+    record_search(source, started, len(ids))
+    result = {'total': len(ids),
+              'documents': documents,
+              'offset': offset,
+              'limit': limit,
+              'next_cursor': next_cursor(cursor_key, offset, limit, len(ids)),
+              'cached': cached}
+    if truncated:
+        result['truncated'] = True
+    return await asyncio.to_thread(add_facets, version, result, all_ids, filters)
+
+
+async def find_all_ids(version, query, key, rank='none'):
+    """Асинхронный вариант app.find_all_ids"""
+    ids = await asyncio.to_thread(query_cache.get, key, version.generation)
+    if ids is not None:
+        return 'cache', ids, False
+
+    (source, response), shared = await search_flights.do(
+        (version.generation, key, 0),
+        lambda: evaluate_query(version, query, key, 0, rank))
+    if shared:
+        metrics.search_coalesced.labels('process').inc()
+        source = 'coalesced'
+    return source, response['ids'], response.get('truncated', False)
+
+
+async def get_batch_results(requests):
+    """Асинхронный вариант app.get_batch_results"""
+    started = time.perf_counter()
+    try:
+        async with search_limiter:
+            async with use_index() as version:
+                return await search_batch(version, requests, started)
+    except Exception as e:
+        return dict(error_result(e), results=[])
+
+
+async def search_batch(version, requests, started):
+    """get_batch_results для одной версии индекса"""
+    generation = version.generation
+    keys = [normalize_query(query) for query, _ in requests]
+    results = [None] * len(requests)
+    pending = {}  # ключ запроса -> позиции в пакете
+
+    for position, ((query, limit), key) in enumerate(zip(requests, keys)):
+        ids = await asyncio.to_thread(query_cache.get, key, generation)
+        if ids is None:
+            pending.setdefault(key, []).append(position)
+            continue
+        results[position] = {'query': query,
+                             'total': len(ids),
+                             'documents': await asyncio.to_thread(fetch_documents, version,
+                                                                  ids[:limit]),
+                             'cached': True}
+        record_search('cache', started, len(ids))
+
+    groups = list(pending.values())
+    batch = [(requests[group[0]][0], max(requests[position][1] for position in group))
+             for group in groups]
+
+    responses = []
+    source = 'inprocess' if SEARCH_BACKEND == 'inprocess' else 'searcher'
+    if batch and source == 'inprocess':
+        responses = await asyncio.to_thread(
+            lambda: [search_in_process(version, query, limit, budget_ms=SEARCH_BUDGET_MS)
+                     for query, limit in batch])
+    elif batch:
+        responses = await version.pool.search_many(batch, with_ids=True,
+                                                   budget_ms=SEARCH_BUDGET_MS)
+
+    for group, response in zip(groups, responses):
+        ids = array('I', response.pop('ids', []))
+        truncated = response.get('truncated', False)
+        if truncated:
+            record_truncated(requests[group[0]][0])
+        else:
+            await asyncio.to_thread(query_cache.put, keys[group[0]], generation, ids)
+        record_search(source, started, len(ids))
+        for position in group:
+            query, limit = requests[position]
+            results[position] = {'query': query,
+                                 'total': len(ids),
+                                 'documents': response['documents'][:limit],
+                                 'search_us': response['search_us']}
+            if truncated:
+                results[position]['truncated'] = True
+
+    return {'results': results}
+
+
+async def render_page(template, **context):
+    """render_template с замером времени рендеринга"""
+    started = time.perf_counter()
+    page = await render_template(template, **context)
+    metrics.RENDER.observe(time.perf_counter() - started)
+    return page
+
+
+@app.after_request
+async def compress_response(response):
+    """Сжатие JSON и HTML ответов (см. app.compress_response)"""
+    if not isinstance(response.response, DataBody):
+        return response
+    data = await response.get_data()
+    body = await asyncio.to_thread(compressed_body, response, data, request.accept_encodings)
+    if body is not None:
+        response.set_data(body)
+    return response
+
+
+@app.route('/')
+async def index():
+    """Главная страница с формой поиска"""
+    return await render_page('search.html', stats=get_corpus_stats())
+
+
+@app.route('/search')
+async def search():
+    """Страница результатов поиска"""
+    query = request.args.get('q', '').strip()
+    page = max(request.args.get('page', 1, type=int), 1)
+    limit = RESULTS_PER_PAGE
+
+    if not query:
+        return await render_page('search.html', stats=get_corpus_stats())
+
+    try:
+        rank = parse_rank(request.args.get('rank'))
+    except ValueError:
+        rank = DEFAULT_RANK
+    filters = parse_filters(request.args)
+
+    results = await get_search_results(query, limit=limit, offset=(page - 1) * limit, rank=rank,
+                                       filters=filters)
+    status = 503 if results.get('busy') else 200
+
+    return await render_page('results.html',
+                             query=query,
+                             results=results,
+                             page=page,
+                             limit=limit,
+                             rank=rank,
+                             filters=filters), status
+
+
+@app.route('/api/search')
+async def api_search():
+    """API endpoint для поиска (JSON), параметры как в app.api_search"""
+    query = request.args.get('q', '').strip()
+    limit = max(request.args.get('limit', 50, type=int), 1)
+    offset = max(request.args.get('offset', 0, type=int), 0)
+
+    if not query:
+        return jsonify({'error': 'Query is required', 'documents': []})
+
+    try:
+        rank = parse_rank(request.args.get('rank'))
+    except ValueError as e:
+        return jsonify({'error': str(e), 'documents': []}), 400
+
+    filters = parse_filters(request.args)
+
+    cursor = request.args.get('cursor')
+    if cursor:
+        try:
+            offset, limit = decode_cursor(cursor, page_key(result_key(query, rank), filters))
+        except InvalidCursor as e:
+            return jsonify({'error': str(e), 'documents': []}), 400
+
+    etag = await asyncio.to_thread(current_search_etag, query, rank, offset, limit, filters)
+    if etag is not None and not_modified(request.if_none_match, etag):
+        return not_modified_response(app.response_class(''), etag)
+
+    results = await get_search_results(query, limit=limit, offset=offset, rank=rank,
+                                       filters=filters)
+    return search_response(results, etag, jsonify)
+
+
+@app.route('/api/search/batch', methods=['POST'])
+async def api_search_batch():
+    """API endpoint для пакета запросов (см. app.api_search_batch)"""
+    try:
+        requests = parse_batch_request(await request.get_json(silent=True))
+    except ValueError as e:
+        return jsonify({'error': str(e), 'results': []}), 400
+
+    results = await get_batch_results(requests)
+    status = 503 if results.get('busy') else 200
+    return jsonify(results), status
+
+
+@app.route('/api/search/export')
+async def api_search_export():
+    """Все найденные документы потоком NDJSON (см. app.api_search_export)"""
+    query = request.args.get('q', '').strip()
+    if not query:
+        return jsonify({'error': 'Query is required', 'documents': []})
+
+    try:
+        rank = parse_rank(request.args.get('rank'))
+    except ValueError as e:
+        return jsonify({'error': str(e), 'documents': []}), 400
+    filters = parse_filters(request.args)
+
+    started = time.perf_counter()
+    version = None
+    try:
+        async with search_limiter:
+            version = await asyncio.to_thread(index_manager.acquire_current)
+            source, ids, truncated = await find_all_ids(version, query, result_key(query, rank),
+                                                        rank)
+            if filters and version.facets is not None:
+                ids = await asyncio.to_thread(version.facets.filter, ids, filters)
+    except Exception as e:
+        if version is not None:
+            version.release()
+        results = error_result(e)
+        return jsonify(results), 503 if results.get('busy') else 200
+    record_search(source, started, len(ids))
+
+    async def generate():
+        yield export_header(query, len(ids), truncated)
+        for start in range(0, len(ids), EXPORT_CHUNK_DOCS):
+            yield await asyncio.to_thread(export_chunk, version, ids, start)
+
+    # Версия занята до закрытия тела ответа (аналог call_on_close в app.py)
+    return Response(ClosingBody(generate(), version.release), mimetype='application/x-ndjson')
+
+
+class ClosingBody(IterableBody):
+    """
+    Потоковое тело ответа, которое вызывает on_close ровно один раз: когда
+    сервер закончил или прервал отправку (в том числе при отключении
+    клиента до первого chunk'а, когда finally генератора не выполняется),
+    а если тело так и не было отправлено - при удалении ответа
+    """
+
+    def __init__(self, iterable, on_close):
+        super().__init__(iterable)
+        self.closed = weakref.finalize(self, on_close)
+
+    async def __aexit__(self, exc_type, exc_value, tb):
+        try:
+            await super().__aexit__(exc_type, exc_value, tb)
+        finally:
+            self.closed()
+
+
+@app.route('/api/suggest')
+async def api_suggest():
+    """API endpoint для автодополнения (см. app.api_suggest)"""
+    limit = min(max(request.args.get('limit', 10, type=int), 1), SUGGEST_MAX_LIMIT)
+    # В потоке: get_suggestions занимает версию индекса, а её первая загрузка блокирует
+    try:
+        return jsonify(await asyncio.to_thread(get_suggestions, request.args.get('prefix', ''),
+                                               limit))
+    except Exception as e:
+        return jsonify(dict(error_result(e), suggestions=[]))
+
+
+@app.route('/api/stats')
+async def api_stats():
+    """API endpoint для статистики (снимок, обновляемый в фоне)"""
+    return jsonify(get_corpus_stats())
+
+
+@app.route('/api/cache')
+async def api_cache():
+    """API endpoint для счётчиков кэша результатов"""
+    return jsonify(query_cache.stats())
+
+
+@app.route('/ready')
+async def ready():
+    """Проверка готовности для балансировщика: 503, пока идёт прогрев кэша"""
+    try:
+        body, ready = await asyncio.to_thread(get_readiness)
+    except Exception as e:
+        return jsonify({'ready': False, 'error': str(e)}), 503
+    return jsonify(body), 200 if ready else 503
+
+
+@app.route('/metrics')
+async def metrics_endpoint():
+    """Метрики в текстовом формате Prometheus"""
+    return Response(metrics.render(), content_type=metrics.CONTENT_TYPE)
+
+
+if __name__ == '__main__':
+    from hypercorn.asyncio import serve
+    from hypercorn.config import Config
+
+    config = Config()
+    config.bind = [f"{os.getenv('FLASK_HOST', '0.0.0.0')}:{os.getenv('FLASK_PORT', 5000)}"]
+    print(f"Запуск ASGI-сервера на http://{config.bind[0]}")
+    asyncio.run(serve(app, config))
@@ -0,0 +1,265 @@
+"""
+Асинхронный пул процессов C++ searcher для режима ASGI.
+
+Тот же протокол, что и в searcher_pool (--batch --format=jsonl),
+но чтение и запись идут через asyncio: ожидание ответа searcher'а
+не занимает поток, и один процесс веб-сервера держит сотни соединений.
+"""
+
+import asyncio
+import json
+import time
+
+import metrics
+
+from searcher_pool import (SearcherError, SearcherTimeout, SearcherBusy,
+                           ResponseParser, format_request)
+
+# Заголовок со списком ID может быть длинной строкой
+_STREAM_LIMIT = 64 * 1024 * 1024
+
+
+class AsyncSearcherWorker:
+    """Один процесс searcher, управляемый из event loop"""
+
+    def __init__(self, process):
+        self.process = process
+        self.ready = False
+
+    @classmethod
+    async def spawn(cls, searcher_path, index_path, pass_fds=()):
+        started = time.perf_counter()
+        process = await asyncio.create_subprocess_exec(
+            searcher_path, f'--index={index_path}', '--batch', '--format=jsonl',
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.DEVNULL,
+            limit=_STREAM_LIMIT,
+            pass_fds=pass_fds,
+        )
+        metrics.SPAWN.observe(time.perf_counter() - started)
+        return cls(process)
+
+    def alive(self):
+        return self.process.returncode is None
+
+    def kill(self):
+        # returncode появляется, только когда процесс подобран, - он мог
+        # уже завершиться сам
+        try:
+            self.process.kill()
+        except ProcessLookupError:
+            pass
+
+    async def wait_ready(self):
+        """Дождаться записи ready: индекс загружен"""
+        while not self.ready:
+            line = await self.process.stdout.readline()
+            if not line:
+                raise SearcherError('Searcher завершился')
+            self.ready = json.loads(line).get('type') == 'ready'
+
+    async def _write(self, data):
+        try:
+            self.process.stdin.write(data)
+            await self.process.stdin.drain()
+        except (BrokenPipeError, ConnectionResetError) as e:
+            raise SearcherError(f'Searcher недоступен: {e}')
+
+    async def search(self, query, limit, with_ids=False, rank_depth=0, budget_ms=0):
+        await self._write(format_request(query, limit, with_ids, rank_depth, budget_ms))
+        return await self._read()
+
+    async def search_many(self, requests, with_ids=False, budget_ms=0):
+        """Пакет запросов [(запрос, limit)] с общим кэшем термов (см. SearcherWorker)"""
+        await self._write(b':batch %d\n' % len(requests))
+        results = []
+        for query, limit in requests:
+            await self._write(format_request(query, limit, with_ids, budget_ms=budget_ms))
+            results.append(await self._read())
+        return results
+
+    async def _read(self):
+        started = time.perf_counter()
+        parser = ResponseParser()
+        parse_seconds = 0.0
+        try:
+            while True:
+                line = await self.process.stdout.readline()
+                if not line:
+                    raise SearcherError('Searcher завершился')
+                parse_started = time.perf_counter()
+                done = parser.feed(line)
+                parse_seconds += time.perf_counter() - parse_started
+                if done:
+                    result = parser.result()
+                    metrics.observe_response(time.perf_counter() - started,
+                                             parse_seconds, result['search_us'])
+                    return result
+        except (ValueError, KeyError) as e:
+            raise SearcherError(f'Некорректный ответ searcher: {e}')
+
+    async def close(self):
+        if self.alive():
+            self.process.stdin.close()
+            try:
+                await asyncio.wait_for(self.process.wait(), timeout=1)
+            except asyncio.TimeoutError:
+                self.kill()
+                await self.process.wait()
+
+
+class AsyncSearcherPool:
+    """
+    Пул процессов searcher для asyncio.
+
+    size          - количество процессов
+    timeout       - время на один запрос, после которого процесс перезапускается
+    queue_timeout - сколько запрос может ждать свободный процесс
+    """
+
+    def __init__(self, searcher_path, index_path, size=4, timeout=30.0, queue_timeout=5.0,
+                 pass_fds=()):
+        self.searcher_path = searcher_path
+        self.index_path = index_path
+        self.pass_fds = pass_fds
+        self.size = size
+        self.timeout = timeout
+        self.queue_timeout = queue_timeout
+        self.idle = asyncio.LifoQueue()
+        self.workers = []  # все процессы пула, и свободные, и занятые
+        self.recycling = set()  # фоновые замены убитых процессов
+        self.restarts = 0
+        self.closed = False
+
+    async def start(self):
+        workers = await asyncio.gather(*(self._spawn() for _ in range(self.size)))
+        for worker in workers:
+            self.idle.put_nowait(worker)
+
+    async def _spawn(self):
+        worker = await AsyncSearcherWorker.spawn(self.searcher_path, self.index_path,
+                                                 self.pass_fds)
+        self.workers.append(worker)
+        return worker
+
+    async def wait_ready(self, timeout):
+        """Дождаться загрузки индекса всеми процессами (до первого запроса к пулу)"""
+        workers = [self.idle.get_nowait() for _ in range(self.idle.qsize())]
+        try:
+            await asyncio.wait_for(
+                asyncio.gather(*(worker.wait_ready() for worker in workers)), timeout)
+        finally:
+            for worker in workers:
+                self.idle.put_nowait(worker)
+
+    async def _replace(self, worker):
+        if worker in self.workers:
+            self.workers.remove(worker)
+        if worker.alive():
+            worker.kill()
+        await worker.process.wait()
+        if self.closed:
+            # Пул остановлен (процесс убит close()): замена не нужна
+            return worker
+        self.restarts += 1
+        return await self._spawn()
+
+    def _recycle(self, worker):
+        """Убить процесс и заменить его в фоне; замена попадёт в очередь"""
+        worker.kill()
+        task = asyncio.ensure_future(self._restore(worker))
+        self.recycling.add(task)
+        task.add_done_callback(self.recycling.discard)
+
+    async def _restore(self, worker):
+        try:
+            worker = await self._replace(worker)
+        except Exception as e:
+            # Новый процесс не запустился: в очередь идёт убитый, его
+            # заменит следующий запрос (alive() уже False)
+            print(f'Не удалось перезапустить searcher: {e}')
+        if self.closed:
+            await worker.close()
+        else:
+            self.idle.put_nowait(worker)
+
+    async def search(self, query, limit=50, with_ids=False, rank_depth=0, budget_ms=0):
+        """Выполнить запрос на свободном процессе (см. SearcherPool.search)"""
+        return await self._run(lambda worker: worker.search(query, limit, with_ids, rank_depth,
+                                                            budget_ms))
+
+    async def search_many(self, requests, with_ids=False, budget_ms=0):
+        """Пакет запросов на одном процессе (см. SearcherPool.search_many)"""
+        return await self._run(lambda worker: worker.search_many(requests, with_ids, budget_ms))
+
+    async def _run(self, call):
+        if self.closed:
+            raise SearcherError('Пул остановлен')
+
+        started = time.perf_counter()
+        try:
+            worker = await asyncio.wait_for(self.idle.get(), self.queue_timeout)
+        except asyncio.TimeoutError:
+            raise SearcherBusy('Searcher busy')
+        finally:
+            metrics.QUEUE_WAIT.observe(time.perf_counter() - started)
+
+        try:
+            if not worker.alive():
+                worker = await self._replace(worker)
+            return await asyncio.wait_for(call(worker), self.timeout)
+        except asyncio.TimeoutError:
+            worker = await self._replace(worker)
+            raise SearcherTimeout('Timeout')
+        except SearcherError:
+            worker = await self._replace(worker)
+            raise
+        except asyncio.CancelledError:
+            # Клиент ушёл посреди ответа: протокол процесса рассинхронизирован.
+            # Пока процесс не подобран, alive() его не отличит от рабочего,
+            # поэтому в очередь вместо него вернётся замена
+            self._recycle(worker)
+            worker = None
+            raise
+        finally:
+            if worker is not None:
+                if self.closed:
+                    # Пул остановлен, пока процесс был занят: в очередь не возвращается
+                    await worker.close()
+                else:
+                    self.idle.put_nowait(worker)
+
+    async def close(self):
+        """Остановить все процессы пула, в том числе занятые запросами"""
+        self.closed = True
+        workers, self.workers = self.workers, []
+        await asyncio.gather(*(worker.close() for worker in workers))
+        await asyncio.gather(*self.recycling, return_exceptions=True)
+
+
+class SearchLimiter:
+    """
+    Ограничение одновременных поисков: semaphore на concurrency выполняющихся
+    и не более queue_size ожидающих; остальные сразу получают SearcherBusy (503).
+    """
+
+    def __init__(self, concurrency, queue_size):
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.capacity = concurrency + queue_size
+        self.pending = 0
+
+    async def __aenter__(self):
+        if self.pending >= self.capacity:
+            raise SearcherBusy('Searcher busy')
+        self.pending += 1
+        try:
+            await self.semaphore.acquire()
+        except BaseException:
+            self.pending -= 1
+            raise
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.semaphore.release()
+        self.pending -= 1
@@ -0,0 +1,410 @@
+#!/usr/bin/env python3
+"""
+Нагрузочный бенчмарк API поиска (/api/search).
+
+Индекс строится из синтетического корпуса с ципфовским распределением слов,
+поэтому бенчмарк не требует MongoDB и data/. Смесь запросов: одиночные
+термы, длинные цепочки И, веера ИЛИ, запросы с НЕ и промахи.
+
+Режимы выполнения запросов (конфигурация app.py):
+    subprocess  отдельный процесс searcher на каждый запрос (SEARCHER_POOL_SIZE=0)
+    pool        постоянные процессы searcher
+    inprocess   query_engine.py в процессе веб-сервера (SEARCH_BACKEND=inprocess)
+Транспорт: client - test client Flask без сети, http - werkzeug на localhost.
+
+app.py читает конфигурацию из окружения при импорте, поэтому каждый режим
+измеряется в отдельном процессе. Кэш результатов отключён: измеряется
+вычисление запросов, а не попадания в кэш.
+
+Параметры (переменные окружения):
+    BENCH_DOCS, BENCH_SEED      размер и seed синтетического корпуса
+    BENCH_REQUESTS              запросов на каждый режим и транспорт
+    BENCH_CONCURRENCY           одновременных клиентов
+    BENCH_MODES, BENCH_TRANSPORTS  списки через запятую
+    BENCH_REGRESSION            порог регрессии для compare (доля)
+
+Использование:
+    python benchmark.py [результат.json]
+    python benchmark.py compare старый.json новый.json
+"""
+
+import http.client
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+from datetime import datetime, timezone
+
+SEARCHER_PATH = os.getenv('SEARCHER_PATH', '../engine/searcher')
+INDEXER_PATH = os.getenv('INDEXER_PATH', '../engine/indexer')
+BUILD_DOCSTORE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                              '..', 'scripts', 'build_docstore.py')
+
+BENCH_DOCS = int(os.getenv('BENCH_DOCS', 20000))
+BENCH_SEED = int(os.getenv('BENCH_SEED', 1))
+BENCH_REQUESTS = int(os.getenv('BENCH_REQUESTS', 2000))
+BENCH_CONCURRENCY = int(os.getenv('BENCH_CONCURRENCY', 4))
+BENCH_MODES = os.getenv('BENCH_MODES', 'subprocess,pool,inprocess').split(',')
+BENCH_TRANSPORTS = os.getenv('BENCH_TRANSPORTS', 'client,http').split(',')
+BENCH_REGRESSION = float(os.getenv('BENCH_REGRESSION', 0.15))
+
+VOCABULARY_SIZE = 8000
+WARMUP_REQUESTS = 50
+RESULT_LIMIT = 50
+
+# Доли видов запросов в смеси
+QUERY_MIX = (
+    ('term', 0.35),
+    ('and_chain', 0.20),
+    ('or_fan', 0.20),
+    ('not', 0.15),
+    ('miss', 0.10),
+)
+
+MODE_ENVIRONMENT = {
+    'subprocess': {'SEARCHER_POOL_SIZE': '0', 'SEARCH_BACKEND': 'searcher'},
+    'pool': {'SEARCH_BACKEND': 'searcher'},
+    'inprocess': {'SEARCH_BACKEND': 'inprocess'},
+}
+
+_SYLLABLES = ('ба', 'ве', 'го', 'ду', 'жи', 'за', 'ки', 'ло', 'ма', 'не', 'по', 'ра',
+              'си', 'ту', 'фе', 'хо', 'це', 'чу', 'ша', 'эк', 'ян', 'ор', 'ин', 'ус')
+
+
+def make_vocabulary(rng, size=VOCABULARY_SIZE):
+    """Псевдослова из слогов; индекс слова - его ранг по частоте"""
+    words = set()
+    while len(words) < size:
+        words.add(''.join(rng.choice(_SYLLABLES) for _ in range(rng.randint(2, 4))))
+    return sorted(words, key=lambda word: (len(word), word))
+
+
+def make_corpus(path, num_docs, seed):
+    """corpus.json в формате scripts/export_corpus.py"""
+    rng = random.Random(seed)
+    vocabulary = make_vocabulary(rng)
+    # Закон Ципфа: частота слова обратно пропорциональна рангу
+    weights = [1 / rank for rank in range(1, len(vocabulary) + 1)]
+    cumulative = []
+    total = 0.0
+    for weight in weights:
+        total += weight
+        cumulative.append(total)
+
+    with open(path, 'w', encoding='utf-8') as f:
+        for doc_id in range(num_docs):
+            words = rng.choices(vocabulary, cum_weights=cumulative, k=rng.randint(40, 300))
+            f.write(json.dumps({
+                'title': ' '.join(words[:6]),
+                'text': ' '.join(words[6:]),
+                'url': f'https://bench.example/{doc_id}',
+                'category': f'категория {doc_id % 7}',
+                'source': f'источник {doc_id % 5}',
+            }, ensure_ascii=False) + '\n')
+    return vocabulary
+
+
+def build_fixture(num_docs=BENCH_DOCS, seed=BENCH_SEED):
+    """Каталог с corpus.json, index.bin и index.docs (строится один раз на параметры)"""
+    directory = os.path.join(tempfile.gettempdir(), f'ir_bench_{num_docs}_{seed}')
+    index_path = os.path.join(directory, 'index.bin')
+    vocabulary_path = os.path.join(directory, 'vocabulary.json')
+    if os.path.exists(index_path) and os.path.exists(vocabulary_path):
+        return directory
+
+    os.makedirs(directory, exist_ok=True)
+    corpus_path = os.path.join(directory, 'corpus.json')
+    print(f'Синтетический корпус: {num_docs} документов -> {directory}')
+    vocabulary = make_corpus(corpus_path, num_docs, seed)
+
+    subprocess.run([INDEXER_PATH, f'--input={corpus_path}', f'--output={index_path}'],
+                   check=True, stdout=subprocess.DEVNULL)
+    subprocess.run([sys.executable, BUILD_DOCSTORE, corpus_path,
+                    os.path.join(directory, 'index.docs'), index_path],
+                   check=True, stdout=subprocess.DEVNULL)
+
+    # Словарь пишется последним: его наличие означает, что фикстура готова
+    with open(vocabulary_path, 'w', encoding='utf-8') as f:
+        json.dump(vocabulary, f, ensure_ascii=False)
+    return directory
+
+
+def make_queries(vocabulary, count, seed):
+    """[(вид, запрос)] в пропорциях QUERY_MIX"""
+    rng = random.Random(seed)
+    frequent = vocabulary[:300]
+    kinds = [kind for kind, _ in QUERY_MIX]
+    weights = [weight for _, weight in QUERY_MIX]
+
+    queries = []
+    for kind in rng.choices(kinds, weights=weights, k=count):
+        if kind == 'term':
+            query = rng.choice(vocabulary[:2000])
+        elif kind == 'and_chain':
+            query = ' '.join(rng.sample(frequent, rng.randint(4, 8)))
+        elif kind == 'or_fan':
+            query = ' || '.join(rng.sample(vocabulary[:2000], rng.randint(3, 8)))
+        elif kind == 'not':
+            positive, *negatives = rng.sample(frequent, rng.randint(3, 5))
+            query = positive + ' ' + ' '.join('!' + word for word in negatives)
+        else:
+            # Слоги только из латиницы: таких слов в корпусе нет
+            query = ''.join(rng.choice('qxzjw') for _ in range(8))
+        queries.append((kind, query))
+    return queries
+
+
+def percentile(values, fraction):
+    """Перцентиль по рангу (values отсортированы)"""
+    if not values:
+        return 0.0
+    return values[min(int(fraction * len(values)), len(values) - 1)]
+
+
+def summarize(latencies):
+    latencies = sorted(latencies)
+    return {
+        'count': len(latencies),
+        'mean_ms': round(sum(latencies) / len(latencies) * 1000, 3) if latencies else 0.0,
+        'p50_ms': round(percentile(latencies, 0.50) * 1000, 3),
+        'p95_ms': round(percentile(latencies, 0.95) * 1000, 3),
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 3),
+        'max_ms': round(latencies[-1] * 1000, 3) if latencies else 0.0,
+    }
+
+
+def client_transport(app):
+    def make_session():
+        client = app.test_client()
+        return lambda path: client.get(path).get_json()
+    return make_session, lambda: None
+
+
+def http_transport(app):
+    from werkzeug.serving import WSGIRequestHandler, make_server
+
+    class QuietHandler(WSGIRequestHandler):
+        def log_request(self, *args):
+            pass
+
+    server = make_server('127.0.0.1', 0, app, threaded=True, request_handler=QuietHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+
+    def make_session():
+        def get(path):
+            connection = http.client.HTTPConnection('127.0.0.1', server.server_port)
+            try:
+                connection.request('GET', path)
+                return json.loads(connection.getresponse().read())
+            finally:
+                connection.close()
+        return get
+
+    return make_session, server.shutdown
+
+
+def stage_totals(metrics):
+    """(сумма, количество) по каждому этапу search_stage_seconds"""
+    totals = {}
+    for stage in metrics.STAGES:
+        histogram = metrics.search_stage.labels(stage)
+        with histogram.lock:
+            totals[stage] = (histogram.sum, sum(histogram.counts))
+    return totals
+
+
+def run_load(make_session, queries, concurrency):
+    """[(вид, секунды, ошибка)] и общее время"""
+    position = iter(range(len(queries)))
+    lock = threading.Lock()
+    samples = []
+
+    def client():
+        get = make_session()
+        while True:
+            with lock:
+                number = next(position, None)
+            if number is None:
+                return
+            kind, query = queries[number]
+            path = f'/api/search?limit={RESULT_LIMIT}&q=' + urllib.parse.quote(query)
+            started = time.perf_counter()
+            try:
+                error = get(path).get('error')
+            except Exception as e:
+                error = str(e)
+            elapsed = time.perf_counter() - started
+            with lock:
+                samples.append((kind, elapsed, error))
+
+    threads = [threading.Thread(target=client) for _ in range(concurrency)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return samples, time.perf_counter() - started
+
+
+def measure(mode, transport, fixture, concurrency):
+    """Запуск в процессе-воркере: окружение уже настроено run_mode()"""
+    import app
+    import metrics
+
+    with open(os.path.join(fixture, 'vocabulary.json'), encoding='utf-8') as f:
+        vocabulary = json.load(f)
+    queries = make_queries(vocabulary, BENCH_REQUESTS, BENCH_SEED)
+    warmup = make_queries(vocabulary, WARMUP_REQUESTS, BENCH_SEED + 1)
+
+    make_session, stop = (http_transport if transport == 'http' else client_transport)(app.app)
+    try:
+        run_load(make_session, warmup, concurrency)
+        before = stage_totals(metrics)
+        samples, seconds = run_load(make_session, queries, concurrency)
+        after = stage_totals(metrics)
+    finally:
+        stop()
+        app.index_manager.stop()
+
+    ok = [(kind, elapsed) for kind, elapsed, error in samples if not error]
+    result = {
+        'mode': mode,
+        'transport': transport,
+        'concurrency': concurrency,
+        'requests': len(samples),
+        'errors': len(samples) - len(ok),
+        'seconds': round(seconds, 3),
+        'qps': round(len(ok) / seconds, 1) if seconds else 0.0,
+        'latency': summarize([elapsed for _, elapsed in ok]),
+        'by_kind': {kind: summarize([elapsed for k, elapsed in ok if k == kind])
+                    for kind, _ in QUERY_MIX},
+        'stages': {},
+    }
+    for stage in metrics.STAGES:
+        total = after[stage][0] - before[stage][0]
+        count = after[stage][1] - before[stage][1]
+        if count:
+            result['stages'][stage] = {'count': count,
+                                       'mean_ms': round(total / count * 1000, 3),
+                                       'per_request_ms': round(total / len(samples) * 1000, 3)}
+    return result
+
+
+def run_mode(mode, transport, fixture, concurrency):
+    """Измерить один режим в отдельном процессе"""
+    env = dict(os.environ)
+    env.update(MODE_ENVIRONMENT[mode])
+    env.setdefault('SEARCHER_POOL_SIZE', str(concurrency))
+    env.update({
+        'INDEX_PATH': os.path.join(fixture, 'index.bin'),
+        'SEARCHER_PATH': os.path.abspath(SEARCHER_PATH),
+        'SEARCHER_QUEUE_SIZE': str(concurrency * 4),
+        'INDEX_CHECK_INTERVAL': '0',
+        'QUERY_CACHE_PATH': '',
+        'QUERY_CACHE_ENTRIES': '0',
+        # Синтетические запросы не должны попасть в общий журнал, а фоновый
+        # прогрев - конкурировать с измеряемыми запросами
+        'QUERY_LOG_PATH': '',
+        'WARMUP_QUERIES': '0',
+    })
+    output = subprocess.run([sys.executable, os.path.abspath(__file__), '_measure',
+                             mode, transport, fixture, str(concurrency)],
+                            env=env, check=True, stdout=subprocess.PIPE,
+                            cwd=os.path.dirname(os.path.abspath(__file__))).stdout
+    return json.loads(output.decode('utf-8').strip().splitlines()[-1])
+
+
+def git_commit():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], check=True,
+                                stdout=subprocess.PIPE, stderr=subprocess.DEVNULL).stdout
+        dirty = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'],
+                               check=True, stdout=subprocess.PIPE).stdout
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown', False
+    return commit.decode().strip(), bool(dirty.strip())
+
+
+def run(output_path=None):
+    fixture = build_fixture()
+    commit, dirty = git_commit()
+    report = {
+        'commit': commit,
+        'dirty': dirty,
+        'created': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'config': {'docs': BENCH_DOCS, 'seed': BENCH_SEED, 'requests': BENCH_REQUESTS,
+                   'concurrency': BENCH_CONCURRENCY, 'limit': RESULT_LIMIT,
+                   'mix': dict(QUERY_MIX)},
+        'results': [],
+    }
+
+    print(f'{"Режим":<12} {"Транспорт":<10} {"QPS":>8} {"p50, мс":>9} '
+          f'{"p95, мс":>9} {"p99, мс":>9} {"Ошибки":>7}')
+    for mode in BENCH_MODES:
+        for transport in BENCH_TRANSPORTS:
+            result = run_mode(mode, transport, fixture, BENCH_CONCURRENCY)
+            report['results'].append(result)
+            latency = result['latency']
+            print(f'{mode:<12} {transport:<10} {result["qps"]:>8.1f} {latency["p50_ms"]:>9.2f} '
+                  f'{latency["p95_ms"]:>9.2f} {latency["p99_ms"]:>9.2f} {result["errors"]:>7}')
+
+    if output_path is None:
+        output_path = os.path.join('..', 'data', 'benchmarks', f'{commit}.json')
+    directory = os.path.dirname(output_path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(output_path, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f'Результаты сохранены в {output_path}')
+
+
+def compare(old_path, new_path):
+    """Сравнить два отчёта; код выхода 1 при регрессии больше BENCH_REGRESSION"""
+    with open(old_path, encoding='utf-8') as f:
+        old = json.load(f)
+    with open(new_path, encoding='utf-8') as f:
+        new = json.load(f)
+    old_results = {(r['mode'], r['transport']): r for r in old['results']}
+
+    print(f'{old["commit"]} -> {new["commit"]}')
+    print(f'{"Режим":<12} {"Транспорт":<10} {"QPS":>16} {"p50":>16} {"p95":>16} {"p99":>16}')
+    regressions = 0
+    for result in new['results']:
+        previous = old_results.get((result['mode'], result['transport']))
+        if previous is None:
+            continue
+        cells = []
+        # Для QPS хуже - меньше, для задержек - больше
+        for name, new_value, old_value, sign in (
+                ('qps', result['qps'], previous['qps'], -1),
+                ('p50', result['latency']['p50_ms'], previous['latency']['p50_ms'], 1),
+                ('p95', result['latency']['p95_ms'], previous['latency']['p95_ms'], 1),
+                ('p99', result['latency']['p99_ms'], previous['latency']['p99_ms'], 1)):
+            change = (new_value - old_value) / old_value if old_value else 0.0
+            worse = sign * change > BENCH_REGRESSION
+            regressions += worse
+            cells.append(f'{new_value:>8.2f} {change:+6.1%}{"!" if worse else " "}')
+        print(f'{result["mode"]:<12} {result["transport"]:<10} ' + ' '.join(cells))
+
+    if regressions:
+        print(f'Регрессий больше {BENCH_REGRESSION:.0%}: {regressions}')
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == '_measure':
+        mode, transport, fixture, concurrency = sys.argv[2:6]
+        print(json.dumps(measure(mode, transport, fixture, int(concurrency))))
+    elif len(sys.argv) > 1 and sys.argv[1] == 'compare':
+        if len(sys.argv) != 4:
+            print('Использование: python benchmark.py compare старый.json новый.json')
+            sys.exit(1)
+        compare(sys.argv[2], sys.argv[3])
+    else:
+        run(sys.argv[1] if len(sys.argv) > 1 else None)
@@ -0,0 +1,84 @@
+"""
+Статистика корпуса, обновляемая в фоне.
+
+Запросы читают готовый снимок (O(1)), а подсчёт по коллекции articles
+выполняет фоновый поток раз в interval секунд - одной агрегацией
+вместо count_documents и двух distinct на каждый запрос.
+"""
+
+import threading
+import time
+
+import metrics
+
+
+class CorpusStats:
+    """Снимок статистики коллекции и фоновый поток, который его обновляет"""
+
+    def __init__(self, collection, interval=60.0):
+        self.collection = collection
+        self.interval = interval
+        self.snapshot = {'error': 'Статистика ещё не загружена'}
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def start(self):
+        """Запустить фоновое обновление (повторный вызов ничего не делает)"""
+        with self.lock:
+            if self.thread is not None:
+                return
+            self.thread = threading.Thread(target=self._run, name='corpus-stats',
+                                           daemon=True)
+            self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+
+    def get(self):
+        """Последний снимок статистики; поток запускается при первом обращении"""
+        if self.thread is None:
+            self.start()
+        return self.snapshot
+
+    def _run(self):
+        while not self.stopped.is_set():
+            try:
+                self.refresh()
+            except Exception as e:
+                # Старый снимок лучше ошибки: заменяем его только если данных ещё не было
+                if 'error' in self.snapshot:
+                    self.snapshot = {'error': str(e)}
+            self.stopped.wait(self.interval)
+
+    def refresh(self):
+        """Пересчитать статистику одним проходом по коллекции"""
+        started = time.monotonic()
+        result = next(self.collection.aggregate([
+            {'$facet': {
+                'sources': [{'$group': {'_id': '$source', 'count': {'$sum': 1}}}],
+                'categories': [{'$group': {'_id': '$category', 'count': {'$sum': 1}}}],
+            }}
+        ]), {'sources': [], 'categories': []})
+
+        source_counts = _counts(result['sources'])
+        category_counts = _counts(result['categories'])
+
+        # Снимок заменяется целиком: читатели видят либо старый, либо новый
+        self.snapshot = {
+            'total_docs': sum(row['count'] for row in result['sources']),
+            'sources': sorted(source_counts),
+            'categories': len(category_counts),
+            'source_counts': source_counts,
+            'category_counts': category_counts,
+            'updated_at': time.time(),
+            'refresh_ms': round((time.monotonic() - started) * 1000, 1),
+        }
+        metrics.MONGO_STATS.observe(time.monotonic() - started)
+        return self.snapshot
+
+
+def _counts(rows):
+    """Результат $group -> {значение: количество} по убыванию (без пустых значений)"""
+    rows = sorted((row for row in rows if row['_id']), key=lambda row: -row['count'])
+    return {str(row['_id']): row['count'] for row in rows}
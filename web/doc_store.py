@@ -0,0 +1,55 @@
+"""
+Чтение хранилища текстов документов index.docs (scripts/build_docstore.py).
+
+Текст каждого документа сжат отдельно и адресуется по таблице смещений,
+поэтому текст одного документа - одно чтение из mmap и одна распаковка.
+"""
+
+import mmap
+import struct
+import zlib
+
+MAGIC = 0x434F444D  # "MDOC"
+VERSION = 2
+# Версия 1 - без идентификатора сборки индекса (build_id = 0)
+SUPPORTED_VERSIONS = (1, 2)
+
+_HEADER = struct.Struct('<IIIIQ')
+_BUILD_ID = struct.Struct('<Q')
+
+
+class DocStoreFormatError(ValueError):
+    """Файл не является хранилищем текстов поддерживаемой версии"""
+
+
+class DocStore:
+    """Хранилище текстов, открытое через mmap"""
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        if len(self.mm) < _HEADER.size:
+            self.mm.close()
+            raise DocStoreFormatError(f'Слишком короткий файл: {path}')
+
+        magic, version, self.num_docs, _, offsets_offset = _HEADER.unpack_from(self.mm, 0)
+        if magic != MAGIC or version not in SUPPORTED_VERSIONS:
+            self.mm.close()
+            raise DocStoreFormatError(f'Неверный формат хранилища текстов: {path}')
+        self.build_id = _BUILD_ID.unpack_from(self.mm, _HEADER.size)[0] if version >= 2 else 0
+
+        end = offsets_offset + 8 * (self.num_docs + 1)
+        self.offsets = memoryview(self.mm)[offsets_offset:end].cast('Q')
+
+    def text(self, doc_id):
+        """Текст документа ('' для неизвестного ID)"""
+        if not 0 <= doc_id < self.num_docs:
+            return ''
+        data = self.mm[self.offsets[doc_id]:self.offsets[doc_id + 1]]
+        return zlib.decompress(data).decode('utf-8', errors='replace')
+
+    def close(self):
+        self.offsets.release()
+        self.mm.close()
@@ -0,0 +1,185 @@
+"""
+Фасеты результатов (источник, категория, год) по столбцам index.facets
+(scripts/build_facets.py).
+
+Столбец - массив кодов u16 по ID документа, открытый через mmap, и словарь
+значений. Число документов по значениям для найденных ID - один bincount
+по кодам, без чтения самих документов.
+
+Фильтр по значению - битовое множество документов (по биту на документ),
+которое строится один раз и дальше пересекается с найденными ID. Значения
+одного столбца объединяются (ИЛИ), разные столбцы пересекаются (И).
+Кэш результатов хранит ID без фильтров, поэтому все сочетания фильтров
+одного запроса вычисляются из одного элемента кэша.
+"""
+
+import mmap
+import struct
+import threading
+from array import array
+from collections import OrderedDict
+
+import numpy
+
+MAGIC = 0x5443464D  # "MFCT"
+VERSION = 2
+# Версия 1 - без идентификатора сборки индекса (build_id = 0)
+SUPPORTED_VERSIONS = (1, 2)
+
+_HEADER = struct.Struct('<IIII')
+_BUILD_ID = struct.Struct('<Q')
+
+# Сколько объединённых множеств для сочетаний фильтров держать в памяти
+FILTER_CACHE_ENTRIES = 64
+
+
+class FacetFormatError(ValueError):
+    """Файл не является столбцами фасетов поддерживаемой версии"""
+
+
+def filters_key(filters):
+    """Каноническая запись фильтров {столбец: [значения]} ('' - без фильтров)"""
+    return '&'.join(f'{name}={value}'
+                    for name in sorted(filters) for value in sorted(set(filters[name])))
+
+
+class FacetStore:
+    """Столбцы фасетов, открытые через mmap"""
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        try:
+            self.columns = self._parse()
+        except (struct.error, ValueError) as e:
+            self.mm.close()
+            raise FacetFormatError(f'Неверный формат фасетов: {path} ({e})')
+
+        self.lock = threading.Lock()
+        self.bitsets = {}  # (столбец, код) -> битовое множество документов
+        self.filters = OrderedDict()  # filters_key -> объединённое множество
+
+    def _parse(self):
+        magic, version, self.num_docs, num_columns = _HEADER.unpack_from(self.mm, 0)
+        if magic != MAGIC or version not in SUPPORTED_VERSIONS:
+            raise ValueError('неизвестная версия')
+
+        columns = {}
+        pos = _HEADER.size
+        self.build_id = 0
+        if version >= 2:
+            self.build_id, = _BUILD_ID.unpack_from(self.mm, pos)
+            pos += _BUILD_ID.size
+        for _ in range(num_columns):
+            name, pos = self._read_string(pos)
+            num_values, = struct.unpack_from('<I', self.mm, pos)
+            pos += 4
+            values = []
+            for _ in range(num_values):
+                value, pos = self._read_string(pos)
+                values.append(value)
+            pos += -pos % 8
+            if pos + 2 * self.num_docs > len(self.mm):
+                raise ValueError('файл обрезан')
+            codes = numpy.frombuffer(self.mm, dtype='<u2', count=self.num_docs, offset=pos)
+            pos += 2 * self.num_docs
+            columns[name] = (values, {value: code for code, value in enumerate(values)}, codes)
+        return columns
+
+    def _read_string(self, pos):
+        length, = struct.unpack_from('<H', self.mm, pos)
+        pos += 2
+        return bytes(self.mm[pos:pos + length]).decode('utf-8', errors='replace'), pos + length
+
+    def names(self):
+        return list(self.columns)
+
+    def filter(self, ids, filters):
+        """ID (array('I') в порядке выдачи), проходящие все фильтры; порядок сохраняется"""
+        bits = self._combined(filters)
+        if bits is None:
+            return ids
+        ids = numpy.frombuffer(ids, dtype=numpy.uint32)
+        return array('I', ids[_test(bits, ids)].tobytes())
+
+    def counts(self, ids, filters=None, limit=20):
+        """
+        {столбец: [{'value', 'count', 'selected'}]} по убыванию числа документов.
+        Счётчики столбца считаются с фильтрами остальных столбцов, но без его
+        собственного: видно, сколько документов даст другое значение.
+        """
+        filters = filters or {}
+        facets = {}
+        for name, (values, codes_by_value, codes) in self.columns.items():
+            others = {other: selected for other, selected in filters.items() if other != name}
+            subset = self.filter(ids, others)
+            subset = numpy.frombuffer(subset, dtype=numpy.uint32)
+            counts = numpy.bincount(codes[subset], minlength=len(values))
+            counts[0] = 0  # значение не указано
+
+            selected = set(filters.get(name, ()))
+            order = numpy.argsort(-counts, kind='stable')[:limit]
+            shown = [int(code) for code in order if counts[code]]
+            shown += [code for code in (codes_by_value.get(value) for value in selected)
+                      if code is not None and code not in shown]
+            facets[name] = [{'value': values[code], 'count': int(counts[code]),
+                             'selected': values[code] in selected}
+                            for code in shown]
+        return facets
+
+    def _combined(self, filters):
+        """Битовое множество для фильтров: ИЛИ внутри столбца, И между столбцами"""
+        filters = {name: values for name, values in filters.items()
+                   if name in self.columns and values}
+        if not filters:
+            return None
+        key = filters_key(filters)
+        with self.lock:
+            bits = self.filters.get(key)
+            if bits is not None:
+                self.filters.move_to_end(key)
+                return bits
+
+        bits = None
+        for name, selected in filters.items():
+            column = numpy.zeros((self.num_docs + 7) // 8, dtype=numpy.uint8)
+            for value in set(selected):
+                numpy.bitwise_or(column, self._bitset(name, value), out=column)
+            bits = column if bits is None else numpy.bitwise_and(bits, column, out=bits)
+
+        with self.lock:
+            self.filters[key] = bits
+            if len(self.filters) > FILTER_CACHE_ENTRIES:
+                self.filters.popitem(last=False)
+        return bits
+
+    def _bitset(self, name, value):
+        """Документы со значением value в столбце name (пустое - нет такого значения)"""
+        _, codes_by_value, codes = self.columns[name]
+        code = codes_by_value.get(value)
+        with self.lock:
+            bits = self.bitsets.get((name, code))
+        if bits is None:
+            if code is None:
+                bits = numpy.zeros((self.num_docs + 7) // 8, dtype=numpy.uint8)
+            else:
+                bits = numpy.packbits(codes == code, bitorder='little')
+            with self.lock:
+                self.bitsets[(name, code)] = bits
+        return bits
+
+    def close(self):
+        self.columns = {}
+        try:
+            self.mm.close()
+        except BufferError:
+            # Ещё живы представления столбцов: mmap закроется вместе с ними
+            pass
+
+
+def _test(bits, ids):
+    """Булев массив: какие ID есть в битовом множестве"""
+    ids = numpy.asarray(ids, dtype=numpy.intp)
+    return ((bits[ids >> 3] >> (ids & 7).astype(numpy.uint8)) & 1).astype(bool)
@@ -0,0 +1,67 @@
+"""
+Сжатие ответов и условные запросы (ETag / If-None-Match).
+
+ETag результата поиска строится из ключа кэша результатов (нормализованный
+запрос и порядок выдачи), страницы (offset, limit) и поколения индекса -
+всего, от чего зависят найденные документы. Поэтому If-None-Match
+проверяется до выполнения запроса, и повторный опрос с тем же ETag получает
+304 без поиска.
+
+ETag слабый (W/"..."): он гарантирует те же документы страницы, но не те же
+байты - время поиска (search_us, cached), исправление запроса (did_you_mean,
+зависит от SPELLING_BUDGET_MS) и счётчики фасетов в нём не учитываются.
+
+JSON и HTML сжимаются gzip или deflate по Accept-Encoding. У сжатого ответа
+другие байты, поэтому к его ETag добавляется суффикс кодировки ("...-gzip");
+при сравнении с If-None-Match суффикс отбрасывается.
+"""
+
+import gzip
+import hashlib
+import zlib
+
+# Кодировки в порядке предпочтения сервера
+ENCODINGS = ('gzip', 'deflate')
+
+COMPRESSIBLE_TYPES = ('application/json', 'text/html')
+
+
+def search_etag(key, offset, limit, generation):
+    """ETag страницы результатов (без кавычек и W/, отдаётся как слабый)"""
+    digest = hashlib.sha1(f'{generation}\0{key}\0{offset}\0{limit}'.encode('utf-8'))
+    return digest.hexdigest()[:32]
+
+
+def strip_encoding(etag):
+    """ETag без суффикса кодировки сжатого ответа"""
+    for encoding in ENCODINGS:
+        if etag.endswith('-' + encoding):
+            return etag[:-len(encoding) - 1]
+    return etag
+
+
+def not_modified(if_none_match, etag):
+    """
+    Совпадает ли ETag с одним из If-None-Match (werkzeug ETags); для
+    If-None-Match сравнение слабое, как требует RFC 9110
+    """
+    if if_none_match.star_tag:
+        return True
+    return any(strip_encoding(tag) == etag
+               for tag in if_none_match.as_set(include_weak=True))
+
+
+def choose_encoding(accept_encodings):
+    """Кодировка по Accept-Encoding (werkzeug Accept); None - без сжатия"""
+    return accept_encodings.best_match(ENCODINGS)
+
+
+def compressible(mimetype):
+    return mimetype in COMPRESSIBLE_TYPES
+
+
+def compress(data, encoding, level=6):
+    """Тело ответа в кодировке encoding; gzip без времени в заголовке - те же байты"""
+    if encoding == 'gzip':
+        return gzip.compress(data, compresslevel=level, mtime=0)
+    return zlib.compress(data, level)
@@ -0,0 +1,238 @@
+"""
+Версии index.bin и их замена без остановки сервиса.
+
+Индекс публикуется атомарно (временный файл, fsync, rename), поэтому новое
+поколение - это новый inode по тому же пути. Версия индекса держит открытый
+дескриптор своего файла: IndexReader, хранилище текстов и процессы searcher
+(получают файл как /dev/fd/N) работают с одним и тем же поколением, даже
+если путь уже указывает на следующее.
+
+Фоновый поток раз в interval секунд сравнивает поколение файла с текущим,
+загружает и прогревает новую версию (mmap, page cache, запуск searcher'ов,
+кэш результатов частых запросов), затем подменяет текущую одной операцией присваивания. Старая версия
+закрывается после того, как завершатся запросы, которые её используют.
+"""
+
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from doc_store import DocStore, DocStoreFormatError
+from facets import FacetStore, FacetFormatError
+from index_reader import IndexReader
+from query_cache import index_generation, file_generation
+from suggest import Suggester, SuggestFormatError
+
+
+def open_companion(open_file, errors, path, reader):
+    """
+    Файл, построенный вместе с индексом (тексты, подсказки, фасеты); None,
+    если его нет или он от другой сборки: не совпадает идентификатор сборки
+    (build_id из заголовков) или число документов
+    """
+    if not path:
+        return None
+    try:
+        companion = open_file(path)
+    except (OSError,) + errors:
+        return None
+    if companion.build_id != reader.build_id or companion.num_docs != reader.num_docs:
+        print(f'{path} построен не для текущего индекса, не используется')
+        companion.close()
+        return None
+    return companion
+
+
+class IndexVersion:
+    """Одно поколение индекса и связанные с ним ресурсы"""
+
+    def __init__(self, index_path, docstore_path=None, hot_terms=1000, suggest_path=None,
+                 facets_path=None):
+        self.fd = os.open(index_path, os.O_RDONLY)
+        try:
+            self.generation = file_generation(self.fd)
+            # Путь для дочерних процессов: тот же файл через унаследованный дескриптор
+            self.index_arg = f'/dev/fd/{self.fd}'
+            self.reader = IndexReader(self.index_arg)
+        except Exception:
+            os.close(self.fd)
+            raise
+
+        reader = self.reader
+        self.doc_store = open_companion(DocStore, (DocStoreFormatError,), docstore_path, reader)
+        self.suggester = open_companion(Suggester, (SuggestFormatError,), suggest_path, reader)
+        self.facets = open_companion(FacetStore, (FacetFormatError,), facets_path, reader)
+
+        self.reader.prefetch(hot_terms)
+        self.pool = None
+        self.users = 0
+        self.idle = threading.Condition()
+
+    def acquire(self):
+        with self.idle:
+            self.users += 1
+
+    def release(self):
+        with self.idle:
+            self.users -= 1
+            if not self.users:
+                self.idle.notify_all()
+
+    def wait_idle(self, timeout):
+        """Дождаться завершения запросов, использующих версию"""
+        with self.idle:
+            return self.idle.wait_for(lambda: not self.users, timeout)
+
+    def close(self):
+        self.reader.close()
+        for companion in (self.doc_store, self.suggester, self.facets):
+            if companion is not None:
+                companion.close()
+        os.close(self.fd)
+
+
+class IndexManager:
+    """
+    Текущая версия индекса и поток, который следит за публикацией новой.
+
+    on_load(version)  - запуск ресурсов версии (пул searcher'ов) до её публикации
+    on_close(version) - их остановка после того, как версия перестала использоваться
+    on_warm(version, background) - прогрев кэша результатов версии: первая версия
+        прогревается в фоне, новая - до публикации
+    drain_timeout     - сколько ждать запросы к старой версии перед закрытием
+    """
+
+    def __init__(self, index_path, docstore_path=None, interval=2.0, hot_terms=1000,
+                 on_load=None, on_close=None, drain_timeout=60.0, suggest_path=None,
+                 on_warm=None, facets_path=None):
+        self.index_path = index_path
+        self.docstore_path = docstore_path
+        self.suggest_path = suggest_path
+        self.facets_path = facets_path
+        self.interval = interval
+        self.hot_terms = hot_terms
+        self.on_load = on_load
+        self.on_close = on_close
+        self.on_warm = on_warm
+        self.drain_timeout = drain_timeout
+
+        self.version = None
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.thread = None
+        self.failed_generation = None
+        self.swaps = 0
+        self.load_seconds = 0.0
+
+    def current(self):
+        """Текущая версия; первая загружается при первом обращении"""
+        version = self.version
+        if version is None:
+            loaded = False
+            with self.lock:
+                if self.version is None:
+                    self.version = self._load()
+                    loaded = True
+                version = self.version
+            if loaded:
+                # Сервис уже отвечает, кэш заполняется параллельно с первыми запросами
+                self._warm(version, background=True)
+            self.start()
+        return version
+
+    def acquire_current(self):
+        """
+        Текущая версия, занятая для запроса (освободить - version.release()).
+        Занимается под self.lock: check() не может подменить и закрыть её
+        между чтением self.version и acquire()
+        """
+        while True:
+            version = self.current()
+            with self.lock:
+                if self.version is version:
+                    version.acquire()
+                    return version
+
+    @contextmanager
+    def use(self):
+        """Версия индекса на время запроса: до выхода она не будет закрыта"""
+        version = self.acquire_current()
+        try:
+            yield version
+        finally:
+            version.release()
+
+    def start(self):
+        """Запустить фоновую проверку (повторный вызов ничего не делает)"""
+        with self.lock:
+            if self.thread is not None or not self.interval:
+                return
+            self.thread = threading.Thread(target=self._run, name='index-watcher', daemon=True)
+            self.thread.start()
+
+    def _load(self):
+        started = time.monotonic()
+        version = IndexVersion(self.index_path, self.docstore_path, self.hot_terms,
+                               self.suggest_path, self.facets_path)
+        if self.on_load is not None:
+            try:
+                self.on_load(version)
+            except Exception:
+                version.close()
+                raise
+        self.load_seconds = time.monotonic() - started
+        return version
+
+    def _run(self):
+        while not self.stopped.wait(self.interval):
+            try:
+                self.check()
+            except Exception as e:
+                print(f'Не удалось загрузить новую версию индекса: {e}')
+
+    def check(self):
+        """Заменить версию, если опубликовано новое поколение; True - заменена"""
+        generation = index_generation(self.index_path)
+        current = self.version
+        if generation is None or current is None or generation == current.generation:
+            return False
+        if generation == self.failed_generation:
+            return False
+
+        try:
+            version = self._load()
+        except Exception:
+            self.failed_generation = generation
+            raise
+        self._warm(version, background=False)
+
+        with self.lock:
+            old, self.version = self.version, version
+            self.swaps += 1
+
+        old.wait_idle(self.drain_timeout)
+        self._close(old)
+        return True
+
+    def _warm(self, version, background):
+        if self.on_warm is None:
+            return
+        try:
+            self.on_warm(version, background)
+        except Exception as e:
+            # Без прогрева версия работает, просто первые запросы медленнее
+            print(f'Не удалось прогреть кэш результатов: {e}')
+
+    def _close(self, version):
+        if self.on_close is not None:
+            self.on_close(version)
+        version.close()
+
+    def stop(self):
+        """Остановить проверку и закрыть текущую версию"""
+        self.stopped.set()
+        with self.lock:
+            version, self.version = self.version, None
+        if version is not None:
+            self._close(version)
@@ -0,0 +1,276 @@
+#!/usr/bin/env python3
+"""
+Чтение index.bin (формат MIDX v1-v3, Indexer::save_to_file) через mmap.
+
+Формат:
+    заголовок   magic u32, version u32, num_terms u32, num_docs u32,
+                forward_offset u64, lengths_offset u64 (в v1 - ноль),
+                в v3 build_id u64 - сборка, общая с index.docs/.suggest/.facets
+    термы       (по возрастанию байтов терма)
+                term_len u32, term, posting_len u32, doc_id u32 * posting_len,
+                в v2 за ними tf u32 * posting_len
+    документы   id u32, затем title, url, category, source: длина u32 + байты
+    длины       (только v2) число термов документа u32 * num_docs
+
+Posting lists отдаются без копирования (NumPy uint32 или memoryview поверх
+mmap), документы декодируются только по запросу. Несколько процессов,
+открывших один файл, делят page cache вместо своих копий индекса.
+
+Запуск для проверки:
+    python index_reader.py ../data/index.bin [терм ...]
+"""
+
+import mmap
+import struct
+import sys
+from array import array
+
+try:
+    import numpy
+except ImportError:  # pragma: no cover - NumPy необязателен
+    numpy = None
+
+MAGIC = 0x5849444D  # "MIDX"
+VERSION = 3
+# Версия 1 - без частот термов и длин документов (ранжирование как при tf = 1),
+# версии 1 и 2 - без идентификатора сборки (build_id = 0)
+SUPPORTED_VERSIONS = (1, 2, 3)
+
+_HEADER = struct.Struct('<IIIIQQ')
+_BUILD_ID = struct.Struct('<Q')
+_U32 = struct.Struct('<I')
+
+
+class IndexFormatError(ValueError):
+    """Файл не является индексом поддерживаемой версии"""
+
+
+class IndexReader:
+    """Индекс, открытый через mmap"""
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        if len(self.mm) < _HEADER.size:
+            self.mm.close()
+            raise IndexFormatError(f'Слишком короткий файл: {path}')
+
+        (magic, self.version, self.num_terms, self.num_docs,
+         self.forward_offset, self.lengths_offset) = _HEADER.unpack_from(self.mm, 0)
+        if magic != MAGIC:
+            self.mm.close()
+            raise IndexFormatError(f'Неверный формат файла индекса: {path}')
+        if self.version not in SUPPORTED_VERSIONS:
+            self.mm.close()
+            raise IndexFormatError(f'Неподдерживаемая версия индекса: {self.version}')
+        self.has_freqs = self.version >= 2
+
+        self.build_id = 0
+        self.header_size = _HEADER.size
+        if self.version >= 3:
+            self.header_size += _BUILD_ID.size
+            if len(self.mm) < self.header_size:
+                self.mm.close()
+                raise IndexFormatError(f'Слишком короткий файл: {path}')
+            self.build_id, = _BUILD_ID.unpack_from(self.mm, _HEADER.size)
+
+        self.term_offsets, self.doc_freqs = self._scan_terms()
+        self._doc_offsets = None
+        self._avg_doc_length = None
+
+    def _scan_terms(self):
+        """
+        Смещения записей термов и длины их posting lists. Сами строки
+        не читаются: один проход по полям длины, posting lists пропускаются.
+        """
+        unpack = _U32.unpack_from
+        mm = self.mm
+        offsets = array('Q', bytes(8 * self.num_terms))
+        doc_freqs = array('I', bytes(4 * self.num_terms))
+        # В v2 за списком ID документов идёт список частот той же длины
+        posting_size = 8 if self.has_freqs else 4
+        offset = self.header_size
+        for i in range(self.num_terms):
+            offsets[i] = offset
+            term_len = unpack(mm, offset)[0]
+            posting_len = unpack(mm, offset + 4 + term_len)[0]
+            doc_freqs[i] = posting_len
+            offset += 8 + term_len + posting_size * posting_len
+        return offsets, doc_freqs
+
+    def _scan_documents(self):
+        unpack = _U32.unpack_from
+        mm = self.mm
+        offsets = array('Q', bytes(8 * self.num_docs))
+        offset = self.forward_offset
+        for i in range(self.num_docs):
+            offsets[i] = offset
+            offset += 4
+            for _ in range(4):
+                offset += 4 + unpack(mm, offset)[0]
+        return offsets
+
+    def __len__(self):
+        return self.num_terms
+
+    def term_bytes(self, term_id):
+        """Терм по номеру в словаре (байты UTF-8)"""
+        offset = self.term_offsets[term_id]
+        term_len = _U32.unpack_from(self.mm, offset)[0]
+        return self.mm[offset + 4:offset + 4 + term_len]
+
+    def term(self, term_id):
+        return self.term_bytes(term_id).decode('utf-8', errors='surrogateescape')
+
+    def lower_bound(self, key):
+        """Номер первого терма >= key (двоичный поиск по отсортированному словарю)"""
+        lo, hi = 0, self.num_terms
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.term_bytes(mid) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def find(self, term):
+        """Номер терма в словаре или -1"""
+        key = term.encode('utf-8', errors='surrogateescape') if isinstance(term, str) else term
+        term_id = self.lower_bound(key)
+        if term_id < self.num_terms and self.term_bytes(term_id) == key:
+            return term_id
+        return -1
+
+    def _posting_location(self, term_id):
+        offset = self.term_offsets[term_id]
+        term_len = _U32.unpack_from(self.mm, offset)[0]
+        posting_len = _U32.unpack_from(self.mm, offset + 4 + term_len)[0]
+        return offset + 8 + term_len, posting_len
+
+    def doc_freq(self, term_id):
+        """Количество документов с термом"""
+        return self.doc_freqs[term_id]
+
+    def prefetch(self, hot_terms=1000):
+        """
+        Подгрузить индекс в page cache до первых запросов: словарь и прямой
+        индекс целиком, posting lists - для hot_terms самых частых термов
+        """
+        if hasattr(self.mm, 'madvise'):
+            self.mm.madvise(mmap.MADV_WILLNEED)
+
+        if numpy is not None:
+            hot = numpy.argsort(numpy.frombuffer(self.doc_freqs, dtype=numpy.uint32))[::-1]
+            hot = hot[:hot_terms].tolist()
+        else:
+            hot = sorted(range(self.num_terms), key=self.doc_freqs.__getitem__,
+                         reverse=True)[:hot_terms]
+
+        touched = 0
+        for term_id in hot:
+            start, count = self._posting_location(term_id)
+            # По одному байту со страницы: чтение страницы с диска
+            touched += len(self.mm[start:start + 4 * count:mmap.PAGESIZE])
+        return touched
+
+    def postings_by_id(self, term_id):
+        """Отсортированные ID документов терма - представление поверх mmap без копирования"""
+        start, count = self._posting_location(term_id)
+        if numpy is not None:
+            return numpy.frombuffer(self.mm, dtype='<u4', count=count, offset=start)
+        return memoryview(self.mm)[start:start + 4 * count].cast('I')
+
+    def term_freqs_by_id(self, term_id):
+        """Частоты терма в документах postings_by_id (в v1 - единицы)"""
+        start, count = self._posting_location(term_id)
+        if not self.has_freqs:
+            if numpy is not None:
+                return numpy.ones(count, dtype='<u4')
+            return memoryview(array('I', [1]) * count)
+        start += 4 * count
+        if numpy is not None:
+            return numpy.frombuffer(self.mm, dtype='<u4', count=count, offset=start)
+        return memoryview(self.mm)[start:start + 4 * count].cast('I')
+
+    def doc_lengths(self):
+        """Длины документов в термах (uint32 по ID); None - индекс v1 без длин"""
+        if not self.has_freqs:
+            return None
+        if numpy is not None:
+            return numpy.frombuffer(self.mm, dtype='<u4', count=self.num_docs,
+                                    offset=self.lengths_offset)
+        start = self.lengths_offset
+        return memoryview(self.mm)[start:start + 4 * self.num_docs].cast('I')
+
+    def avg_doc_length(self):
+        """Средняя длина документа в термах (0.0 для индекса v1), как у Indexer"""
+        if self._avg_doc_length is None:
+            lengths = self.doc_lengths()
+            if lengths is None or not self.num_docs:
+                self._avg_doc_length = 0.0
+            else:
+                # Целая сумма и одно деление - то же значение, что в C++
+                total = int(lengths.sum(dtype=numpy.uint64)) if numpy is not None else sum(lengths)
+                self._avg_doc_length = total / self.num_docs
+        return self._avg_doc_length
+
+    def postings(self, term):
+        """Posting list терма (ключ индекса, т.е. уже стеммированный); пустой, если нет"""
+        term_id = self.find(term)
+        if term_id < 0:
+            if numpy is not None:
+                return numpy.empty(0, dtype='<u4')
+            return memoryview(array('I'))
+        return self.postings_by_id(term_id)
+
+    def document(self, doc_id):
+        """Документ прямого индекса (поля как в записях hit у searcher)"""
+        if self._doc_offsets is None:
+            self._doc_offsets = self._scan_documents()
+
+        mm = self.mm
+        offset = self._doc_offsets[doc_id]
+        fields = []
+        position = offset + 4
+        for _ in range(4):
+            length = _U32.unpack_from(mm, position)[0]
+            fields.append(mm[position + 4:position + 4 + length].decode('utf-8', errors='replace'))
+            position += 4 + length
+
+        return {
+            'id': _U32.unpack_from(mm, offset)[0],
+            'title': fields[0],
+            'url': fields[1],
+            'category': fields[2],
+            'source': fields[3],
+        }
+
+    def documents(self, doc_ids):
+        return [self.document(doc_id) for doc_id in doc_ids if 0 <= doc_id < self.num_docs]
+
+    def close(self):
+        try:
+            self.mm.close()
+        except BufferError:
+            # Ещё живы представления posting lists: mmap закроется вместе с ними
+            pass
+
+
+def main():
+    if len(sys.argv) < 2:
+        print('Использование: python index_reader.py index.bin [терм ...]')
+        return 1
+
+    reader = IndexReader(sys.argv[1])
+    print(f'Документов: {reader.num_docs}, термов: {reader.num_terms}')
+    for term in sys.argv[2:]:
+        postings = reader.postings(term)
+        print(f'{term}: {len(postings)} документов', [int(doc_id) for doc_id in postings[:10]])
+    reader.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
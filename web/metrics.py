@@ -0,0 +1,214 @@
+"""
+Метрики веб-сервиса в текстовом формате Prometheus (/metrics).
+
+Все метрики и их метки создаются при импорте: на горячем пути только
+bisect по готовым границам и инкремент счётчика в заранее выделенном
+списке. Значения копятся в процессе; при нескольких воркерах gunicorn
+каждый отдаёт свои (Prometheus собирает их как отдельные цели).
+
+Этапы поиска (search_stage_seconds{stage=...}):
+    queue_wait  ожидание свободного процесса searcher
+    spawn       запуск процесса searcher
+    ipc         обмен с searcher'ом без учёта вычисления и разбора ответа
+    evaluation  вычисление запроса (search_us от searcher или query_engine)
+    parse       разбор JSON-строк ответа
+    snippets    чтение текстов и построение сниппетов
+    mongo_stats агрегация статистики корпуса в MongoDB
+    render      рендеринг шаблона
+"""
+
+import threading
+from bisect import bisect_left
+
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025,
+                   0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+SIZE_BUCKETS = (0, 1, 10, 50, 100, 500, 1000, 5000, 10000, 50000, 100000, 500000)
+
+_registry = []
+_collectors = []
+
+
+def _format_value(value):
+    if value == int(value):
+        return str(int(value))
+    return repr(value)
+
+
+def _format_labels(label, value):
+    if not label:
+        return ''
+    value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+    return f'{{{label}="{value}"}}'
+
+
+class Counter:
+    """Монотонный счётчик"""
+
+    def __init__(self, labels=''):
+        self.labels = labels
+        self.value = 0
+        self.lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self.lock:
+            self.value += amount
+
+    def samples(self, name):
+        yield f'{name}{self.labels} {_format_value(self.value)}'
+
+
+class Histogram:
+    """Гистограмма с фиксированными границами корзин"""
+
+    def __init__(self, buckets, labels=''):
+        self.bounds = tuple(buckets)
+        self.labels = labels
+        # Последняя корзина - значения больше всех границ (+Inf)
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.sum = 0.0
+        self.lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect_left(self.bounds, value)
+        with self.lock:
+            self.counts[index] += 1
+            self.sum += value
+
+    def samples(self, name):
+        with self.lock:
+            counts = list(self.counts)
+            total = self.sum
+
+        prefix = self.labels[:-1] + ',' if self.labels else '{'
+        cumulative = 0
+        for bound, count in zip(self.bounds, counts):
+            cumulative += count
+            yield f'{name}_bucket{prefix}le="{_format_value(bound)}"}} {cumulative}'
+        cumulative += counts[-1]
+        yield f'{name}_bucket{prefix}le="+Inf"}} {cumulative}'
+        yield f'{name}_sum{self.labels} {total!r}'
+        yield f'{name}_count{self.labels} {cumulative}'
+
+
+class Family:
+    """
+    Метрика с одной меткой и заранее известным набором её значений.
+    Без метки (label=None) - одна метрика, доступная как family.child.
+    max_values > 0 - значения метки заранее не известны: метрика для нового
+    значения создаётся при первом обращении, сверх max_values значений
+    все попадают в OTHER (число временных рядов ограничено).
+    """
+
+    OTHER = 'other'
+
+    def __init__(self, kind, name, help_text, label=None, values=(), max_values=0, **options):
+        self.kind = kind
+        self.name = name
+        self.help = help_text
+        self.label = label
+        self.max_values = max_values
+        self.options = options
+        self.metric_class = Histogram if kind == 'histogram' else Counter
+        self.lock = threading.Lock()
+
+        if label is None:
+            self.children = {None: self.metric_class(**options)}
+        else:
+            self.children = {value: self._create(value) for value in values}
+        self.child = self.children.get(None)
+        _registry.append(self)
+
+    def _create(self, value):
+        return self.metric_class(labels=_format_labels(self.label, value), **self.options)
+
+    def labels(self, value):
+        child = self.children.get(value)
+        if child is None and self.max_values:
+            with self.lock:
+                if value not in self.children and len(self.children) >= self.max_values:
+                    value = self.OTHER
+                child = self.children.get(value)
+                if child is None:
+                    child = self.children[value] = self._create(value)
+        if child is None:
+            raise KeyError(value)
+        return child
+
+    def render(self):
+        yield f'# HELP {self.name} {self.help}'
+        yield f'# TYPE {self.name} {self.kind}'
+        for child in list(self.children.values()):
+            yield from child.samples(self.name)
+
+
+def register_collector(collect):
+    """
+    Значения, которые дешевле прочитать при выдаче /metrics, чем считать
+    на каждом запросе: collect() возвращает [(имя, тип, описание, значение)]
+    """
+    _collectors.append(collect)
+
+
+def render():
+    """Все метрики в текстовом формате Prometheus"""
+    lines = []
+    for family in _registry:
+        lines.extend(family.render())
+    for collect in _collectors:
+        for name, kind, help_text, value in collect():
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {kind}')
+            lines.append(f'{name} {_format_value(value)}')
+    return '\n'.join(lines) + '\n'
+
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+STAGES = ('queue_wait', 'spawn', 'ipc', 'evaluation', 'parse', 'snippets', 'spelling',
+          'facets', 'mongo_stats', 'render')
+
+search_stage = Family('histogram', 'search_stage_seconds',
+                      'Время этапов обработки поиска', label='stage', values=STAGES,
+                      buckets=LATENCY_BUCKETS)
+search_latency = Family('histogram', 'search_request_seconds',
+                        'Полное время поиска (без рендеринга)', buckets=LATENCY_BUCKETS)
+result_size = Family('histogram', 'search_result_size',
+                     'Число найденных документов', buckets=SIZE_BUCKETS)
+search_requests = Family('counter', 'search_requests_total',
+                         'Запросы поиска по источнику результата', label='source',
+                         values=('cache', 'searcher', 'inprocess', 'coalesced', 'not_modified'))
+search_errors = Family('counter', 'search_errors_total',
+                       'Ошибки поиска', label='kind',
+                       values=('timeout', 'busy', 'not_found', 'error'))
+search_coalesced = Family('counter', 'search_coalesced_total',
+                          'Сэкономленные вычисления: запрос получил результат одинакового '
+                          'одновременного запроса этого процесса или другого воркера',
+                          label='scope', values=('process', 'worker'))
+search_truncated = Family('counter', 'search_truncated_total',
+                          'Запросы, остановленные по истечении времени на запрос, по форме '
+                          'запроса (термы заменены на t)', label='shape', max_values=200)
+search_corrections = Family('counter', 'search_corrections_total',
+                            'Запросы без результатов: предложено исправление опечаток или нет',
+                            label='outcome', values=('corrected', 'none'))
+response_compression = Family('counter', 'http_response_compression_total',
+                              'JSON и HTML ответы по кодировке тела', label='encoding',
+                              values=('gzip', 'deflate', 'identity'))
+
+QUEUE_WAIT = search_stage.labels('queue_wait')
+SPAWN = search_stage.labels('spawn')
+IPC = search_stage.labels('ipc')
+EVALUATION = search_stage.labels('evaluation')
+PARSE = search_stage.labels('parse')
+SNIPPETS = search_stage.labels('snippets')
+SPELLING = search_stage.labels('spelling')
+FACETS = search_stage.labels('facets')
+MONGO_STATS = search_stage.labels('mongo_stats')
+RENDER = search_stage.labels('render')
+
+
+def observe_response(elapsed, parse_seconds, search_us):
+    """Разложить время ответа searcher'а на ipc, evaluation и parse"""
+    evaluation = search_us / 1e6
+    EVALUATION.observe(evaluation)
+    PARSE.observe(parse_seconds)
+    IPC.observe(max(elapsed - parse_seconds - evaluation, 0.0))
@@ -0,0 +1,51 @@
+"""
+Курсоры для постраничной выдачи.
+
+Курсор - непрозрачный токен со смещением и размером страницы, привязанный
+к нормализованному запросу: курсор от другого запроса отклоняется.
+Сам список ID хранится на сервере (кэш результатов), поэтому следующая
+страница стоит O(размер страницы), а не O(число результатов).
+"""
+
+import base64
+import hashlib
+import json
+
+
+class InvalidCursor(ValueError):
+    """Курсор повреждён или выдан для другого запроса"""
+
+
+def _query_tag(key):
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()[:12]
+
+
+def encode_cursor(key, offset, limit):
+    """Курсор на страницу [offset, offset + limit) запроса key"""
+    payload = json.dumps({'q': _query_tag(key), 'o': offset, 'l': limit},
+                         separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(token, key):
+    """Разобрать курсор; возвращает (offset, limit)"""
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+        offset, limit = int(payload['o']), int(payload['l'])
+        tag = payload['q']
+    except (ValueError, KeyError, TypeError) as e:
+        raise InvalidCursor(f'Некорректный курсор: {e}')
+
+    if tag != _query_tag(key):
+        raise InvalidCursor('Курсор выдан для другого запроса')
+    if offset < 0 or limit <= 0:
+        raise InvalidCursor('Некорректный курсор')
+    return offset, limit
+
+
+def next_cursor(key, offset, limit, total):
+    """Курсор следующей страницы или None, если страница последняя"""
+    if offset + limit >= total:
+        return None
+    return encode_cursor(key, offset + limit, limit)
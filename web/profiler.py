@@ -0,0 +1,185 @@
+"""
+Выборочное профилирование запросов веб-сервиса.
+
+Пока профилируемый запрос выполняется, фоновый поток раз в interval секунд
+снимает стек его потока (sys._current_frames) - без трассировки каждого
+вызова, поэтому запрос замедляется незаметно. В профиль попадает всё, что
+выполняется в потоке запроса: обработчик Flask, разбор ответа searcher'а,
+сниппеты, рендеринг шаблона и сжатие ответа.
+
+Сохраняется каждый sample_every-й запрос и каждый запрос не быстрее
+slow_seconds. Профиль - файл collapsed stacks ("кадр;кадр;кадр число"),
+который принимают flamegraph.pl и speedscope; первый кадр - маршрут
+запроса. Файлы лежат в каталоге-кольце: после записи самые старые сверх
+max_files удаляются.
+"""
+
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+SUFFIX = '.folded'
+
+
+class Profiler:
+    """
+    Сэмплирующий профилировщик запросов.
+
+    directory    - каталог профилей (общий для воркеров)
+    sample_every - сохранять каждый N-й запрос (0 - только медленные)
+    slow_seconds - сохранять запросы не быстрее этого (0 - только каждый N-й)
+    interval     - период снятия стеков, секунды
+    max_files    - сколько последних профилей хранить
+    max_depth    - сколько кадров стека от вершины учитывать
+    """
+
+    def __init__(self, directory, sample_every=0, slow_seconds=0.0, interval=0.005,
+                 max_files=100, max_depth=64):
+        self.directory = directory
+        self.sample_every = sample_every
+        self.slow_seconds = slow_seconds
+        self.interval = interval
+        self.max_files = max_files
+        self.max_depth = max_depth
+
+        self.lock = threading.Lock()
+        self.wakeup = threading.Condition(self.lock)
+        self.active = {}  # ID потока -> _Request
+        self.thread = None
+        self.labels = {}  # code -> подпись кадра
+
+        self.requests = 0
+        self.written = 0
+        self.errors = 0
+        self.sequence = 0
+
+        os.makedirs(directory, exist_ok=True)
+
+    def begin(self):
+        """Начать запрос в текущем потоке; None - запрос не профилируется"""
+        with self.lock:
+            self.requests += 1
+            sampled = self.sample_every > 0 and self.requests % self.sample_every == 0
+            if not sampled and self.slow_seconds <= 0:
+                return None
+            record = _Request(threading.get_ident(), sampled)
+            self.active[record.thread_id] = record
+            if self.thread is None:
+                # Поток запускается при первом запросе - уже после fork воркера
+                self.thread = threading.Thread(target=self._run, name='profiler', daemon=True)
+                self.thread.start()
+            self.wakeup.notify()
+        return record
+
+    def end(self, record, name):
+        """Завершить запрос; профиль сохраняется, если запрос выбран или медленный"""
+        seconds = time.perf_counter() - record.started
+        with self.lock:
+            self.active.pop(record.thread_id, None)
+        if not (record.sampled or 0 < self.slow_seconds <= seconds):
+            return
+        # Запрос короче interval мог завершиться до первого снятия стека
+        if not record.stacks:
+            return
+        try:
+            self._write(record, name, seconds)
+        except OSError:
+            with self.lock:
+                self.errors += 1
+
+    def _run(self):
+        while True:
+            with self.lock:
+                while not self.active:
+                    self.wakeup.wait()
+                active = list(self.active.values())
+            frames = sys._current_frames()
+            samples = [(record, self._collapse(frames[record.thread_id]))
+                       for record in active if record.thread_id in frames]
+            del frames
+            with self.lock:
+                # Завершённый за это время запрос уже пишется в файл - не трогаем
+                for record, stack in samples:
+                    if self.active.get(record.thread_id) is record:
+                        record.stacks[stack] += 1
+            time.sleep(self.interval)
+
+    def _collapse(self, frame):
+        """Стек потока одной строкой от корня: 'модуль:функция;...'"""
+        labels = []
+        while frame is not None and len(labels) < self.max_depth:
+            code = frame.f_code
+            label = self.labels.get(code)
+            if label is None:
+                module = os.path.splitext(os.path.basename(code.co_filename))[0]
+                label = self.labels[code] = f'{module}:{code.co_name}'.replace(';', ',')
+            labels.append(label)
+            frame = frame.f_back
+        return ';'.join(reversed(labels))
+
+    def _write(self, record, name, seconds):
+        with self.lock:
+            self.sequence += 1
+            sequence = self.sequence
+        stamp = time.strftime('%Y%m%d-%H%M%S', time.localtime(record.wall_started))
+        filename = f'{stamp}-{os.getpid()}-{sequence}-{int(seconds * 1000)}ms{SUFFIX}'
+        path = os.path.join(self.directory, filename)
+
+        root = name.replace(';', ',').replace(' ', '_')
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            for stack, count in record.stacks.most_common():
+                f.write(f'{root};{stack} {count}\n')
+        os.replace(tmp_path, path)
+        with self.lock:
+            self.written += 1
+        self._trim()
+
+    def _trim(self):
+        """Удалить самые старые профили сверх max_files"""
+        files = self.files()
+        for filename in files[self.max_files:]:
+            try:
+                os.remove(os.path.join(self.directory, filename))
+            except FileNotFoundError:
+                # Уже удалён другим воркером
+                pass
+
+    def files(self):
+        """Имена файлов профилей, новые первыми"""
+        entries = []
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                if entry.name.endswith(SUFFIX):
+                    try:
+                        entries.append((entry.stat().st_mtime, entry.name))
+                    except FileNotFoundError:
+                        pass
+        return [name for _, name in sorted(entries, reverse=True)]
+
+    def stats(self):
+        with self.lock:
+            stats = {'sample_every': self.sample_every,
+                     'slow_ms': self.slow_seconds * 1000,
+                     'interval_ms': self.interval * 1000,
+                     'requests': self.requests,
+                     'written': self.written,
+                     'errors': self.errors}
+        stats['directory'] = self.directory
+        stats['files'] = self.files()
+        return stats
+
+
+class _Request:
+    """Профилируемый запрос: его поток и собранные стеки"""
+
+    __slots__ = ('thread_id', 'sampled', 'started', 'wall_started', 'stacks')
+
+    def __init__(self, thread_id, sampled):
+        self.thread_id = thread_id
+        self.sampled = sampled
+        self.started = time.perf_counter()
+        self.wall_started = time.time()
+        self.stacks = Counter()
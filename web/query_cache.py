@@ -0,0 +1,369 @@
+"""
+Двухуровневый кэш результатов поиска.
+
+Первый уровень - LRU в памяти процесса, второй - файл SQLite, общий для
+всех воркеров gunicorn. Значение - полный список ID найденных документов
+(array('I')), ключ - нормализованный запрос (query_parser.normalize_query).
+
+Каждая запись помечена поколением index.bin: после пересборки индекса
+старые записи перестают совпадать с текущим поколением и вытесняются.
+"""
+
+import hashlib
+import os
+import secrets
+import sqlite3
+import threading
+import time
+from array import array
+from collections import OrderedDict
+
+# Сколько байт с начала и с конца index.bin входит в хэш поколения
+_GENERATION_SAMPLE = 64 * 1024
+
+_generation_lock = threading.Lock()
+_generation_cache = {}
+
+
+def index_generation(path):
+    """
+    Поколение индекса: mtime, размер, inode и хэш начала и конца файла.
+    Хэш пересчитывается только при изменении stat, поэтому вызов дешёвый.
+    None - индекса нет.
+    """
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+
+    signature = (st.st_mtime_ns, st.st_size, st.st_ino)
+    with _generation_lock:
+        cached = _generation_cache.get(path)
+        if cached and cached[0] == signature:
+            return cached[1]
+
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return None
+    try:
+        generation = file_generation(fd, st)
+    finally:
+        os.close(fd)
+
+    with _generation_lock:
+        _generation_cache[path] = (signature, generation)
+    return generation
+
+
+def file_generation(fd, st=None):
+    """Поколение уже открытого файла индекса (то же значение, что index_generation)"""
+    if st is None:
+        st = os.fstat(fd)
+
+    digest = hashlib.sha1()
+    digest.update(os.pread(fd, _GENERATION_SAMPLE, 0))
+    tail = max(st.st_size - _GENERATION_SAMPLE, _GENERATION_SAMPLE)
+    digest.update(os.pread(fd, _GENERATION_SAMPLE, tail))
+
+    return '%x-%x-%x-%s' % (st.st_mtime_ns, st.st_size, st.st_ino,
+                            digest.hexdigest()[:16])
+
+
+class DiskCache:
+    """Общий для процессов уровень кэша в SQLite"""
+
+    def __init__(self, path, max_bytes):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.local = threading.local()
+
+        connection = self._connection()
+        with connection:
+            connection.execute('''
+                CREATE TABLE IF NOT EXISTS results (
+                    key TEXT PRIMARY KEY,
+                    generation TEXT NOT NULL,
+                    ids BLOB NOT NULL,
+                    size INTEGER NOT NULL,
+                    accessed REAL NOT NULL
+                )''')
+            connection.execute(
+                'CREATE INDEX IF NOT EXISTS results_accessed ON results (accessed)')
+            # Запросы, которые сейчас вычисляет какой-то воркер. Метки
+            # живут не дольше ttl, поэтому таблицу старого формата (без
+            # owner) можно просто пересоздать
+            columns = [row[1] for row in connection.execute('PRAGMA table_info(pending)')]
+            if columns and 'owner' not in columns:
+                connection.execute('DROP TABLE pending')
+            connection.execute('''
+                CREATE TABLE IF NOT EXISTS pending (
+                    key TEXT PRIMARY KEY,
+                    generation TEXT NOT NULL,
+                    expires REAL NOT NULL,
+                    owner TEXT NOT NULL
+                )''')
+
+    def _connection(self):
+        """Соединение SQLite нельзя делить между потоками - своё на каждый"""
+        connection = getattr(self.local, 'connection', None)
+        if connection is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            connection = sqlite3.connect(self.path, timeout=0.5)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            self.local.connection = connection
+        return connection
+
+    def get(self, key, generation):
+        connection = self._connection()
+        row = connection.execute(
+            'SELECT generation, ids FROM results WHERE key = ?', (key,)).fetchone()
+        if row is None or row[0] != generation:
+            return None
+
+        with connection:
+            connection.execute('UPDATE results SET accessed = ? WHERE key = ?',
+                               (time.time(), key))
+
+        ids = array('I')
+        ids.frombytes(row[1])
+        return ids
+
+    def put(self, key, generation, ids):
+        """Сохранить запись; возвращает количество вытесненных записей"""
+        connection = self._connection()
+        blob = ids.tobytes()
+        evicted = 0
+
+        # Транзакция: при ошибке изменения откатываются целиком
+        with connection:
+            connection.execute(
+                'INSERT OR REPLACE INTO results (key, generation, ids, size, accessed) '
+                'VALUES (?, ?, ?, ?, ?)',
+                (key, generation, blob, len(blob) + len(key), time.time()))
+
+            total = connection.execute(
+                'SELECT COALESCE(SUM(size), 0) FROM results').fetchone()[0]
+            if total > self.max_bytes:
+                # Сначала записи старых поколений, затем самые давно читанные
+                evicted += connection.execute(
+                    'DELETE FROM results WHERE generation != ?', (generation,)).rowcount
+                total = connection.execute(
+                    'SELECT COALESCE(SUM(size), 0) FROM results').fetchone()[0]
+                for old_key, size in connection.execute(
+                        'SELECT key, size FROM results ORDER BY accessed').fetchall():
+                    if total <= self.max_bytes:
+                        break
+                    connection.execute('DELETE FROM results WHERE key = ?', (old_key,))
+                    total -= size
+                    evicted += 1
+
+        return evicted
+
+    def claim(self, key, generation, ttl, owner):
+        """Занять вычисление запроса меткой owner; False - его уже выполняет другой воркер"""
+        connection = self._connection()
+        now = time.time()
+        with connection:
+            # Метки упавших воркеров и старых поколений не мешают
+            connection.execute(
+                'DELETE FROM pending WHERE key = ? AND (expires < ? OR generation != ?)',
+                (key, now, generation))
+            claimed = connection.execute(
+                'INSERT OR IGNORE INTO pending (key, generation, expires, owner) '
+                'VALUES (?, ?, ?, ?)',
+                (key, generation, now + ttl, owner)).rowcount
+        return claimed == 1
+
+    def pending(self, key, generation):
+        row = self._connection().execute(
+            'SELECT 1 FROM pending WHERE key = ? AND generation = ? AND expires >= ?',
+            (key, generation, time.time())).fetchone()
+        return row is not None
+
+    def release(self, key, generation, owner):
+        """
+        Снять метку owner. Если она истекла и запрос занял другой воркер,
+        его метка остаётся
+        """
+        connection = self._connection()
+        with connection:
+            connection.execute(
+                'DELETE FROM pending WHERE key = ? AND generation = ? AND owner = ?',
+                (key, generation, owner))
+
+
+class QueryCache:
+    """
+    LRU в памяти + общий дисковый уровень.
+
+    max_entries    - максимум записей в памяти
+    max_ids        - максимум ID документов суммарно во всех записях в памяти
+    disk_path      - файл SQLite (None - без дискового уровня)
+    disk_max_bytes - максимальный суммарный размер записей на диске
+    """
+
+    def __init__(self, max_entries=1024, max_ids=2000000, disk_path=None,
+                 disk_max_bytes=256 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_ids = max_ids
+        self.entries = OrderedDict()
+        self.size = 0
+        self.lock = threading.Lock()
+
+        self.counters = {
+            'memory_hits': 0,
+            'disk_hits': 0,
+            'misses': 0,
+            'stores': 0,
+            'evictions': 0,
+            'disk_errors': 0,
+            'claim_waits': 0,
+        }
+
+        self.disk = None
+        if disk_path:
+            try:
+                self.disk = DiskCache(disk_path, disk_max_bytes)
+            except (sqlite3.Error, OSError):
+                self.counters['disk_errors'] += 1
+
+    def get(self, key, generation):
+        """Список ID документов или None, если записи нет или она устарела"""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                if entry[0] == generation:
+                    self.entries.move_to_end(key)
+                    self.counters['memory_hits'] += 1
+                    return entry[1]
+                self._remove(key)
+
+        ids = None
+        if self.disk is not None:
+            try:
+                ids = self.disk.get(key, generation)
+            except sqlite3.Error:
+                self._count('disk_errors')
+
+        if ids is None:
+            self._count('misses')
+            return None
+
+        self._count('disk_hits')
+        with self.lock:
+            self._store(key, generation, ids)
+        return ids
+
+    def put(self, key, generation, ids):
+        """Сохранить полный список ID документов для запроса"""
+        with self.lock:
+            self._store(key, generation, ids)
+            self.counters['stores'] += 1
+
+        if self.disk is not None:
+            try:
+                evicted = self.disk.put(key, generation, ids)
+            except sqlite3.Error:
+                self._count('disk_errors')
+            else:
+                if evicted:
+                    self._count('evictions', evicted)
+
+    def claim(self, key, generation, ttl):
+        """
+        Занять вычисление запроса для всех воркеров (метка в дисковом уровне,
+        действует ttl секунд). Возвращает владельца метки - его передают в
+        release(); None - запрос уже выполняет другой воркер, результат можно
+        ждать через wait(). Без дискового уровня запрос всегда занимается.
+        """
+        # PID отличает воркеры, случайная часть - запросы одного воркера
+        owner = f'{os.getpid()}-{secrets.token_hex(8)}'
+        if self.disk is None:
+            return owner
+        try:
+            return owner if self.disk.claim(key, generation, ttl, owner) else None
+        except sqlite3.Error:
+            self._count('disk_errors')
+            return owner
+
+    def release(self, key, generation, owner):
+        """
+        Снять метку claim() с владельцем owner (после put() или ошибки
+        вычисления). Истёкшая и занятая другим воркером метка не снимается
+        """
+        if self.disk is None:
+            return
+        try:
+            self.disk.release(key, generation, owner)
+        except sqlite3.Error:
+            self._count('disk_errors')
+
+    def wait(self, key, generation, timeout):
+        """
+        Дождаться результата запроса, который вычисляет другой воркер.
+        None - вычисление завершилось без результата или не уложилось в timeout.
+        """
+        if self.disk is None:
+            return None
+        self._count('claim_waits')
+        deadline = time.monotonic() + timeout
+        delay = 0.005
+        try:
+            while True:
+                ids = self.disk.get(key, generation)
+                if ids is not None:
+                    break
+                if not self.disk.pending(key, generation):
+                    # Результат мог появиться между двумя проверками
+                    ids = self.disk.get(key, generation)
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return None
+                time.sleep(min(delay, remaining))
+                delay = min(delay * 2, 0.05)
+        except sqlite3.Error:
+            self._count('disk_errors')
+            return None
+
+        if ids is not None:
+            self._count('disk_hits')
+            with self.lock:
+                self._store(key, generation, ids)
+        return ids
+
+    def stats(self):
+        with self.lock:
+            stats = dict(self.counters)
+            stats['entries'] = len(self.entries)
+            stats['ids'] = self.size
+        lookups = stats['memory_hits'] + stats['disk_hits'] + stats['misses']
+        stats['hit_rate'] = round((lookups - stats['misses']) / lookups, 4) if lookups else 0.0
+        return stats
+
+    def _count(self, name, value=1):
+        with self.lock:
+            self.counters[name] += value
+
+    def _remove(self, key):
+        _, ids = self.entries.pop(key)
+        self.size -= len(ids)
+
+    def _store(self, key, generation, ids):
+        """Вставка в LRU с вытеснением (под self.lock)"""
+        if key in self.entries:
+            self._remove(key)
+        if len(ids) > self.max_ids:
+            return
+
+        self.entries[key] = (generation, ids)
+        self.size += len(ids)
+
+        while len(self.entries) > self.max_entries or self.size > self.max_ids:
+            old_key = next(iter(self.entries))
+            self._remove(old_key)
+            self.counters['evictions'] += 1
@@ -0,0 +1,337 @@
+#!/usr/bin/env python3
+"""
+Булев поиск в процессе веб-сервера поверх IndexReader.
+
+Грамматика и ключи термов те же, что у C++ Searcher (query_parser.py),
+результат совпадает с выдачей searcher'а, но операции над posting lists
+векторизованы (NumPy):
+  - цепочка И вычисляется от самого короткого списка к длинному;
+  - пересечение короткого списка с длинным - двоичный поиск (searchsorted),
+    при крупных операндах - плотная битовая маска по всем документам;
+  - НЕ внутри И - разность множеств, дополнение до всей коллекции
+    строится только для НЕ вне И (как в Searcher::negate).
+
+Срок вычисления (deadline, по time.monotonic) проверяется перед каждым
+узлом дерева (Searcher сверяется с часами ещё и внутри слияния списков,
+здесь операция над списками - один вызов NumPy): после него оставшиеся
+поддеревья не вычисляются, результат неполный (truncated), но остаётся
+подмножеством точного - невычисленное поддерево без отрицания считается
+пустым, под отрицанием - всей коллекцией (_ALL).
+
+Ранжирование BM25 (search_ranked) повторяет Searcher::search_ranked: те же
+оценки и тот же порядок, лучшие depth выбираются частичной сортировкой.
+
+Бенчмарк против searcher'а:
+    python query_engine.py ../data/index.bin "запрос" ["запрос" ...]
+"""
+
+import math
+import subprocess
+import sys
+import time
+
+import numpy
+
+from index_reader import IndexReader
+from query_parser import parse_query, term_key
+from stemmer import stem
+from tokenizer import tokenize
+
+# Операнд считается крупным, если в нём не меньше 1/DENSE_FRACTION документов
+DENSE_FRACTION = 32
+
+_EMPTY = numpy.empty(0, dtype=numpy.uint32)
+
+# Вся коллекция: невычисленное поддерево под отрицанием
+_ALL = object()
+
+# Параметры BM25, как в Searcher
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+
+class QueryEngine:
+    """Вычисление запросов по posting lists одного индекса"""
+
+    def __init__(self, reader, deadline=None):
+        self.reader = reader
+        self.num_docs = reader.num_docs
+        self.dense_threshold = max(self.num_docs // DENSE_FRACTION, 1)
+        self.deadline = deadline
+        self.truncated = False
+
+    def _expired(self):
+        if self.deadline is not None and not self.truncated and time.monotonic() >= self.deadline:
+            self.truncated = True
+        return self.truncated
+
+    def search(self, query):
+        """Отсортированный массив ID документов (uint32), как Searcher::search"""
+        self.truncated = False
+        tree = parse_query(query)
+        if tree is None:
+            # Запрос не разобран: И по всем токенам, стемминг один раз
+            tokens = tokenize(query)
+            if not tokens:
+                return _EMPTY
+            lists = []
+            for token in tokens:
+                if self._expired():
+                    return _EMPTY
+                lists.append(self._postings(stem(token)))
+            return self._intersect_all(lists)
+        return self.evaluate(tree)
+
+    def search_ranked(self, query, depth):
+        """
+        Все найденные ID в порядке выдачи, как Searcher::search_ranked:
+        depth лучших по BM25 (при равной оценке - меньший ID), затем остальные по ID
+        """
+        ids = self.search(query)
+        if len(ids) == 0 or depth <= 0 or self._expired():
+            return ids
+
+        scores = self.score(ids, _scoring_keys(query))
+        if len(ids) > depth:
+            # depth-я по величине оценка; из равных ей берутся документы с меньшим ID
+            threshold = -numpy.partition(-scores, depth - 1)[depth - 1]
+            better = numpy.flatnonzero(scores > threshold)
+            equal = numpy.flatnonzero(scores == threshold)[:depth - len(better)]
+            top = numpy.concatenate((better, equal))
+        else:
+            top = numpy.arange(len(ids))
+        top = top[numpy.lexsort((top, -scores[top]))]
+
+        rest = numpy.ones(len(ids), dtype=bool)
+        rest[top] = False
+        return numpy.concatenate((ids[top], ids[rest]))
+
+    def score(self, ids, keys):
+        """Оценки BM25 документов ids (отсортированных) по ключам термов keys"""
+        scores = numpy.zeros(len(ids), dtype=numpy.float64)
+        lengths = self.reader.doc_lengths()
+        avg_length = self.reader.avg_doc_length()
+
+        for key in keys:
+            term_id = self.reader.find(key)
+            if term_id < 0:
+                continue
+            postings = self.reader.postings_by_id(term_id)
+            df = float(len(postings))
+            idf = math.log(1.0 + (self.num_docs - df + 0.5) / (df + 0.5))
+
+            positions = numpy.searchsorted(ids, postings)
+            found = positions < len(ids)
+            found[found] = ids[positions[found]] == postings[found]
+            positions = positions[found]
+            tf = self.reader.term_freqs_by_id(term_id)[found].astype(numpy.float64)
+
+            if avg_length > 0:
+                norm = 1.0 - BM25_B + BM25_B * lengths[ids[positions]] / avg_length
+            else:
+                norm = 1.0
+            scores[positions] += idf * tf * (BM25_K1 + 1.0) / (tf + BM25_K1 * norm)
+        return scores
+
+    def evaluate(self, node, negated=False):
+        """
+        ID документов узла; negated - узел под нечётным числом отрицаний.
+        После срока может вернуть _ALL (только при negated)
+        """
+        if self._expired():
+            return _ALL if negated else _EMPTY
+
+        kind = node[0]
+
+        if kind == 'term':
+            return self._postings(term_key(node[1]))
+
+        if kind == 'not':
+            return self._negate([node[1]], negated)
+
+        operands = _flatten(node, kind)
+
+        if kind == 'or':
+            lists = [self.evaluate(child, negated) for child in operands]
+            if any(ids is _ALL for ids in lists):
+                return _ALL
+            return self._union_all(lists)
+
+        positive = [child for child in operands if child[0] != 'not']
+        negative = [child[1] for child in operands if child[0] == 'not']
+
+        # Термы дешевле: длина posting list известна без вычисления
+        lists = []
+        for child in sorted(positive, key=self._estimate):
+            ids = self.evaluate(child, negated)
+            if ids is _ALL:
+                continue
+            if len(ids) == 0:
+                return _EMPTY
+            lists.append(ids)
+
+        if not lists:
+            # Только отрицания: !a !b = !(a || b)
+            return self._negate(negative, negated) if negative else _ALL
+
+        result = self._intersect_all(lists)
+        for child in negative:
+            if len(result) == 0:
+                break
+            excluded = self.evaluate(child, not negated)
+            if excluded is _ALL:
+                return _EMPTY
+            result = self._difference(result, excluded)
+        return result
+
+    def _negate(self, operands, negated):
+        """Дополнение объединения operands"""
+        lists = [self.evaluate(child, not negated) for child in operands]
+        if any(ids is _ALL for ids in lists):
+            return _EMPTY
+        if self._expired():
+            return _ALL if negated else _EMPTY
+        return self._complement(self._union_all(lists))
+
+    def _postings(self, key):
+        if key is None:
+            return _EMPTY
+        return self.reader.postings(key)
+
+    def _estimate(self, node):
+        """Оценка размера операнда для порядка вычисления И"""
+        if node[0] == 'term':
+            key = term_key(node[1])
+            term_id = self.reader.find(key) if key is not None else -1
+            return self.reader.doc_freq(term_id) if term_id >= 0 else 0
+        return self.num_docs
+
+    def _mask(self, ids):
+        mask = numpy.zeros(self.num_docs, dtype=bool)
+        mask[ids] = True
+        return mask
+
+    def _contains(self, ids, other):
+        """Булев массив: какие элементы ids есть в отсортированном other"""
+        if len(other) >= self.dense_threshold:
+            return self._mask(other)[ids]
+        positions = numpy.searchsorted(other, ids)
+        positions[positions == len(other)] = 0
+        return other[positions] == ids
+
+    def _intersect_all(self, lists):
+        lists = sorted(lists, key=len)
+        result = lists[0]
+        for other in lists[1:]:
+            if len(result) == 0:
+                return _EMPTY
+            result = result[self._contains(result, other)]
+        return result
+
+    def _union_all(self, lists):
+        lists = [ids for ids in lists if len(ids)]
+        if not lists:
+            return _EMPTY
+        if len(lists) == 1:
+            return lists[0]
+        if sum(len(ids) for ids in lists) >= self.dense_threshold:
+            mask = numpy.zeros(self.num_docs, dtype=bool)
+            for ids in lists:
+                mask[ids] = True
+            return numpy.flatnonzero(mask).astype(numpy.uint32)
+        return numpy.unique(numpy.concatenate(lists))
+
+    def _difference(self, ids, excluded):
+        if len(excluded) == 0:
+            return ids
+        return ids[~self._contains(ids, excluded)]
+
+    def _complement(self, ids):
+        mask = numpy.ones(self.num_docs, dtype=bool)
+        mask[ids] = False
+        return numpy.flatnonzero(mask).astype(numpy.uint32)
+
+
+def _scoring_keys(query):
+    """
+    Ключи термов, дающих оценку BM25 (Searcher::collect_scoring_terms): термы
+    вне отрицаний без повторов; без дерева - все токены, стемминг один раз
+    """
+    tree = parse_query(query)
+    if tree is None:
+        return [stem(token) for token in dict.fromkeys(tokenize(query))]
+
+    stems = []
+    stack = [tree]
+    while stack:
+        node = stack.pop()
+        if node[0] == 'term':
+            tokens = tokenize(node[1])
+            if tokens and stem(tokens[0]) not in stems:
+                stems.append(stem(tokens[0]))
+        elif node[0] != 'not':
+            stack.append(node[2])
+            stack.append(node[1])
+    # Searcher ищет стем терма ещё раз через search_term (как term_key)
+    return [stem(text) for text in stems]
+
+
+def _flatten(node, kind):
+    """Операнды цепочки одинаковых бинарных узлов ('and' или 'or')"""
+    operands = []
+    stack = [node]
+    while stack:
+        current = stack.pop()
+        if current[0] == kind:
+            stack.append(current[2])
+            stack.append(current[1])
+        else:
+            operands.append(current)
+    return operands
+
+
+def _benchmark(index_path, queries, searcher_path='../engine/searcher', repeat=20):
+    reader = IndexReader(index_path)
+    engine = QueryEngine(reader)
+
+    searcher = subprocess.Popen(
+        [searcher_path, f'--index={index_path}', '--batch', '--format=jsonl'],
+        stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    searcher.stdout.readline()  # {"type":"ready",...}
+
+    from searcher_pool import ResponseParser, format_request
+
+    def run_subprocess(query):
+        searcher.stdin.write(format_request(query, 0, with_ids=True))
+        searcher.stdin.flush()
+        parser = ResponseParser()
+        while not parser.feed(searcher.stdout.readline()):
+            pass
+        return parser.result()['ids']
+
+    print(f'{"Запрос":<40} {"Найдено":>8} {"Python, мкс":>12} {"searcher, мкс":>14}')
+    for query in queries:
+        expected = run_subprocess(query)
+        found = engine.search(query)
+        if found.tolist() != expected:
+            print(f'{query}: результаты различаются ({len(found)} и {len(expected)})')
+
+        timings = []
+        for run in (lambda: engine.search(query), lambda: run_subprocess(query)):
+            started = time.perf_counter()
+            for _ in range(repeat):
+                run()
+            timings.append((time.perf_counter() - started) / repeat * 1e6)
+
+        print(f'{query:<40} {len(found):>8} {timings[0]:>12.0f} {timings[1]:>14.0f}')
+
+    searcher.stdin.close()
+    searcher.wait()
+    reader.close()
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 3:
+        print('Использование: python query_engine.py index.bin "запрос" ["запрос" ...]')
+        sys.exit(1)
+    _benchmark(sys.argv[1], sys.argv[2:])
@@ -0,0 +1,267 @@
+"""
+Парсер булевых запросов, совпадающий с C++ QueryParser (engine/src/query_parser.cpp).
+
+Синтаксис:
+  - Пробел или && - логическое И
+  - || - логическое ИЛИ
+  - ! - логическое НЕ
+  - Скобки для группировки
+
+Дерево запроса - кортежи:
+  ('term', слово), ('and', левый, правый), ('or', левый, правый), ('not', операнд)
+
+Разбор идёт по байтам UTF-8, как в C++: например, неизвестный символ
+посреди запроса так же обрывает разбор, а нераспознанный запрос
+так же возвращает None (searcher тогда ищет AND по всем токенам).
+"""
+
+from stemmer import stem
+from tokenizer import tokenize
+
+
+class QueryParser:
+    """Рекурсивный спуск по строке запроса"""
+
+    def parse(self, query):
+        """Распарсить строку запроса; None если ошибка"""
+        self.input = query.encode('utf-8')
+        self.pos = 0
+
+        if not self.input:
+            return None
+
+        self.skip_whitespace()
+        if self.pos >= len(self.input):
+            return None
+
+        return self.parse_or()
+
+    def skip_whitespace(self):
+        while self.pos < len(self.input) and self.input[self.pos] in b' \t':
+            self.pos += 1
+
+    def peek(self):
+        if self.pos >= len(self.input):
+            return 0
+        return self.input[self.pos]
+
+    def parse_or(self):
+        left = self.parse_and()
+        if left is None:
+            return None
+
+        self.skip_whitespace()
+
+        while self.input.startswith(b'||', self.pos):
+            self.pos += 2
+            self.skip_whitespace()
+
+            right = self.parse_and()
+            if right is None:
+                return None
+
+            left = ('or', left, right)
+            self.skip_whitespace()
+
+        return left
+
+    def parse_and(self):
+        left = self.parse_not()
+        if left is None:
+            return None
+
+        self.skip_whitespace()
+
+        while True:
+            if self.input.startswith(b'&&', self.pos):
+                self.pos += 2
+                self.skip_whitespace()
+
+                right = self.parse_not()
+                if right is None:
+                    return None
+
+                left = ('and', left, right)
+                self.skip_whitespace()
+                continue
+
+            if self.pos < len(self.input):
+                c = self.input[self.pos]
+
+                if c in b'|)':
+                    break
+
+                # Как std::isalpha в локали "C": только латиница
+                if (0x41 <= c <= 0x5A or 0x61 <= c <= 0x7A or
+                        c in b'!(' or c >= 0xD0):
+                    right = self.parse_not()
+                    if right is None:
+                        return None
+
+                    left = ('and', left, right)
+                    self.skip_whitespace()
+                    continue
+
+            break
+
+        return left
+
+    def parse_not(self):
+        self.skip_whitespace()
+
+        if self.peek() == ord('!'):
+            self.pos += 1
+            self.skip_whitespace()
+
+            operand = self.parse_not()
+            if operand is None:
+                return None
+            return ('not', operand)
+
+        return self.parse_primary()
+
+    def parse_primary(self):
+        self.skip_whitespace()
+
+        if self.peek() == ord('('):
+            self.pos += 1
+
+            expr = self.parse_or()
+            if expr is None:
+                return None
+
+            self.skip_whitespace()
+            if self.peek() != ord(')'):
+                return None
+            self.pos += 1
+
+            return expr
+
+        return self.parse_term()
+
+    def parse_term(self):
+        self.skip_whitespace()
+
+        start = self.pos
+        data = self.input
+
+        while self.pos < len(data):
+            c = data[self.pos]
+
+            if _is_alnum(c):
+                self.pos += 1
+                continue
+
+            if c in (0xD0, 0xD1) and self.pos + 1 < len(data):
+                self.pos += 2
+                continue
+
+            if (c == 0x2D and self.pos > start and self.pos + 1 < len(data) and
+                    (_is_alnum(data[self.pos + 1]) or data[self.pos + 1] in (0xD0, 0xD1))):
+                self.pos += 1
+                continue
+
+            break
+
+        if self.pos == start:
+            return None
+
+        return ('term', data[start:self.pos].decode('utf-8', errors='replace'))
+
+
+def _is_alnum(c):
+    return 0x30 <= c <= 0x39 or 0x41 <= c <= 0x5A or 0x61 <= c <= 0x7A
+
+
+def parse_query(query):
+    """Распарсить запрос (новый парсер на каждый вызов: парсер хранит состояние)"""
+    return QueryParser().parse(query)
+
+
+def term_key(term):
+    """
+    Ключ терма в индексе, как его ищет C++ Searcher: первый токен,
+    стеммированный дважды (Searcher::execute, затем Indexer::search_term)
+    """
+    tokens = tokenize(term)
+    if not tokens:
+        return None
+    return stem(stem(tokens[0]))
+
+
+def normalize_query(query):
+    """
+    Каноническая форма запроса: одинаковая строка - одинаковый результат.
+
+    Пробелы и написание операторов не важны, неявное И совпадает с &&,
+    операнды И/ИЛИ упорядочены, термы заменены ключами индекса.
+    """
+    tree = parse_query(query)
+    if tree is None:
+        # Searcher::search без дерева: И по всем токенам, стемминг один раз
+        return '~' + ' '.join(sorted({stem(token) for token in tokenize(query)}))
+    return _canonical(tree)
+
+
+def _canonical(node):
+    kind = node[0]
+
+    if kind == 'term':
+        key = term_key(node[1])
+        # Терм без букв ничего не находит
+        return key if key is not None else '#'
+
+    if kind == 'not':
+        operand = node[1]
+        text = _canonical(operand)
+        return f'!({text})' if operand[0] in ('and', 'or') else '!' + text
+
+    operands = set()
+    stack = [node[1], node[2]]
+    while stack:
+        child = stack.pop()
+        if child[0] == kind:
+            stack.extend((child[1], child[2]))
+            continue
+        text = _canonical(child)
+        operands.add(f'({text})' if child[0] in ('and', 'or') else text)
+
+    separator = ' && ' if kind == 'and' else ' || '
+    return separator.join(sorted(operands))
+
+
+def query_shape(query, max_length=80):
+    """
+    Форма запроса для метрик: термы заменены на t, операнды И/ИЛИ
+    упорядочены, поэтому запросы одной структуры дают одну строку
+    """
+    tree = parse_query(query)
+    if tree is None:
+        return 'plain'
+    shape = _shape(tree)
+    return shape if len(shape) <= max_length else shape[:max_length - 3] + '...'
+
+
+def _shape(node):
+    kind = node[0]
+
+    if kind == 'term':
+        return 't'
+
+    if kind == 'not':
+        operand = node[1]
+        text = _shape(operand)
+        return f'!({text})' if operand[0] in ('and', 'or') else '!' + text
+
+    operands = []
+    stack = [node[1], node[2]]
+    while stack:
+        child = stack.pop()
+        if child[0] == kind:
+            stack.extend((child[1], child[2]))
+            continue
+        text = _shape(child)
+        operands.append(f'({text})' if child[0] in ('and', 'or') else text)
+
+    separator = ' && ' if kind == 'and' else ' || '
+    return separator.join(sorted(operands))
@@ -0,0 +1,335 @@
+"""
+Пул долгоживущих процессов C++ searcher в пакетном режиме (--batch).
+
+Каждый процесс загружает index.bin один раз и дальше получает запросы
+через stdin, а ответы отдаёт через stdout. Поэтому время ответа
+определяется выполнением запроса, а не загрузкой индекса.
+"""
+
+import json
+import os
+import queue
+import select
+import subprocess
+import threading
+import time
+
+import metrics
+
+
+class SearcherError(Exception):
+    """Ошибка процесса searcher (падение, неожиданный вывод)"""
+
+
+class SearcherTimeout(SearcherError):
+    """Запрос не уложился в отведённое время"""
+
+
+class SearcherBusy(SearcherError):
+    """Очередь запросов переполнена"""
+
+
+class LineReader:
+    """Построчное чтение из pipe с ограничением по времени"""
+
+    def __init__(self, stream):
+        self.fd = stream.fileno()
+        self.buffer = b''
+        self.pos = 0
+
+    def readline(self, deadline):
+        """Прочитать одну строку (без перевода строки) до момента deadline"""
+        while True:
+            newline = self.buffer.find(b'\n', self.pos)
+            if newline >= 0:
+                line = self.buffer[self.pos:newline]
+                self.pos = newline + 1
+                return line
+
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise SearcherTimeout('Timeout')
+
+            ready, _, _ = select.select([self.fd], [], [], remaining)
+            if not ready:
+                raise SearcherTimeout('Timeout')
+
+            chunk = os.read(self.fd, 65536)
+            if not chunk:
+                raise SearcherError('Searcher завершился')
+            # Прочитанная часть буфера отбрасывается только при дочитывании,
+            # поэтому разбор ответа линеен по его размеру
+            self.buffer = self.buffer[self.pos:] + chunk
+            self.pos = 0
+
+
+class ResponseParser:
+    """
+    Разбор ответа searcher'а в формате jsonl на один запрос по строкам:
+    запись header, затем ровно header['hits'] записей hit.
+    Строки до заголовка (запись ready) пропускаются.
+    Не зависит от способа чтения, поэтому общий для потоков и asyncio.
+    """
+
+    def __init__(self):
+        self.header = None
+        self.documents = []
+
+    def feed(self, line):
+        """Обработать строку; True - ответ собран целиком"""
+        record = json.loads(line)
+        if self.header is None:
+            if record.get('type') == 'header':
+                self.header = record
+            return self.done()
+
+        self.documents.append({
+            'id': record['id'],
+            'title': record['title'],
+            'url': record['url'],
+            'category': record['category'],
+            'source': record['source'],
+        })
+        return self.done()
+
+    def done(self):
+        return self.header is not None and len(self.documents) >= self.header['hits']
+
+    def result(self):
+        result = {
+            'total': self.header['total'],
+            'documents': self.documents,
+            'search_us': self.header['search_us'],
+        }
+        if 'ids' in self.header:
+            result['ids'] = self.header['ids']
+        if self.header.get('truncated'):
+            result['truncated'] = True
+        return result
+
+
+def read_search_response(reader, deadline):
+    """Прочитать из LineReader ответ на один запрос"""
+    started = time.perf_counter()
+    parser = ResponseParser()
+    parse_seconds = 0.0
+    while True:
+        line = reader.readline(deadline)
+        parse_started = time.perf_counter()
+        done = parser.feed(line)
+        parse_seconds += time.perf_counter() - parse_started
+        if done:
+            break
+    result = parser.result()
+    metrics.observe_response(time.perf_counter() - started, parse_seconds, result['search_us'])
+    return result
+
+
+def format_request(query, limit, with_ids=False, rank_depth=0, budget_ms=0):
+    """
+    Строка пакетного режима: опции, табуляция, запрос.
+    rank_depth > 0 - ранжирование BM25 для стольких лучших документов;
+    budget_ms > 0 - время на вычисление, после него результат неполный (truncated)
+    """
+    # Перевод строки или табуляция внутри запроса сломали бы протокол
+    query = ' '.join(query.split())
+    options = f'limit={limit}'
+    if with_ids:
+        options += ' ids=1'
+    if rank_depth > 0:
+        options += f' rank=bm25 depth={rank_depth}'
+    if budget_ms > 0:
+        options += f' budget_ms={budget_ms}'
+    return f'{options}\t{query}\n'.encode('utf-8')
+
+
+class SearcherWorker:
+    """
+    Один процесс searcher в пакетном режиме.
+    pass_fds - дескрипторы, наследуемые процессом (индекс как /dev/fd/N)
+    """
+
+    def __init__(self, searcher_path, index_path, pass_fds=()):
+        self.process = subprocess.Popen(
+            [searcher_path, f'--index={index_path}', '--batch', '--format=jsonl'],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            pass_fds=pass_fds,
+        )
+        self.reader = LineReader(self.process.stdout)
+        self.ready = False
+
+    def wait_ready(self, deadline):
+        """Дождаться записи ready: индекс загружен"""
+        while not self.ready:
+            record = json.loads(self.reader.readline(deadline))
+            self.ready = record.get('type') == 'ready'
+
+    def alive(self):
+        return self.process.poll() is None
+
+    def _write(self, data):
+        try:
+            self.process.stdin.write(data)
+            self.process.stdin.flush()
+        except (BrokenPipeError, OSError) as e:
+            raise SearcherError(f'Searcher недоступен: {e}')
+
+    def _read(self, deadline):
+        try:
+            return read_search_response(self.reader, deadline)
+        except (ValueError, KeyError) as e:
+            raise SearcherError(f'Некорректный ответ searcher: {e}')
+
+    def search(self, query, limit, timeout, with_ids=False, rank_depth=0, budget_ms=0):
+        """Выполнить запрос; при таймауте или ошибке процесс больше не пригоден"""
+        deadline = time.monotonic() + timeout
+        self._write(format_request(query, limit, with_ids, rank_depth, budget_ms))
+        return self._read(deadline)
+
+    def search_many(self, requests, timeout, with_ids=False, budget_ms=0):
+        """
+        Пакет запросов [(запрос, limit)] с общим кэшем термов (":batch N").
+        Запросы отправляются по одному: иначе searcher, которому некуда
+        писать ответы, перестал бы читать stdin, и запись зависла бы.
+        """
+        deadline = time.monotonic() + timeout
+        self._write(b':batch %d\n' % len(requests))
+        results = []
+        for query, limit in requests:
+            self._write(format_request(query, limit, with_ids, budget_ms=budget_ms))
+            results.append(self._read(deadline))
+        return results
+
+    def close(self):
+        """Остановить процесс (мягко, затем принудительно)"""
+        try:
+            self.process.stdin.close()
+        except OSError:
+            pass
+        try:
+            self.process.wait(timeout=1)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+            self.process.wait()
+        self.process.stdout.close()
+
+
+class SearcherPool:
+    """
+    Пул процессов searcher с ограниченной очередью.
+
+    size          - количество процессов
+    timeout       - время на один запрос, после которого процесс перезапускается
+    queue_size    - сколько запросов может ждать свободный процесс
+    queue_timeout - сколько запрос может ждать в очереди
+    """
+
+    def __init__(self, searcher_path, index_path, size=4, timeout=30.0,
+                 queue_size=32, queue_timeout=5.0, pass_fds=()):
+        self.searcher_path = searcher_path
+        self.index_path = index_path
+        self.pass_fds = pass_fds
+        self.size = size
+        self.timeout = timeout
+        self.queue_timeout = queue_timeout
+
+        self.idle = queue.LifoQueue()
+        self.slots = threading.BoundedSemaphore(size + queue_size)
+        self.lock = threading.Lock()
+        self.workers = []
+        self.restarts = 0
+        self.closed = False
+
+    def start(self):
+        """Запустить все процессы (индекс загружается параллельно)"""
+        for _ in range(self.size):
+            self.idle.put(self._spawn())
+
+    def _spawn(self):
+        started = time.perf_counter()
+        worker = SearcherWorker(self.searcher_path, self.index_path, self.pass_fds)
+        metrics.SPAWN.observe(time.perf_counter() - started)
+        with self.lock:
+            self.workers.append(worker)
+        return worker
+
+    def wait_ready(self, timeout):
+        """Дождаться загрузки индекса всеми процессами (до первого запроса к пулу)"""
+        deadline = time.monotonic() + timeout
+        with self.lock:
+            workers = list(self.workers)
+        for worker in workers:
+            worker.wait_ready(deadline)
+
+    def _replace(self, worker):
+        """Убить процесс и запустить вместо него новый"""
+        with self.lock:
+            if worker in self.workers:
+                self.workers.remove(worker)
+            self.restarts += 1
+        try:
+            worker.process.kill()
+        except OSError:
+            pass
+        worker.close()
+        return self._spawn()
+
+    def search(self, query, limit=50, with_ids=False, rank_depth=0, budget_ms=0):
+        """
+        Выполнить запрос на свободном процессе пула.
+        with_ids - вернуть в ответе полный список ID документов ('ids');
+        rank_depth - упорядочить по BM25 столько лучших документов (0 - по ID);
+        budget_ms - время на вычисление запроса (0 - без ограничения); после
+        него searcher отдаёт неполный результат с 'truncated': True, а timeout
+        пула остаётся запасным ограничением.
+        """
+        return self._run(lambda worker: worker.search(query, limit, self.timeout, with_ids,
+                                                      rank_depth, budget_ms))
+
+    def search_many(self, requests, with_ids=False, budget_ms=0):
+        """Пакет запросов [(запрос, limit)] на одном процессе; ответы в том же порядке"""
+        return self._run(lambda worker: worker.search_many(requests, self.timeout, with_ids,
+                                                           budget_ms))
+
+    def _run(self, call):
+        """Вызвать call(worker) на свободном процессе пула"""
+        if self.closed:
+            raise SearcherError('Пул остановлен')
+
+        if not self.slots.acquire(blocking=False):
+            raise SearcherBusy('Searcher busy')
+        try:
+            started = time.perf_counter()
+            try:
+                worker = self.idle.get(timeout=self.queue_timeout)
+            except queue.Empty:
+                raise SearcherBusy('Searcher busy')
+            finally:
+                metrics.QUEUE_WAIT.observe(time.perf_counter() - started)
+
+            if not worker.alive():
+                worker = self._replace(worker)
+
+            try:
+                result = call(worker)
+            except SearcherError:
+                # Завис или упал: процесс в неизвестном состоянии протокола
+                worker = self._replace(worker)
+                raise
+            finally:
+                self.idle.put(worker)
+
+            return result
+        finally:
+            self.slots.release()
+
+    def close(self):
+        """Остановить все процессы пула"""
+        self.closed = True
+        with self.lock:
+            workers = list(self.workers)
+            self.workers.clear()
+        for worker in workers:
+            worker.close()
@@ -0,0 +1,85 @@
+"""
+Объединение одинаковых одновременных вычислений (singleflight).
+
+Первый вызов с ключом выполняет функцию, остальные вызовы с тем же ключом,
+пришедшие до её завершения, ждут и получают тот же результат (или то же
+исключение). После завершения ключ освобождается: следующий вызов снова
+вычисляет, а повторное использование результата - задача кэша.
+"""
+
+import asyncio
+import threading
+
+
+class _Call:
+    """Одно выполняемое вычисление и его результат"""
+
+    def __init__(self, done):
+        self.done = done
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """Объединение вызовов из потоков одного процесса"""
+
+    def __init__(self):
+        self.calls = {}
+        self.lock = threading.Lock()
+
+    def do(self, key, fn):
+        """(результат fn(), shared); shared - результат получен от чужого вызова"""
+        with self.lock:
+            call = self.calls.get(key)
+            leader = call is None
+            if leader:
+                call = self.calls[key] = _Call(threading.Event())
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+
+        try:
+            call.result = fn()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self.lock:
+                del self.calls[key]
+            call.done.set()
+        return call.result, False
+
+
+class AsyncSingleFlight:
+    """Объединение корутин одного цикла событий"""
+
+    def __init__(self):
+        self.calls = {}
+
+    async def do(self, key, fn):
+        """(await fn(), shared), как SingleFlight.do"""
+        while True:
+            call = self.calls.get(key)
+            if call is None:
+                break
+            await call.done.wait()
+            # Отменённый первый вызов не отменяет ожидающих: вычисляет следующий
+            if isinstance(call.error, asyncio.CancelledError):
+                continue
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+
+        call = self.calls[key] = _Call(asyncio.Event())
+        try:
+            call.result = await fn()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            del self.calls[key]
+            call.done.set()
+        return call.result, False
@@ -0,0 +1,157 @@
+"""
+Сниппеты с подсветкой найденных термов.
+
+Слово текста совпадает с термом запроса, если его основа равна ключу
+терма в индексе (как при индексации). Основа слова почти всегда - его
+префикс, поэтому кандидаты находит поиск префиксов ключей в тексте,
+а стеммер проверяет только их.
+Окно сниппета - отрезок текста заданной ширины, покрывающий больше всего
+разных термов (скользящее окно по найденным совпадениям, тоже один проход).
+"""
+
+import re
+from functools import lru_cache
+
+from markupsafe import Markup, escape
+
+from query_parser import parse_query, term_key
+from stemmer import stem
+from tokenizer import LETTERS, tokenize
+
+SNIPPET_CHARS = 240
+
+_stem = lru_cache(maxsize=65536)(stem)
+_SPACES = re.compile(r'\s+')
+_WORD = re.compile(f'[{LETTERS}]+')
+_LOWER_LETTERS = frozenset('abcdefghijklmnopqrstuvwxyzабвгдежзийклмнопрстуфхцчшщъыьэюяё')
+
+def query_keys(query):
+    """Ключи индекса для термов запроса, кроме термов под НЕ"""
+    tree = parse_query(query)
+    if tree is None:
+        # Как Searcher::search без дерева: стемминг один раз
+        return frozenset(stem(token) for token in tokenize(query))
+
+    keys = set()
+    stack = [tree]
+    while stack:
+        node = stack.pop()
+        if node[0] == 'term':
+            key = term_key(node[1])
+            if key:
+                keys.add(key)
+        elif node[0] in ('and', 'or'):
+            stack.extend((node[1], node[2]))
+    return frozenset(keys)
+
+
+@lru_cache(maxsize=1024)
+def _prefixes(keys):
+    """Префиксы слов, основа которых может совпасть с одним из ключей"""
+    prefixes = set()
+    for key in keys:
+        # Английский стеммер заменяет -y и -ies на -i: префикс без последней буквы
+        if key.endswith('i') and key.isascii() and len(key) > 1:
+            key = key[:-1]
+        prefixes.add(key)
+    return tuple(prefixes)
+
+
+def find_matches(text, keys):
+    """Совпадения с термами: [(начало, конец, ключ)] по возрастанию позиции"""
+    if not keys:
+        return []
+
+    lowered = text.lower()
+    if len(lowered) != len(text):
+        # Редкие символы меняют длину при lower(): позиции бы разошлись
+        lowered = ''.join(char.lower()[0] for char in text)
+
+    # str.find по каждому префиксу работает на скорости memchr, в отличие
+    # от регулярного выражения с альтернативами
+    words = {}
+    for prefix in _prefixes(keys):
+        position = lowered.find(prefix)
+        while position >= 0:
+            if position == 0 or lowered[position - 1] not in _LOWER_LETTERS:
+                if position not in words:
+                    words[position] = _WORD.match(lowered, position).end()
+            position = lowered.find(prefix, position + 1)
+
+    matches = []
+    for start in sorted(words):
+        key = _stem(lowered[start:words[start]])
+        if key in keys:
+            matches.append((start, words[start], key))
+    return matches
+
+
+def best_window(matches, width):
+    """
+    Отрезок [начало, конец) совпадений, помещающийся в width символов
+    и содержащий больше всего разных термов (при равенстве - больше совпадений)
+    """
+    counts = {}
+    best = (0, 0, 0, 0)  # разных термов, совпадений, левое, правое совпадение
+    left = 0
+    for right, (_, end, key) in enumerate(matches):
+        counts[key] = counts.get(key, 0) + 1
+        while end - matches[left][0] > width:
+            left_key = matches[left][2]
+            counts[left_key] -= 1
+            if not counts[left_key]:
+                del counts[left_key]
+            left += 1
+        candidate = (len(counts), right - left + 1, left, right)
+        if candidate[:2] > best[:2]:
+            best = candidate
+    return best[2], best[3]
+
+
+def make_snippet(text, keys, width=SNIPPET_CHARS):
+    """HTML-фрагмент текста вокруг лучшего окна совпадений, термы в <mark>"""
+    if not text:
+        return Markup('')
+
+    matches = find_matches(text, keys)
+    if matches:
+        first, last = best_window(matches, width)
+        span_start, span_end = matches[first][0], matches[last][1]
+        start = max(span_start - (width - (span_end - span_start)) // 2, 0)
+    else:
+        span_start = span_end = 0
+        start = 0
+    end = min(start + width, len(text))
+    start = max(min(start, end - width), 0)
+
+    # Не резать слова на границах окна
+    if start > 0:
+        space = text.find(' ', start, span_start if matches else end)
+        if space >= 0:
+            start = space + 1
+    if end < len(text):
+        space = text.rfind(' ', max(span_end, start), end)
+        if space > start:
+            end = space
+
+    parts = ['… '] if start > 0 else []
+    position = start
+    for match_start, match_end, _ in matches:
+        if match_start < start or match_end > end:
+            continue
+        parts.append(escape(_SPACES.sub(' ', text[position:match_start])))
+        parts.append(Markup('<mark>%s</mark>') % text[match_start:match_end])
+        position = match_end
+    parts.append(escape(_SPACES.sub(' ', text[position:end])))
+    if end < len(text):
+        parts.append(' …')
+
+    return Markup('').join(parts)
+
+
+def add_snippets(documents, query, doc_store):
+    """Добавить документам поле snippet (HTML) из хранилища текстов"""
+    keys = query_keys(query)
+    for document in documents:
+        document['snippet'] = make_snippet(doc_store.text(document['id']), keys)
+    return documents
@@ -0,0 +1,59 @@
+"""
+Исправление опечаток в запросах без результатов ("возможно, вы имели в виду").
+
+Слова запроса, которых нет в индексе, заменяются ближайшими словоформами
+словаря подсказок (Suggester.similar): сначала меньшее расстояние
+Левенштейна, затем большее число документов. На каждое слово отводится
+не больше budget секунд, поэтому исправление не задерживает ответ.
+"""
+
+import re
+import time
+
+from query_parser import term_key
+from tokenizer import LETTERS
+
+_WORD = re.compile(f'[{LETTERS}]+')
+
+# Более короткие слова не исправляются: у них слишком много соседей
+MIN_WORD_LENGTH = 3
+
+
+def max_distance(word):
+    """Допустимое число правок: в коротком слове одна, в длинном две"""
+    return 1 if len(word) <= 5 else 2
+
+
+def correct_query(query, reader, suggester, budget=0.005):
+    """
+    Исправленный запрос: {'query': текст, 'corrections': [{'term', 'correction',
+    'distance', 'df'}]}; None, если исправлять нечего или ничего не нашлось.
+    Операторы и слова, которые есть в индексе, остаются как были.
+    """
+    if suggester is None or budget <= 0:
+        return None
+
+    corrections = {}
+    for word in _WORD.findall(query):
+        word = word.lower()
+        if word in corrections or len(word) < MIN_WORD_LENGTH:
+            continue
+        key = term_key(word)
+        if key is None or reader.find(key) >= 0:
+            continue
+        found = suggester.similar(word, max_distance(word), limit=1,
+                                  deadline=time.perf_counter() + budget)
+        corrections[word] = found[0] if found else None
+
+    corrections = {word: found for word, found in corrections.items() if found}
+    if not corrections:
+        return None
+
+    def replace(match):
+        found = corrections.get(match.group().lower())
+        return found[0] if found else match.group()
+
+    return {'query': _WORD.sub(replace, query),
+            'corrections': [{'term': word, 'correction': correction,
+                             'distance': distance, 'df': df}
+                            for word, (correction, df, distance) in corrections.items()]}
@@ -0,0 +1,97 @@
+"""
+Стеммер, совпадающий с C++ Stemmer (engine/src/stemmer.cpp).
+
+Индекс хранит основы, полученные C++ стеммером, поэтому для поиска
+по ним из Python правила должны совпадать до байта: длины в C++
+считаются в байтах UTF-8, кроме проверок char_count().
+"""
+
+_RUSSIAN_ENDINGS = [
+    # Длинные окончания сначала
+    'ивший', 'ывший', 'ующий', 'ающий',
+    'ённый', 'анный', 'енный',
+    'ость', 'ести', 'ости',
+    'ами', 'ями', 'ому', 'ему',
+    'ого', 'его', 'ых', 'их',
+    'ать', 'ять', 'еть', 'ить',
+    'ал', 'ял', 'ел', 'ил',
+    'ет', 'ит', 'ат', 'ят',
+    'ой', 'ый', 'ий', 'ая', 'яя',
+    'ов', 'ев', 'ей',
+    'ам', 'ям', 'ом', 'ем',
+    'ах', 'ях', 'ую', 'юю',
+    'ть', 'ся',
+    'а', 'я', 'о', 'е', 'и', 'ы', 'у', 'ю',
+]
+
+_ENGLISH_SUFFIXES = [
+    b'ational', b'ization', b'fulness', b'ousness', b'iveness',
+    b'ation', b'ness', b'ment', b'able', b'ible', b'ence', b'ance',
+    b'ful', b'ous', b'ive', b'ize', b'ise', b'ant', b'ent',
+    b'al', b'er', b'or', b'ly',
+]
+
+
+def _is_cyrillic(word):
+    return 'А' <= word[0] <= 'я' or word[0] in 'Ёё'
+
+
+def stem(word):
+    """Получить основу слова (в нижнем регистре)"""
+    if not word:
+        return word
+    if _is_cyrillic(word):
+        return _stem_russian(word)
+    return _stem_english(word)
+
+
+def _stem_russian(word):
+    if len(word.encode('utf-8')) < 4:
+        return word
+
+    for ending in _RUSSIAN_ENDINGS:
+        if word.endswith(ending) and len(word) > len(ending) + 1:
+            return word[:-len(ending)]
+    return word
+
+
+def _stem_english(word):
+    result = word.encode('utf-8')
+    if len(result) < 3:
+        return word
+
+    # Шаг 1: -s, -es
+    if result.endswith(b'sses'):
+        result = result[:-2]
+    elif result.endswith(b'ies'):
+        result = result[:-3] + b'i'
+    elif result.endswith(b'ss'):
+        pass
+    elif result.endswith(b's') and len(result) > 3:
+        result = result[:-1]
+
+    # Шаг 2: -ed, -ing
+    if result.endswith(b'eed'):
+        if len(result) > 4:
+            result = result[:-2]
+    elif result.endswith(b'ed') and len(result) > 4:
+        result = result[:-2]
+        if len(result) >= 2 and result[-1] == result[-2]:
+            result = result[:-1]
+    elif result.endswith(b'ing') and len(result) > 5:
+        result = result[:-3]
+        if len(result) >= 2 and result[-1] == result[-2]:
+            result = result[:-1]
+
+    # Шаг 3: -y -> -i
+    if result.endswith(b'y') and len(result) > 2:
+        if result[-2:-1] not in (b'a', b'e', b'i', b'o', b'u'):
+            result = result[:-1] + b'i'
+
+    # Шаг 4: суффиксы
+    for suffix in _ENGLISH_SUFFIXES:
+        if result.endswith(suffix) and len(result) > len(suffix) + 2:
+            result = result[:-len(suffix)]
+            break
+
+    return result.decode('utf-8', errors='surrogateescape')
@@ -0,0 +1,262 @@
+#!/usr/bin/env python3
+"""
+Автодополнение по словарю подсказок index.suggest (indexer --suggest).
+
+Словоформы отсортированы побайтово, поэтому все продолжения префикса -
+непрерывный отрезок [lo, hi), который находят два двоичных поиска.
+Лучшие k по числу документов выбираются деревом отрезков из файла:
+максимум отрезка - O(log V), следующий кандидат - максимум одной из двух
+частей, на которые его делит уже выданная словоформа (куча на k элементов).
+Файл открыт через mmap: страницы общие для всех воркеров, в памяти процесса
+только сам объект.
+
+Для исправления опечаток (версия 2) в файле есть триграммы словоформ:
+кандидаты - словоформы с достаточным числом общих триграмм, из них
+остаются те, что в пределах заданного расстояния Левенштейна.
+
+Использование:
+    python suggest.py ../data/index.suggest леч [limit]
+    python suggest.py ../data/index.suggest --similar диабэт [limit]
+"""
+
+import heapq
+import mmap
+import struct
+import sys
+import time
+
+import numpy
+
+MAGIC = 0x4755534D  # "MSUG"
+VERSION = 3
+# Версия 1 - без триграмм: подсказки работают, исправление опечаток нет;
+# версии 1 и 2 - без идентификатора сборки индекса (build_id = 0)
+SUPPORTED_VERSIONS = (1, 2, 3)
+
+_HEADER = struct.Struct('<IIIIII')
+_BUILD_ID = struct.Struct('<Q')
+_GRAM_HEADER = struct.Struct('<II')
+
+# Сколько кандидатов с наибольшим числом общих триграмм проверять расстоянием
+SIMILAR_CANDIDATES = 200
+
+# Для префикса p: все его продолжения меньше p + b'\xff' (в UTF-8 нет байта 0xFF)
+_AFTER_PREFIX = b'\xff'
+
+
+class SuggestFormatError(ValueError):
+    """Файл не является словарём подсказок поддерживаемой версии"""
+
+
+def trigrams(word):
+    """Триграммы словоформы, как в Indexer::save_suggest_file (word_trigrams)"""
+    points = [0] + [ord(c) for c in word] + [0]
+    return sorted({(points[i] << 42) | (points[i + 1] << 21) | points[i + 2]
+                   for i in range(len(points) - 2)})
+
+
+def bounded_distance(a, b, limit):
+    """Расстояние Левенштейна между a и b или limit + 1, если оно больше limit"""
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    previous = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        current = [i]
+        for j, cb in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1,
+                               previous[j - 1] + (ca != cb)))
+        # Строка DP не убывает вниз: если весь ряд больше limit, дальше не лучше
+        if min(current) > limit:
+            return limit + 1
+        previous = current
+    return min(previous[-1], limit + 1)
+
+
+class Suggester:
+    """Словарь подсказок, открытый через mmap"""
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        if len(self.mm) < _HEADER.size:
+            self.mm.close()
+            raise SuggestFormatError(f'Слишком короткий файл: {path}')
+
+        magic, version, self.num_words, self.leaves, self.num_docs, _ = \
+            _HEADER.unpack_from(self.mm, 0)
+        if magic != MAGIC or version not in SUPPORTED_VERSIONS:
+            self.mm.close()
+            raise SuggestFormatError(f'Неверный формат словаря подсказок: {path}')
+
+        self.build_id = 0
+        position = _HEADER.size
+        if version >= 3:
+            self.build_id, = _BUILD_ID.unpack_from(self.mm, position)
+            position += _BUILD_ID.size
+
+        view = memoryview(self.mm)
+        self.offsets = view[position:position + 4 * (self.num_words + 1)].cast('I')
+        position += 4 * (self.num_words + 1)
+        self.dfs = view[position:position + 4 * self.num_words].cast('I')
+        position += 4 * self.num_words
+        self.tree = view[position:position + 8 * self.leaves].cast('I')
+        self.strings = position + 8 * self.leaves
+
+        self.grams = None
+        if version >= 2:
+            position = self.strings + self.offsets[self.num_words]
+            position += -position % 8
+            num_grams, num_postings = _GRAM_HEADER.unpack_from(self.mm, position)
+            position += _GRAM_HEADER.size
+            self.grams = numpy.frombuffer(self.mm, dtype='<u8', count=num_grams, offset=position)
+            position += 8 * num_grams
+            self.gram_offsets = numpy.frombuffer(self.mm, dtype='<u4', count=num_grams + 1,
+                                                 offset=position)
+            position += 4 * (num_grams + 1)
+            self.gram_postings = numpy.frombuffer(self.mm, dtype='<u4', count=num_postings,
+                                                  offset=position)
+        view.release()
+
+    def __len__(self):
+        return self.num_words
+
+    def word_bytes(self, index):
+        start = self.strings + self.offsets[index]
+        return self.mm[start:self.strings + self.offsets[index + 1]]
+
+    def lower_bound(self, key):
+        """Номер первой словоформы >= key (побайтово)"""
+        lo, hi = 0, self.num_words
+        while lo < hi:
+            middle = (lo + hi) // 2
+            if self.word_bytes(middle) < key:
+                lo = middle + 1
+            else:
+                hi = middle
+        return lo
+
+    def prefix_range(self, prefix):
+        """Отрезок [lo, hi) словоформ, начинающихся с prefix"""
+        key = prefix.encode('utf-8')
+        lo = self.lower_bound(key)
+        return lo, (self.lower_bound(key + _AFTER_PREFIX) if key else self.num_words)
+
+    def _better(self, a, b):
+        # При равном df дерево хранит словоформу с меньшим номером
+        if a < 0:
+            return b
+        if self.dfs[b] > self.dfs[a] or (self.dfs[b] == self.dfs[a] and b < a):
+            return b
+        return a
+
+    def range_max(self, lo, hi):
+        """Номер словоформы с наибольшим df на [lo, hi) (lo < hi)"""
+        best = -1
+        lo += self.leaves
+        hi += self.leaves
+        while lo < hi:
+            if lo & 1:
+                best = self._better(best, self.tree[lo])
+                lo += 1
+            if hi & 1:
+                hi -= 1
+                best = self._better(best, self.tree[hi])
+            lo >>= 1
+            hi >>= 1
+        return best
+
+    def suggest(self, prefix, limit=10):
+        """[(словоформа, df)] с префиксом prefix, по убыванию df"""
+        lo, hi = self.prefix_range(prefix)
+        if lo >= hi or limit <= 0:
+            return []
+
+        heap = []
+
+        def push(lo, hi):
+            if lo < hi:
+                best = self.range_max(lo, hi)
+                heapq.heappush(heap, (-self.dfs[best], best, lo, hi))
+
+        push(lo, hi)
+        result = []
+        while heap and len(result) < limit:
+            _, best, lo, hi = heapq.heappop(heap)
+            result.append((self.word_bytes(best).decode('utf-8', errors='replace'),
+                           self.dfs[best]))
+            push(lo, best)
+            push(best + 1, hi)
+        return result
+
+    def similar(self, word, max_distance=2, limit=5, deadline=None):
+        """
+        [(словоформа, df, расстояние)] в пределах max_distance от word,
+        по возрастанию расстояния, затем по убыванию df. Сама word не входит.
+
+        Кандидаты - словоформы с общими триграммами: правка меняет не больше
+        трёх триграмм, поэтому у близкой словоформы их не меньше
+        len(word) - 3 * max_distance. Проверяются SIMILAR_CANDIDATES лучших по
+        числу общих триграмм; после deadline (time.perf_counter) проверка
+        прекращается и возвращается найденное.
+        """
+        if self.grams is None or not len(self.grams) or not word:
+            return []
+
+        keys = numpy.array(trigrams(word), dtype=numpy.uint64)
+        found = numpy.minimum(numpy.searchsorted(self.grams, keys), len(self.grams) - 1)
+        lists = [self.gram_postings[self.gram_offsets[g]:self.gram_offsets[g + 1]]
+                 for g in found[self.grams[found] == keys].tolist()]
+        if not lists:
+            return []
+
+        candidates, shared = numpy.unique(numpy.concatenate(lists), return_counts=True)
+        keep = shared >= max(len(word) - 3 * max_distance, 1)
+        candidates, shared = candidates[keep], shared[keep]
+        if len(candidates) > SIMILAR_CANDIDATES:
+            best = numpy.argpartition(-shared, SIMILAR_CANDIDATES)[:SIMILAR_CANDIDATES]
+            candidates, shared = candidates[best], shared[best]
+        order = numpy.argsort(-shared, kind='stable')
+
+        result = []
+        for index in candidates[order].tolist():
+            if deadline is not None and time.perf_counter() > deadline:
+                break
+            candidate = self.word_bytes(index).decode('utf-8', errors='replace')
+            if candidate == word:
+                continue
+            distance = bounded_distance(word, candidate, max_distance)
+            if distance <= max_distance:
+                result.append((candidate, self.dfs[index], distance))
+
+        result.sort(key=lambda item: (item[2], -item[1], item[0]))
+        return result[:limit]
+
+    def close(self):
+        self.grams = self.gram_offsets = self.gram_postings = None
+        self.offsets.release()
+        self.dfs.release()
+        self.tree.release()
+        self.mm.close()
+
+
+def main():
+    if len(sys.argv) < 3:
+        print('Использование: python suggest.py index.suggest [--similar] слово [limit]')
+        sys.exit(1)
+
+    suggester = Suggester(sys.argv[1])
+    if sys.argv[2] == '--similar' and len(sys.argv) > 3:
+        limit = int(sys.argv[4]) if len(sys.argv) > 4 else 10
+        for word, df, distance in suggester.similar(sys.argv[3].lower(), limit=limit):
+            print(f'{word:<30} {df:<10} {distance}')
+    else:
+        limit = int(sys.argv[3]) if len(sys.argv) > 3 else 10
+        for word, df in suggester.suggest(sys.argv[2].lower(), limit):
+            print(f'{word:<30} {df}')
+    suggester.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,19 @@
+"""
+Токенизатор, совпадающий с C++ Tokenizer (engine/src/tokenizer.cpp).
+
+Буквы - латиница и кириллица (А-я, Ё, ё), всё остальное - разделители.
+Токены приводятся к нижнему регистру.
+"""
+
+import re
+
+# Символы, из которых состоят токены (для классов символов в регулярных выражениях)
+LETTERS = 'A-Za-zА-яЁё'
+
+_TOKEN_RE = re.compile(f'[{LETTERS}]+')
+
+
+def tokenize(text):
+    """Разбить текст на токены в нижнем регистре"""
+    return [token.lower() for token in _TOKEN_RE.findall(text)]
+
@@ -0,0 +1,227 @@
+"""
+Журнал частых запросов и прогрев кэша результатов по нему.
+
+Журнал - таблица SQLite, общая для всех воркеров: ключ результата
+(нормализованный запрос и порядок выдачи), один из исходных текстов
+запроса и счётчик. Обращения копятся в памяти и раз в flush_interval
+секунд дописываются одной транзакцией из фонового потока, поэтому запись
+в журнал не задерживает ответ. Журнал скользящий: раз в half_life секунд
+все счётчики уменьшаются вдвое, редкие запросы удаляются, размер
+ограничен max_entries записями.
+
+После загрузки версии индекса (при старте сервиса или перед заменой
+версии) Warmer выполняет top_n самых частых запросов журнала не больше
+чем concurrency одновременно - их результаты оказываются в кэше до того,
+как на новую версию придут запросы.
+"""
+
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# Записи со счётчиком меньше этого после уменьшения вдвое удаляются
+_MIN_COUNT = 0.5
+
+
+class QueryLog:
+    """
+    Скользящий журнал частот запросов.
+
+    path           - файл SQLite
+    max_entries    - максимум запросов в журнале
+    half_life      - через сколько секунд счётчики уменьшаются вдвое
+    flush_interval - как часто накопленные обращения пишутся в файл
+    """
+
+    def __init__(self, path, max_entries=10000, half_life=6 * 3600, flush_interval=5.0):
+        self.path = path
+        self.max_entries = max_entries
+        self.half_life = half_life
+        self.flush_interval = flush_interval
+        self.local = threading.local()
+
+        self.pending = {}
+        self.lock = threading.Lock()
+        self.thread = None
+        self.errors = 0
+
+        connection = self._connection()
+        with connection:
+            connection.execute('''
+                CREATE TABLE IF NOT EXISTS queries (
+                    key TEXT PRIMARY KEY,
+                    query TEXT NOT NULL,
+                    rank TEXT NOT NULL,
+                    count REAL NOT NULL,
+                    seen REAL NOT NULL
+                )''')
+            connection.execute(
+                'CREATE INDEX IF NOT EXISTS queries_count ON queries (count)')
+            connection.execute('''
+                CREATE TABLE IF NOT EXISTS meta (
+                    name TEXT PRIMARY KEY,
+                    value REAL NOT NULL
+                )''')
+
+    def _connection(self):
+        """Соединение SQLite нельзя делить между потоками - своё на каждый"""
+        connection = getattr(self.local, 'connection', None)
+        if connection is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            connection = sqlite3.connect(self.path, timeout=0.5)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            self.local.connection = connection
+        return connection
+
+    def record(self, key, query, rank):
+        """Учесть запрос (только в памяти; в файл - из фонового потока)"""
+        with self.lock:
+            entry = self.pending.get(key)
+            self.pending[key] = (query, rank, entry[2] + 1 if entry else 1)
+            if self.thread is None:
+                # Поток запускается при первом запросе - уже после fork воркера
+                self.thread = threading.Thread(target=self._run, name='query-log', daemon=True)
+                self.thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.flush_interval)
+            self.flush()
+
+    def flush(self):
+        """Записать накопленные обращения, уменьшить старые счётчики, обрезать журнал"""
+        with self.lock:
+            pending, self.pending = self.pending, {}
+
+        now = time.time()
+        try:
+            connection = self._connection()
+            with connection:
+                if pending:
+                    connection.executemany(
+                        'INSERT INTO queries (key, query, rank, count, seen) VALUES (?, ?, ?, ?, ?) '
+                        'ON CONFLICT (key) DO UPDATE SET count = count + excluded.count, '
+                        'query = excluded.query, seen = excluded.seen',
+                        [(key, query, rank, count, now)
+                         for key, (query, rank, count) in pending.items()])
+
+                row = connection.execute(
+                    "SELECT value FROM meta WHERE name = 'decayed'").fetchone()
+                if row is None:
+                    connection.execute(
+                        "INSERT INTO meta (name, value) VALUES ('decayed', ?)", (now,))
+                elif now - row[0] >= self.half_life:
+                    connection.execute('UPDATE queries SET count = count / 2')
+                    connection.execute('DELETE FROM queries WHERE count < ?', (_MIN_COUNT,))
+                    connection.execute(
+                        "UPDATE meta SET value = ? WHERE name = 'decayed'", (now,))
+
+                excess = connection.execute(
+                    'SELECT COUNT(*) FROM queries').fetchone()[0] - self.max_entries
+                if excess > 0:
+                    connection.execute(
+                        'DELETE FROM queries WHERE key IN '
+                        '(SELECT key FROM queries ORDER BY count, seen LIMIT ?)', (excess,))
+        except sqlite3.Error:
+            with self.lock:
+                self.errors += 1
+
+    def top(self, n):
+        """[(запрос, порядок выдачи)] - n самых частых запросов"""
+        self.flush()
+        try:
+            return self._connection().execute(
+                'SELECT query, rank FROM queries ORDER BY count DESC, seen DESC LIMIT ?',
+                (n,)).fetchall()
+        except sqlite3.Error:
+            with self.lock:
+                self.errors += 1
+            return []
+
+
+class Warmer:
+    """
+    Прогрев кэша результатов для версии индекса.
+
+    run(version, query, rank) - вычислить запрос и сохранить в кэш;
+        True - вычислен, False - уже был в кэше
+    top_n       - сколько самых частых запросов журнала выполнить
+    concurrency - сколько запросов выполнять одновременно
+    max_seconds - после этого времени оставшиеся запросы пропускаются
+    """
+
+    def __init__(self, log, run, top_n=200, concurrency=2, max_seconds=60.0):
+        self.log = log
+        self.run = run
+        self.top_n = top_n
+        self.concurrency = concurrency
+        self.max_seconds = max_seconds
+
+        self.lock = threading.Lock()
+        self.state = {'state': 'idle', 'generation': None, 'total': 0, 'done': 0,
+                      'computed': 0, 'failed': 0, 'skipped': 0, 'seconds': 0.0}
+        self.runs = 0
+
+    def progress(self):
+        with self.lock:
+            return dict(self.state)
+
+    def running(self, generation):
+        """Идёт ли прогрев указанного поколения индекса"""
+        with self.lock:
+            return self.state['state'] == 'running' and self.state['generation'] == generation
+
+    def start(self, version):
+        """Прогреть версию в фоновом потоке"""
+        with self.lock:
+            self._reset(version, 'running')
+        threading.Thread(target=self.warm, args=(version, False),
+                         name='cache-warmup', daemon=True).start()
+
+    def warm(self, version, reset=True):
+        """Выполнить частые запросы для версии (блокирует до завершения)"""
+        started = time.monotonic()
+        if reset:
+            with self.lock:
+                self._reset(version, 'running')
+
+        queries = self.log.top(self.top_n) if self.top_n > 0 else []
+        deadline = started + self.max_seconds
+        with self.lock:
+            self.state['total'] = len(queries)
+
+        def warm_one(entry):
+            if time.monotonic() > deadline:
+                self._count('skipped')
+                return
+            try:
+                computed = self.run(version, *entry)
+            except Exception:
+                self._count('failed')
+            else:
+                if computed:
+                    self._count('computed')
+            self._count('done')
+
+        if queries:
+            with ThreadPoolExecutor(max_workers=max(self.concurrency, 1),
+                                    thread_name_prefix='cache-warmup') as executor:
+                list(executor.map(warm_one, queries))
+
+        with self.lock:
+            self.state['state'] = 'done'
+            self.state['seconds'] = round(time.monotonic() - started, 3)
+            self.runs += 1
+
+    def _reset(self, version, state):
+        self.state = {'state': state, 'generation': version.generation, 'total': 0, 'done': 0,
+                      'computed': 0, 'failed': 0, 'skipped': 0, 'seconds': 0.0}
+
+    def _count(self, name, value=1):
+        with self.lock:
+            self.state[name] += value